@@ -1,7 +1,8 @@
 import logging, json, os
 import azure.functions as func
 from azure.storage.queue import QueueClient, BinaryBase64EncodePolicy
-from utilities.azureblobstorage import get_all_files
+from utilities.azureblobstorage import get_all_files, CATALOG_SYNC_INTERVAL
+from utilities.tracing import setup_tracing, traced
 
 account_name = os.environ['BLOB_ACCOUNT_NAME']
 account_key = os.environ['BLOB_ACCOUNT_KEY']
@@ -9,10 +10,16 @@ connect_str = f"DefaultEndpointsProtocol=https;AccountName={account_name};Accoun
 container_name = os.environ['BLOB_CONTAINER_NAME']
 queue_name = os.environ['QUEUE_NAME']
 
+setup_tracing("qna-batch")
+
+@traced("function.BatchStartProcessing")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Requested to start processing all documents received')
-    files_data = get_all_files()
-    files_data = list(filter(lambda x : not x['embeddings_added'], files_data))
+    # Pending documents come from the blob catalogue. Uploads through the app update it at once;
+    # the container is only walked again when the catalogue is missing or older than CATALOG_SYNC_INTERVAL,
+    # or when the caller asks for it with ?resync=true
+    max_age = 0 if req.params.get('resync', '').lower() == 'true' else CATALOG_SYNC_INTERVAL
+    files_data = get_all_files(max_age=max_age, embeddings_added=False)
     files_data = list(map(lambda x: {'filename': x['filename']}, files_data))
     # Create the QueueClient object
     queue_client = QueueClient.from_connection_string(connect_str, queue_name, message_encode_policy=BinaryBase64EncodePolicy())
@@ -4,11 +4,14 @@ load_dotenv()
 import streamlit as st
 from urllib.error import URLError
 import pandas as pd
-from utilities import utils  # Eliminado translator ya que no se usará
+from utilities import utils, webcache  # Eliminado translator ya que no se usará
+from utilities.tracing import setup_tracing
 import os
 
-# Inicialización sin necesidad de DataFrame
-utils.initialize(engine='gpt-35-turbo-instruct')  # CAMBIO 1
+setup_tracing("qna-webapp")
+
+# Inicialización una sola vez por proceso, compartida entre sesiones
+webcache.initialize(engine='gpt-35-turbo-instruct')
 
 try:
     default_prompt = "" 
@@ -0,0 +1,257 @@
+"""
+HTTP API for search, QnA and ingestion, for programmatic clients such as the bot.
+
+Stateless, so any number of replicas can sit behind a load balancer. It reuses
+utilities.utils and utilities.redisembeddings, so answers match the web app.
+Run it with several worker processes:
+
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints (JSON bodies):
+
+- POST /search  {"question": ..., "k": 3} or {"questions": [...], "k": 3}
+- POST /answer  {"question": ..., "prompt", "model", "max_tokens", "temperature", "stream"}
+                With "stream": true the answer is sent as server-sent events.
+                "model" must be one of the deployments in API_ALLOWED_MODELS.
+- POST /ingest  {"text": ..., "filename": ...} or {"blob": <blob name>}
+                or {"url": <URL of a blob in BLOB_CONTAINER_NAME>}
+- GET  /healthz liveness, GET /readyz Redis and OpenAI readiness
+
+/search, /answer and /ingest need the key in API_KEY, sent as `Authorization: Bearer <key>`
+or `X-API-Key: <key>`; without API_KEY they answer 401. /ingest only reads documents from
+the configured blob container, with a SAS built here, and records them in the blob
+catalogue like the web app does. Named texts are stored there as .txt blobs.
+
+The handlers call the blocking utilities in a thread pool of API_THREADS threads
+per worker. Redis and OpenAI connections are pooled and kept alive per worker:
+the Redis client has a connection pool, and the openai SDK keeps one requests
+session per thread.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import functools
+import hmac
+import json
+import logging
+import os
+
+import anyio
+from redis.exceptions import RedisError
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from utilities import utils, redisembeddings, azureblobstorage
+from utilities.tracing import setup_tracing
+
+logger = logging.getLogger(__name__)
+
+API_THREADS = int(os.getenv('API_THREADS', 40))
+API_MAX_BATCH = int(os.getenv('API_MAX_BATCH', 100))
+# Key clients send in the Authorization (Bearer) or X-API-Key header
+API_KEY = os.getenv('API_KEY')
+DEFAULT_MODEL = os.getenv('API_COMPLETION_MODEL', 'gpt-35-turbo-instruct')
+# Deployments clients may name in /answer; the default one is always allowed
+ALLOWED_MODELS = {DEFAULT_MODEL} | {m.strip() for m in os.getenv('API_ALLOWED_MODELS', '').split(',') if m.strip()}
+DEFAULT_PROMPT = os.getenv("INDICACIÓN_DE_PREGUNTA",
+    "Por favor, responde a la pregunta utilizando únicamente la información presente en el texto anterior. "
+    "Si no puedes encontrarla, responde 'No está en el texto'.\nPregunta: _QUESTION_\nRespuesta:").replace(r'\n', '\n')
+
+class BadRequest(Exception):
+    pass
+
+class Unauthorized(Exception):
+    pass
+
+def _request_key(request):
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return request.headers.get("x-api-key")
+
+def protected(handler):
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if not API_KEY:
+            raise Unauthorized("API_KEY is not configured on the server")
+        key = _request_key(request)
+        if not key or not hmac.compare_digest(key.encode('utf-8'), API_KEY.encode('utf-8')):
+            raise Unauthorized("Missing or invalid API key")
+        return await handler(request)
+    return wrapper
+
+async def _body(request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise BadRequest("Body must be JSON")
+    if not isinstance(body, dict):
+        raise BadRequest("Body must be a JSON object")
+    return body
+
+def _int(body, key, default, low, high):
+    try:
+        value = int(body.get(key, default))
+    except (TypeError, ValueError):
+        raise BadRequest(f"{key} must be an integer")
+    if not low <= value <= high:
+        raise BadRequest(f"{key} must be between {low} and {high}")
+    return value
+
+def _float(body, key, default, low, high):
+    try:
+        value = float(body.get(key, default))
+    except (TypeError, ValueError):
+        raise BadRequest(f"{key} must be a number")
+    if not low <= value <= high:
+        raise BadRequest(f"{key} must be between {low} and {high}")
+    return value
+
+def _model(body):
+    model = body.get("model") or DEFAULT_MODEL
+    if model not in ALLOWED_MODELS:
+        raise BadRequest(f"model must be one of {', '.join(sorted(ALLOWED_MODELS))}")
+    return model
+
+def _search_response(res):
+    return {"results": res.to_dicts(), "error": res.error}
+
+@protected
+async def search(request):
+    body = await _body(request)
+    k = _int(body, "k", 3, 1, 50)
+    options = {"language_mode": body.get("language_mode"), "ef_runtime": body.get("ef_runtime")}
+    if "questions" in body:
+        questions = body["questions"]
+        if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions) or len(questions) > API_MAX_BATCH:
+            raise BadRequest(f"questions must be a list of at most {API_MAX_BATCH} strings")
+        results = await run_in_threadpool(utils.search_semantic_redis_batch, questions, k, **options)
+        return JSONResponse({"searches": [_search_response(res) for res in results]})
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise BadRequest("question is required")
+    res = await run_in_threadpool(utils.search_semantic_redis, question, k, False, **options)
+    return JSONResponse(_search_response(res))
+
+@protected
+async def answer(request):
+    body = await _body(request)
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise BadRequest("question is required")
+    options = {
+        "explicit_prompt": body.get("prompt") or DEFAULT_PROMPT,
+        "model": _model(body),
+        "tokens_response": _int(body, "max_tokens", 400, 1, 4000),
+        "temperature": _float(body, "temperature", 0.0, 0.0, 2.0),
+    }
+    if body.get("stream"):
+        prompt, sources, fragments = await run_in_threadpool(utils.stream_semantic_answer, question, **options)
+
+        async def events():
+            yield f"data: {json.dumps({'sources': sources})}\n\n"
+            async for fragment in iterate_in_threadpool(fragments):
+                yield f"data: {json.dumps({'text': fragment})}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    prompt, response, sources = await run_in_threadpool(utils.get_semantic_answer, question, **options)
+    if response is None:
+        return JSONResponse({"error": "Empty response from OpenAI"}, status_code=502)
+    return JSONResponse({"answer": response["choices"][0]["text"].strip(), "sources": sources, "usage": response.get("usage")})
+
+def _ingest_blob(name):
+    # Documents are read from our own container only, with a SAS built here
+    blob_client = azureblobstorage.get_blob_service_client().get_blob_client(container=os.environ['BLOB_CONTAINER_NAME'], blob=name)
+    if not blob_client.exists():
+        raise BadRequest(f"Blob {name} does not exist")
+    stored = utils.convert_file_and_add_embeddings(azureblobstorage.get_blob_sas_url(name), name)
+    if stored:
+        azureblobstorage.upsert_blob_metadata(name, {"embeddings_added": "true"})
+    return stored
+
+def _ingest_text(text, filename):
+    if not filename:
+        return utils.add_embeddings(text, filename)
+    # Named texts are kept as .txt blobs, as the web app does, so they are listed with the other documents
+    if not filename.endswith('.txt'):
+        filename += '.txt'
+    azureblobstorage.upload_file(text.encode('utf-8'), filename, content_type='text/plain')
+    stored = utils.add_embeddings(text, filename)
+    if stored:
+        azureblobstorage.upsert_blob_metadata(filename, {"embeddings_added": "true"})
+    return stored
+
+@protected
+async def ingest(request):
+    body = await _body(request)
+    filename = body.get("filename") or ""
+    if body.get("url"):
+        name = await run_in_threadpool(azureblobstorage.blob_name_from_url, body["url"])
+        if name is None:
+            raise BadRequest(f"url must point to a blob in container {os.environ['BLOB_CONTAINER_NAME']}")
+        stored = await run_in_threadpool(_ingest_blob, name)
+    elif body.get("blob"):
+        if not isinstance(body["blob"], str) or body["blob"].startswith('converted/'):
+            raise BadRequest("blob must be the name of a document blob")
+        stored = await run_in_threadpool(_ingest_blob, body["blob"])
+    elif body.get("text"):
+        if not isinstance(body["text"], str) or not isinstance(filename, str):
+            raise BadRequest("text and filename must be strings")
+        stored = await run_in_threadpool(_ingest_text, body["text"], filename)
+    else:
+        raise BadRequest("text, blob or url is required")
+    return JSONResponse({"stored": bool(stored)}, status_code=200 if stored else 500)
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+async def readyz(request):
+    checks = {}
+    try:
+        await run_in_threadpool(redisembeddings.get_redis_conn().ping)
+        # Creates the indexes if Redis was not reachable at startup
+        await run_in_threadpool(redisembeddings.ensure_indexes)
+        checks["redis"] = True
+    except RedisError as e:
+        checks["redis"] = False
+        logger.warning(f"Redis not ready: {e}")
+    # Updated in the background by utils.initialize(); None until the first probe
+    checks["openai"] = utils.get_health_state()["healthy"] is not False
+    return JSONResponse({"ready": all(checks.values()), "checks": checks}, status_code=200 if all(checks.values()) else 503)
+
+async def bad_request(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+async def unauthorized(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
+
+async def server_error(request, exc):
+    logger.error(f"{request.method} {request.url.path} failed: {exc}")
+    return JSONResponse({"error": str(exc)}, status_code=500)
+
+def startup():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+    setup_tracing("qna-api")
+    if not API_KEY:
+        logger.warning("API_KEY is not set: /search, /answer and /ingest will refuse every request")
+    utils.initialize(engine=DEFAULT_MODEL)
+    try:
+        redisembeddings.ensure_indexes()
+    except RedisError as e:
+        # /readyz reports it until Redis is reachable
+        logger.warning(f"Redis not available at startup: {e}")
+
+app = Starlette(
+    routes=[
+        Route("/search", search, methods=["POST"]),
+        Route("/answer", answer, methods=["POST"]),
+        Route("/ingest", ingest, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/readyz", readyz, methods=["GET"]),
+    ],
+    exception_handlers={BadRequest: bad_request, Unauthorized: unauthorized, 500: server_error},
+    on_startup=[startup],
+)
@@ -0,0 +1,105 @@
+"""
+Load test for the HTTP API (api.py).
+
+Sends --requests requests from --concurrency threads to a running API. Each
+thread keeps one HTTP session alive, like a pooled bot client. Questions come
+from the synthetic corpus (benchmarks/corpus.py). It reports requests/sec,
+latency percentiles and errors per endpoint.
+
+    uvicorn api:app --port 8000 --workers 4 &
+    python -m benchmarks.api_load --url http://localhost:8000 --endpoint search --requests 5000 --concurrency 50
+    python -m benchmarks.api_load --url http://localhost:8000 --endpoint answer --stream --requests 500
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.corpus import make_corpus, make_questions
+from benchmarks.e2e import RESULTS_DIR, git_commit, percentiles
+
+_local = threading.local()
+
+API_KEY = os.getenv('API_KEY')
+
+def session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+        if API_KEY:
+            _local.session.headers["Authorization"] = f"Bearer {API_KEY}"
+    return _local.session
+
+def call(url, endpoint, question, k, stream):
+    body = {"question": question, "k": k} if endpoint == "search" else {"question": question, "stream": stream}
+    start = time.perf_counter()
+    first_byte = None
+    try:
+        with session().post(f"{url}/{endpoint}", json=body, stream=stream, timeout=120) as response:
+            for _ in response.iter_content(chunk_size=None):
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+            ok = response.status_code == 200
+    except requests.RequestException:
+        ok = False
+    return ok, time.perf_counter() - start, first_byte
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", choices=["search", "answer"], default="search")
+    parser.add_argument("--stream", action="store_true", help="Stream /answer responses and report time to first byte")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/api-load-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    ready = requests.get(f"{args.url}/readyz", timeout=10)
+    if ready.status_code != 200:
+        raise SystemExit(f"API not ready: {ready.text}")
+    documents = make_corpus(max(10, args.requests // 10), seed=args.seed)
+    questions = [item["question"] for item in make_questions(documents, args.requests, seed=args.seed + 1)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(lambda question: call(args.url, args.endpoint, question, args.k, args.stream), questions))
+    seconds = time.perf_counter() - start
+
+    latencies = [latency for ok, latency, _ in outcomes if ok]
+    first_bytes = [first_byte for ok, _, first_byte in outcomes if ok and first_byte is not None]
+    results = {
+        "requests": len(outcomes),
+        "errors": sum(1 for ok, _, _ in outcomes if not ok),
+        "seconds": seconds,
+        "rps": len(outcomes) / seconds,
+        "latency_ms": percentiles(latencies),
+        "first_byte_ms": percentiles(first_bytes),
+    }
+    if not latencies:
+        raise SystemExit(f"All {len(outcomes)} requests failed")
+    print(f"{args.endpoint}: {results['rps']:.1f} req/s, {results['errors']} errors, "
+          f"p50/p95/p99={results['latency_ms']['p50']:.0f}/{results['latency_ms']['p95']:.0f}/{results['latency_ms']['p99']:.0f} ms"
+          + (f", first byte p50={results['first_byte_ms']['p50']:.0f} ms" if args.stream and first_bytes else ""))
+
+    commit = git_commit()
+    report = {
+        "benchmark": "api_load",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"api-load-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
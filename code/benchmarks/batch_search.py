@@ -0,0 +1,99 @@
+"""
+Benchmark for search_semantic_redis_batch against one-at-a-time searches.
+
+Runs N synthetic questions through search_semantic_redis in a loop and through
+search_semantic_redis_batch. It reports wall time, queries/sec and the number of
+embedding requests each path needs, and checks that both return the same chunks.
+Embeddings come from the fake OpenAI server (benchmarks/fake_openai.py), and the
+searches run against redis-stack. --reset loads a synthetic corpus into a fresh
+index first, so point it at a dedicated Redis:
+
+    python -m benchmarks.batch_search --queries 1000 --corpus 1000 --reset
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.corpus import make_corpus, make_questions
+from benchmarks.e2e import RESULTS_DIR, git_commit, indexed_documents, reset_index
+from benchmarks.fake_openai import FakeOpenAI
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Questions per search_semantic_redis_batch call")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--corpus", type=int, default=1000, help="Documents loaded with --reset")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake OpenAI seconds per request")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--redis-address", default=os.getenv("REDIS_ADDRESS", "localhost"))
+    parser.add_argument("--reset", action="store_true", help="Drop the embeddings index and load a synthetic corpus")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/batch-search-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, seed=args.seed).start()
+    os.environ.update(OPENAI_API_BASE=fake.api_base, OPENAI_API_KEY="fake", REDIS_ADDRESS=args.redis_address,
+                      OPENAI_HEALTHCHECK_INTERVAL="86400", QUERY_LANGUAGE_MODE="off")
+    from utilities import utils, redisembeddings
+
+    utils.initialize()
+    redisembeddings.ensure_indexes()
+    documents = make_corpus(args.corpus, seed=args.seed)
+    if args.reset:
+        reset_index(redisembeddings)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda doc: utils.add_embeddings(doc["text"], doc["filename"]), documents))
+    elif not indexed_documents(redisembeddings):
+        sys.exit("The embeddings index is empty. Pass --reset to load a synthetic corpus into a dedicated Redis.")
+    questions = [item["question"] for item in make_questions(documents, args.queries, seed=args.seed + 1)]
+
+    fake.requests.update(embeddings=0)
+    start = time.perf_counter()
+    sequential = [utils.search_semantic_redis(question, n=args.k, pprint=False) for question in questions]
+    sequential_s = time.perf_counter() - start
+    sequential_requests = fake.requests["embeddings"]
+
+    fake.requests.update(embeddings=0)
+    start = time.perf_counter()
+    batched = []
+    for i in range(0, len(questions), args.batch_size):
+        batched += utils.search_semantic_redis_batch(questions[i:i + args.batch_size], n=args.k)
+    batched_s = time.perf_counter() - start
+    batched_requests = fake.requests["embeddings"]
+    fake.stop()
+
+    def ids(res):
+        return [doc.id for doc in res]
+    mismatches = sum(1 for a, b in zip(sequential, batched) if ids(a) != ids(b))
+
+    results = {
+        "sequential": {"seconds": sequential_s, "qps": len(questions) / sequential_s, "embedding_requests": sequential_requests},
+        "batched": {"seconds": batched_s, "qps": len(questions) / batched_s, "embedding_requests": batched_requests},
+        "speedup": sequential_s / batched_s if batched_s else None,
+        "mismatched_queries": mismatches,
+    }
+    print(f"{'path':<12} {'seconds':>8} {'qps':>9} {'embedding requests':>19}")
+    for name in ("sequential", "batched"):
+        print(f"{name:<12} {results[name]['seconds']:>8.2f} {results[name]['qps']:>9.1f} {results[name]['embedding_requests']:>19}")
+    print(f"speedup x{results['speedup']:.1f}, {mismatches} queries with different results")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "batch_search",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"batch-search-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark for document uploads to blob storage (utilities.azureblobstorage), against Azurite.
+
+Uploads --files random files of --size-mb MB each, once per variant:
+
+- sequential:  one file after another, one block at a time (the old batch loop)
+- blocks:      one file after another, --max-concurrency blocks at a time
+- parallel:    upload_files with --workers files and --max-concurrency blocks at a time
+
+Every file is sent from a BytesIO over one shared buffer, so the benchmark
+itself holds a single copy of the data. It reports MB/s, total seconds and
+per-file latency. The blob catalogue is updated in Redis when one is running.
+Otherwise it logs a warning per file.
+
+    python -m benchmarks.blob_upload --files 100 --size-mb 20 --workers 8 --max-concurrency 4
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import time
+
+from benchmarks.e2e import AZURITE_ACCOUNT_KEY, AZURITE_CONNECTION_STRING, RESULTS_DIR, git_commit, percentiles
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=8, help="Files uploaded at the same time in the parallel variant")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Blocks per file uploaded at the same time")
+    parser.add_argument("--block-size-mb", type=float, default=8)
+    parser.add_argument("--variant", action="append", choices=["sequential", "blocks", "parallel"], help="Variants to run (default: all)")
+    parser.add_argument("--blob-connection-string", default=AZURITE_CONNECTION_STRING)
+    parser.add_argument("--container", default="benchmark-upload")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/blob-upload-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    os.environ.update(
+        BLOB_CONNECTION_STRING=args.blob_connection_string,
+        BLOB_ACCOUNT_NAME="devstoreaccount1",
+        BLOB_ACCOUNT_KEY=AZURITE_ACCOUNT_KEY,
+        BLOB_CONTAINER_NAME=args.container,
+        BLOB_BLOCK_SIZE=str(int(args.block_size_mb * 2**20)),
+    )
+    from azure.core.exceptions import ResourceExistsError
+    from utilities import azureblobstorage
+
+    container = azureblobstorage.get_blob_service_client().get_container_client(args.container)
+    try:
+        container.create_container()
+    except ResourceExistsError:
+        pass
+
+    size = int(args.size_mb * 2**20)
+    buffer = os.urandom(size)
+    total_mb = args.files * size / 2**20
+    print(f"{args.files} files of {args.size_mb} MB ({total_mb:.0f} MB), blocks of {args.block_size_mb} MB")
+
+    def files(variant):
+        return [(io.BytesIO(buffer), f"{variant}/file-{i:04d}.bin", "application/octet-stream") for i in range(args.files)]
+
+    def one_by_one(variant, max_concurrency):
+        latencies = []
+        for data, name, content_type in files(variant):
+            start = time.perf_counter()
+            azureblobstorage.upload_file(data, name, content_type, max_concurrency=max_concurrency)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def parallel(variant):
+        statuses = azureblobstorage.upload_files(files(variant), workers=args.workers, max_concurrency=args.max_concurrency)
+        failed = [status for status in statuses if status["error"]]
+        if failed:
+            raise RuntimeError(f"{len(failed)} uploads failed, e.g. {failed[0]['error']}")
+        return [status["seconds"] for status in statuses]
+
+    variants = {
+        "sequential": lambda: one_by_one("sequential", 1),
+        "blocks": lambda: one_by_one("blocks", args.max_concurrency),
+        "parallel": lambda: parallel("parallel"),
+    }
+    results = {}
+    print(f"{'variant':<12} {'seconds':>9} {'MB/s':>8} {'file p50 ms':>12} {'file p99 ms':>12}")
+    for name in args.variant or list(variants):
+        start = time.perf_counter()
+        latencies = variants[name]()
+        seconds = time.perf_counter() - start
+        results[name] = {"seconds": seconds, "mb_per_s": total_mb / seconds, "file_ms": percentiles(latencies)}
+        print(f"{name:<12} {seconds:>9.2f} {results[name]['mb_per_s']:>8.1f} {results[name]['file_ms']['p50']:>12.0f} {results[name]['file_ms']['p99']:>12.0f}")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "blob_upload",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"blob-upload-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
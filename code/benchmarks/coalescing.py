@@ -0,0 +1,77 @@
+"""
+Benchmark for request coalescing of identical concurrent embeddings.
+
+Simulates a spike: --users threads start together and each embeds one of
+--questions distinct questions, so every question is asked by users/questions
+threads at once. It runs the spike with and without single flight against the
+fake OpenAI server (benchmarks/fake_openai.py) and reports the embedding
+requests sent upstream and the wall time. No Redis is needed:
+
+    python -m benchmarks.coalescing --users 200 --questions 10 --latency 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+
+from benchmarks.e2e import RESULTS_DIR, git_commit, percentiles
+from benchmarks.fake_openai import FakeOpenAI
+
+def spike(utils, questions, users):
+    barrier = threading.Barrier(users)
+    latencies = []
+    def ask(question):
+        barrier.wait()
+        start = time.perf_counter()
+        utils.get_embedding(question, engine=utils.get_embeddings_model()['query'])
+        latencies.append(time.perf_counter() - start)
+    threads = [threading.Thread(target=ask, args=(questions[i % len(questions)],)) for i in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Concurrent requests in the spike")
+    parser.add_argument("--questions", type=int, default=10, help="Distinct questions among them")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake OpenAI seconds per request")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/coalescing-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency).start()
+    os.environ.update(OPENAI_API_BASE=fake.api_base, OPENAI_API_KEY="fake", OPENAI_HEALTHCHECK_INTERVAL="86400")
+    from utilities import utils
+
+    utils.initialize()
+    questions = [f"¿Cuál es el horario de la actividad número {i} de la parroquia?" for i in range(args.questions)]
+    results = {}
+    print(f"{'path':<12} {'requests':>9} {'seconds':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, enabled in (("direct", False), ("coalesced", True)):
+        utils._embedding_flight.enabled = enabled
+        fake.requests.update(embeddings=0)
+        seconds, latencies = spike(utils, questions, args.users)
+        results[name] = {"embedding_requests": fake.requests["embeddings"], "seconds": seconds, "latency_ms": percentiles(latencies)}
+        print(f"{name:<12} {results[name]['embedding_requests']:>9} {seconds:>8.2f} {results[name]['latency_ms']['p50']:>8.0f} {results[name]['latency_ms']['p99']:>8.0f}")
+    fake.stop()
+
+    commit = git_commit()
+    report = {
+        "benchmark": "coalescing",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"coalescing-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
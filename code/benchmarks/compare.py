@@ -0,0 +1,54 @@
+"""
+Compare two benchmark result files, e.g. from two commits.
+
+    python -m benchmarks.compare benchmarks/results/e2e-abc123-....json benchmarks/results/e2e-def456-....json
+
+Prints every numeric metric side by side with the relative change. Results are
+matched by their first identifying key (corpus_size, variant, ...).
+"""
+import argparse
+import json
+
+ID_KEYS = ("corpus_size", "variant", "name", "size")
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+def result_id(result):
+    for key in ID_KEYS:
+        if key in result:
+            return f"{key}={result[key]}"
+    return "result"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline:  {baseline.get('commit')} {baseline.get('timestamp')}")
+    print(f"candidate: {candidate.get('commit')} {candidate.get('timestamp')}")
+    candidate_results = {result_id(r): r for r in candidate.get("results", [])}
+    for result in baseline.get("results", []):
+        rid = result_id(result)
+        if rid not in candidate_results:
+            continue
+        print(f"\n[{rid}]")
+        other = dict(flatten(candidate_results[rid]))
+        for metric, value in flatten(result):
+            if metric not in other:
+                continue
+            change = f"{(other[metric] - value) / value * 100:+.1f}%" if value else "n/a"
+            print(f"  {metric:<40} {value:>14.3f} {other[metric]:>14.3f} {change:>9}")
+
+if __name__ == "__main__":
+    main()
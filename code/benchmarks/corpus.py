@@ -0,0 +1,52 @@
+"""
+Deterministic synthetic corpus for the offline benchmarks.
+
+Each document belongs to one topic. It mixes that topic's vocabulary with
+common words and a few words unique to the document. Questions built from a
+document's words therefore have a known relevant document.
+"""
+import random
+
+SYLLABLES = ["la", "me", "ri", "to", "sa", "no", "ve", "qui", "da", "pe", "lo", "mi", "ca", "ru", "ten",
+             "bo", "fi", "gra", "del", "son", "ar", "es", "in", "ul", "or", "ma", "ce", "sol", "tri", "ven"]
+
+def _word(rng, syllables=3):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+def make_corpus(size, seed=42, topics=None, words_per_doc=200):
+    """Return a list of {"filename", "text", "topic", "keywords"} dicts."""
+    rng = random.Random(seed)
+    topics = topics or max(1, size // 10)
+    common = [_word(rng, 2) for _ in range(300)]
+    topic_words = [[_word(rng, 3) for _ in range(40)] for _ in range(topics)]
+    documents = []
+    for i in range(size):
+        topic = i % topics
+        keywords = [_word(rng, 4) for _ in range(5)]
+        words = []
+        for _ in range(words_per_doc):
+            r = rng.random()
+            if r < 0.5:
+                words.append(rng.choice(topic_words[topic]))
+            elif r < 0.95:
+                words.append(rng.choice(common))
+            else:
+                words.append(rng.choice(keywords))
+        documents.append({
+            "filename": f"bench/doc_{i:07d}.txt",
+            "text": " ".join(words),
+            "topic": topic,
+            "keywords": keywords,
+        })
+    return documents
+
+def make_questions(documents, count, seed=7, words=6):
+    """Return a list of {"question", "relevant"} dicts, each built from one document's words."""
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        doc = rng.choice(documents)
+        terms = rng.sample(doc["keywords"], 2) + rng.sample(doc["text"].split(), words - 2)
+        rng.shuffle(terms)
+        questions.append({"question": " ".join(terms), "relevant": [doc["filename"]]})
+    return questions
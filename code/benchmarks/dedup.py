@@ -0,0 +1,117 @@
+"""
+Benchmark for near-duplicate detection (utilities.dedup), offline.
+
+Builds a synthetic corpus where some chunks are edited copies of earlier ones
+(--edit-rate of their words replaced), as templated letters and new manual
+versions are. Each chunk goes through the MinHash/LSH lookup in order, against
+in-memory buckets in place of the Redis sets. The benchmark reports signature
+throughput and the duplicates found. It also reports precision and recall
+against the exact Jaccard similarity of the shingles, and the share of embedding
+calls saved.
+
+    python -m benchmarks.dedup --chunks 5000 --duplicate-rate 0.3 --edit-rate 0.01
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+
+from benchmarks.corpus import make_corpus
+from benchmarks.e2e import RESULTS_DIR, git_commit, percentiles
+
+def make_chunks(count, duplicate_rate, edit_rate, seed=42):
+    """Return (texts, index of the chunk each text was copied from or None)."""
+    rng = random.Random(seed)
+    originals = [doc["text"] for doc in make_corpus(count, seed=seed)]
+    texts, sources = [], []
+    for i in range(count):
+        if texts and rng.random() < duplicate_rate:
+            source = rng.randrange(len(texts))
+            words = texts[source].split()
+            for _ in range(max(1, int(len(words) * edit_rate))):
+                words[rng.randrange(len(words))] = rng.choice(words)
+            texts.append(" ".join(words))
+            sources.append(source)
+        else:
+            texts.append(originals[i])
+            sources.append(None)
+    return texts, sources
+
+def _shingles(text, size):
+    words = text.lower().split()
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.3, help="Share of chunks copied from an earlier chunk")
+    parser.add_argument("--edit-rate", type=float, default=0.01, help="Share of words replaced in each copy")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/dedup-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    from utilities import dedup
+    texts, sources = make_chunks(args.chunks, args.duplicate_rate, args.edit_rate)
+
+    signature_times, lookup_times = [], []
+    buckets, signatures, found = {}, [], []
+    for i, text in enumerate(texts):
+        start = time.perf_counter()
+        sig = dedup.signature(text)
+        signature_times.append(time.perf_counter() - start)
+
+        # Same steps as find_duplicate, with dicts instead of the Redis sets
+        start = time.perf_counter()
+        band_keys = dedup._band_keys(sig)
+        candidates = sorted(set().union(*(buckets.get(key, ()) for key in band_keys)))
+        duplicate_of = next((c for c in candidates if dedup.similarity(sig, signatures[c]) >= dedup.DEDUP_THRESHOLD), None)
+        if duplicate_of is None:
+            for key in band_keys:
+                buckets.setdefault(key, set()).add(i)
+        lookup_times.append(time.perf_counter() - start)
+        signatures.append(sig)
+        found.append(duplicate_of)
+
+    # Ground truth: exact Jaccard similarity with the chunk each copy was made from
+    shingles = [_shingles(text, dedup.DEDUP_SHINGLE_WORDS) for text in texts]
+    def jaccard(a, b):
+        return len(shingles[a] & shingles[b]) / len(shingles[a] | shingles[b])
+    expected = {i for i, source in enumerate(sources) if source is not None and jaccard(i, source) >= dedup.DEDUP_THRESHOLD}
+    detected = {i for i, duplicate_of in enumerate(found) if duplicate_of is not None}
+    correct = {i for i in detected if jaccard(i, found[i]) >= dedup.DEDUP_THRESHOLD}
+
+    results = {
+        "chunks": len(texts),
+        "copies": sum(1 for source in sources if source is not None),
+        "expected_duplicates": len(expected),
+        "detected": len(detected),
+        "precision": len(correct) / len(detected) if detected else 1.0,
+        "recall": len(expected & detected) / len(expected) if expected else 1.0,
+        "embedding_calls_saved": len(detected) / len(texts),
+        "signature_ms": percentiles(signature_times),
+        "lookup_ms": percentiles(lookup_times),
+        "signatures_per_s": len(texts) / sum(signature_times),
+    }
+    print(f"{results['chunks']} chunks, {results['copies']} edited copies, {results['expected_duplicates']} above the threshold ({dedup.DEDUP_THRESHOLD})")
+    print(f"detected {results['detected']}: precision {results['precision']:.3f}, recall {results['recall']:.3f}, "
+          f"embedding calls saved {results['embedding_calls_saved']:.1%}")
+    print(f"signature p50 {results['signature_ms']['p50']:.3f} ms, p99 {results['signature_ms']['p99']:.3f} ms "
+          f"({results['signatures_per_s']:.0f}/s); lookup p50 {results['lookup_ms']['p50']:.3f} ms")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "dedup",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": dict(vars(args), threshold=dedup.DEDUP_THRESHOLD, num_perm=dedup.DEDUP_NUM_PERM, bands=dedup.DEDUP_BANDS),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"dedup-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
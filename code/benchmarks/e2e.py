@@ -0,0 +1,232 @@
+"""
+Offline end-to-end benchmark for ingestion and QnA.
+
+Runs the real utilities.utils, utilities.redisembeddings and
+utilities.azureblobstorage code against local stand-ins:
+
+- a fake Azure OpenAI server (benchmarks/fake_openai.py) with configurable
+  latency and 429 injection
+- redis-stack:  docker run -p 6379:6379 redis/redis-stack-server:latest
+- Azurite:      docker run -p 10000:10000 mcr.microsoft.com/azure-storage/azurite azurite-blob --blobHost 0.0.0.0
+
+For each corpus size it reports ingest docs/sec, QnA and search latency
+percentiles, and Redis memory per chunk. Results are written as JSON so runs
+from different commits can be compared with benchmarks/compare.py.
+
+The embeddings index is dropped and rebuilt for every corpus size, so point
+it at a dedicated Redis and pass --reset:
+
+    python -m benchmarks.e2e --sizes 100,1000,10000 --queries 200 --reset
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.corpus import make_corpus, make_questions
+from benchmarks.fake_openai import FakeOpenAI
+
+AZURITE_CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+)
+AZURITE_ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+PROMPT = "Por favor, responde a la pregunta utilizando únicamente la información presente en el texto anterior.\nPregunta: _QUESTION_\nRespuesta:"
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    values = np.array(values) * 1000
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def configure_environment(args, fake):
+    os.environ.update(
+        OPENAI_API_BASE=fake.api_base,
+        OPENAI_API_KEY="fake",
+        REDIS_ADDRESS=args.redis_address,
+        # Keep background probes and translation lookups out of the measurements
+        OPENAI_HEALTHCHECK_INTERVAL="86400",
+        QUERY_LANGUAGE_MODE="off",
+    )
+    if not args.skip_blob:
+        os.environ.update(
+            BLOB_CONNECTION_STRING=args.blob_connection_string,
+            BLOB_ACCOUNT_NAME=args.blob_account_name,
+            BLOB_ACCOUNT_KEY=args.blob_account_key,
+            BLOB_CONTAINER_NAME=args.blob_container,
+        )
+
+def reset_index(redisembeddings):
+    try:
+        redisembeddings.get_index(redisembeddings.get_index_state(refresh=True)[0].name).dropindex(delete_documents=True)
+    except Exception:
+        pass
+    redisembeddings.get_redis_conn().delete(redisembeddings.INDEX_VERSIONS_KEY)
+    redisembeddings.ensure_indexes(force=True)
+
+def used_memory(redis_conn):
+    return redis_conn.info("memory")["used_memory"]
+
+def indexed_documents(redisembeddings):
+    return int(redisembeddings.get_index(redisembeddings.index_alias).info()["num_docs"])
+
+def run_size(size, args, fake, utils, redisembeddings, azureblobstorage):
+    redis_conn = redisembeddings.get_redis_conn()
+    reset_index(redisembeddings)
+    documents = make_corpus(size, seed=args.seed)
+    questions = make_questions(documents, args.queries, seed=args.seed + 1)
+    memory_before = used_memory(redis_conn)
+    fake.requests.update(embeddings=0, completions=0, rate_limited=0)
+
+    def ingest(doc):
+        start = time.perf_counter()
+        if not args.skip_blob:
+            azureblobstorage.upload_file(doc["text"].encode("utf-8"), doc["filename"], content_type="text/plain")
+        ok = utils.add_embeddings(doc["text"], doc["filename"])
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.ingest_workers) as pool:
+        ingested = list(pool.map(ingest, documents))
+    ingest_seconds = time.perf_counter() - start
+    ingest_requests = dict(fake.requests)
+
+    chunks = indexed_documents(redisembeddings)
+    memory_after = used_memory(redis_conn)
+    sample_keys = [key for _, key in zip(range(50), redis_conn.scan_iter("embedding:*", count=100))]
+    sampled = [redis_conn.memory_usage(key) or 0 for key in sample_keys]
+
+    fake.requests.update(embeddings=0, completions=0, rate_limited=0)
+
+    def search(item):
+        start = time.perf_counter()
+        res = utils.search_semantic_redis(item["question"], n=args.k, pprint=False)
+        return len(res) > 0, time.perf_counter() - start
+
+    def answer(item):
+        start = time.perf_counter()
+        try:
+            _, response, _ = utils.get_semantic_answer(item["question"], explicit_prompt=PROMPT, model="gpt-35-turbo-instruct", tokens_response=100)
+            ok = response is not None
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        searched = list(pool.map(search, questions))
+        answered = list(pool.map(answer, questions))
+
+    result = {
+        "corpus_size": size,
+        "chunks": chunks,
+        "ingest": {
+            "seconds": ingest_seconds,
+            "docs_per_sec": size / ingest_seconds if ingest_seconds else None,
+            "failed": sum(1 for ok, _ in ingested if not ok),
+            "latency_ms": percentiles([t for _, t in ingested]),
+            "openai_requests": ingest_requests["embeddings"],
+            "rate_limited": ingest_requests["rate_limited"],
+        },
+        "search": {
+            "latency_ms": percentiles([t for _, t in searched]),
+            "empty": sum(1 for ok, _ in searched if not ok),
+        },
+        "qna": {
+            "latency_ms": percentiles([t for _, t in answered]),
+            "failed": sum(1 for ok, _ in answered if not ok),
+            "rate_limited": fake.requests["rate_limited"],
+        },
+        "redis_memory": {
+            "used_memory_delta_bytes": memory_after - memory_before,
+            "bytes_per_chunk": (memory_after - memory_before) / chunks if chunks else None,
+            "sampled_key_bytes_mean": float(np.mean(sampled)) if sampled else None,
+        },
+    }
+    print(f"size={size:>7} chunks={chunks:>7} ingest={result['ingest']['docs_per_sec'] or 0:8.1f} docs/s "
+          f"qna p50/p95/p99={result['qna']['latency_ms']['p50'] or 0:.0f}/{result['qna']['latency_ms']['p95'] or 0:.0f}/{result['qna']['latency_ms']['p99'] or 0:.0f} ms "
+          f"mem/chunk={result['redis_memory']['bytes_per_chunk'] or 0:.0f} B")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000", help="Comma-separated corpus sizes")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent QnA/search requests")
+    parser.add_argument("--ingest-workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake OpenAI seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random latency")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Share of OpenAI requests answered with 429")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--redis-address", default=os.getenv("REDIS_ADDRESS", "localhost"))
+    parser.add_argument("--skip-blob", action="store_true", help="Do not upload documents to Azurite")
+    parser.add_argument("--blob-connection-string", default=AZURITE_CONNECTION_STRING)
+    parser.add_argument("--blob-account-name", default="devstoreaccount1")
+    parser.add_argument("--blob-account-key", default=AZURITE_ACCOUNT_KEY)
+    parser.add_argument("--blob-container", default="benchmark")
+    parser.add_argument("--reset", action="store_true", help="Allow dropping the embeddings index and its documents")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/e2e-<commit>-<time>.json)")
+    parser.add_argument("--labels-output", help="Write the questions of the last corpus size as a labelled JSONL set for benchmarks.retrieval_eval")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio, seed=args.seed).start()
+    configure_environment(args, fake)
+    from utilities import utils, redisembeddings, azureblobstorage
+
+    utils.initialize()
+    redisembeddings.ensure_indexes()
+    if indexed_documents(redisembeddings) and not args.reset:
+        sys.exit("The embeddings index is not empty. Use a dedicated Redis and pass --reset to let the benchmark drop it.")
+    if not args.skip_blob:
+        container = azureblobstorage.get_blob_service_client().get_container_client(args.blob_container)
+        if not container.exists():
+            container.create_container()
+
+    results = [run_size(int(size), args, fake, utils, redisembeddings, azureblobstorage) for size in args.sizes.split(",")]
+    fake.stop()
+
+    if args.labels_output:
+        # The index still holds the last corpus, so these labels can be evaluated right away
+        documents = make_corpus(int(args.sizes.split(",")[-1]), seed=args.seed)
+        with open(args.labels_output, "w", encoding="utf-8") as f:
+            for item in make_questions(documents, args.queries, seed=args.seed + 1):
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "e2e",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "config": dict(vars(args), blob_account_key=None, blob_connection_string=None),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark for local text extraction (utilities.extraction), offline.
+
+Writes --documents synthetic born-digital PDFs of --pages pages each, with the
+text of the benchmark corpus. It then extracts them with iter_extract, the way
+ingestion does, once per --workers value. It reports pages per second and
+per-document latency. No document reaches Form Recognizer. Every PDF has a
+text layer, and the run fails if one would have been sent to OCR.
+
+    python -m benchmarks.extraction --documents 20 --pages 50 --workers 1 --workers 8
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+from benchmarks.corpus import make_corpus
+from benchmarks.e2e import RESULTS_DIR, git_commit, percentiles
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(pages, lines_per_page=40, words_per_line=12):
+    """A PDF with one text stream in Helvetica per page, written without a PDF library."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        words = text.split()
+        lines = [" ".join(words[i:i + words_per_line]) for i in range(0, len(words), words_per_line)][:lines_per_page]
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R /Resources << /Font << /F1 3 0 R >> >> >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50, help="Pages per document")
+    parser.add_argument("--workers", type=int, action="append", help="Extraction processes (default: 1 and the CPU count)")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/extraction-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    texts = [doc["text"] for doc in make_corpus(args.pages, seed=42, words_per_doc=400)]
+    documents = [make_pdf(texts[i:] + texts[:i]) for i in range(args.documents)]
+    print(f"{args.documents} PDFs of {args.pages} pages, {sum(map(len, documents)) / 2**20:.1f} MiB")
+
+    from utilities import extraction
+    def no_ocr(url):
+        raise RuntimeError("A born-digital document was sent to Form Recognizer")
+    extraction.iter_analyze_read = no_ocr
+
+    results = {}
+    print(f"{'workers':>8} {'pages/s':>10} {'doc p50 ms':>11} {'doc p99 ms':>11}")
+    for workers in args.workers or [1, os.cpu_count() or 1]:
+        # A new pool per run; its start-up is not timed
+        extraction.LOCAL_EXTRACTION_WORKERS = workers
+        extraction._pool = None
+        list(extraction.iter_extract("", "warmup.pdf", documents[0]))
+        latencies = []
+        start = time.perf_counter()
+        for i, data in enumerate(documents):
+            begin = time.perf_counter()
+            list(extraction.iter_extract("", f"doc_{i}.pdf", data))
+            latencies.append(time.perf_counter() - begin)
+        seconds = time.perf_counter() - start
+        extraction._get_pool().shutdown()
+        results[workers] = {"seconds": seconds, "pages_per_s": args.documents * args.pages / seconds, "document_ms": percentiles(latencies)}
+        print(f"{workers:>8} {results[workers]['pages_per_s']:>10.0f} {results[workers]['document_ms']['p50']:>11.1f} {results[workers]['document_ms']['p99']:>11.1f}")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "extraction",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"extraction-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
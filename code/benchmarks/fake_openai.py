@@ -0,0 +1,162 @@
+"""
+Local stand-in for the Azure OpenAI REST API used by utilities.utils.
+
+Serves the deployment routes the openai 0.26 SDK calls in Azure mode:
+
+- POST /openai/deployments/{engine}/embeddings
+- POST /openai/deployments/{engine}/completions (also with "stream": true)
+- GET  /openai/models
+
+Embeddings are deterministic hashed bag-of-words vectors. Texts that share words
+are close in cosine distance, so retrieval results mean something. Latency per
+request and the share of requests answered with 429 are configurable.
+"""
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+def fake_embedding(text, dim=1536):
+    """Hashed bag-of-words embedding, L2-normalised."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+        position = int.from_bytes(digest[:4], 'little') % dim
+        vector[position] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+class FakeOpenAI:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, dim=1536, host="127.0.0.1", port=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.dim = dim
+        self.requests = {"embeddings": 0, "completions": 0, "models": 0, "rate_limited": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 128
+
+    @property
+    def api_base(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _admit(self, kind):
+        # Returns False when this request should be answered with 429
+        with self._lock:
+            self.requests[kind] += 1
+            limited = self._random.random() < self.rate_limit_ratio
+            if limited:
+                self.requests["rate_limited"] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        time.sleep(delay)
+        return not limited
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200, headers=None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, engine, words):
+                # Server-sent events, one word per event, as the SDK reads them with stream=True
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for word in words:
+                    event = {"id": "cmpl-fake", "object": "text_completion", "model": engine,
+                             "choices": [{"text": f" {word}", "index": 0, "finish_reason": None, "logprobs": None}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def _rate_limited(self):
+                self._reply({"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit (fake)."}}, 429, {"Retry-After": "1"})
+
+            def do_GET(self):
+                if urlparse(self.path).path.rstrip('/') == '/openai/models':
+                    fake._admit("models")
+                    self._reply({"object": "list", "data": [{"id": "text-embedding-ada-002", "object": "model"}, {"id": "gpt-35-turbo-instruct", "object": "model"}]})
+                else:
+                    self._reply({"error": {"message": "not found"}}, 404)
+
+            def do_POST(self):
+                parts = urlparse(self.path).path.strip('/').split('/')
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if len(parts) != 4 or parts[:2] != ['openai', 'deployments']:
+                    self._reply({"error": {"message": "not found"}}, 404)
+                    return
+                engine, operation = parts[2], parts[3]
+                if operation == 'embeddings':
+                    if not fake._admit("embeddings"):
+                        return self._rate_limited()
+                    texts = payload.get('input', [])
+                    texts = [texts] if isinstance(texts, str) else texts
+                    tokens = sum(len(t.split()) for t in texts)
+                    self._reply({
+                        "object": "list",
+                        "model": engine,
+                        "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t, fake.dim).tolist()} for i, t in enumerate(texts)],
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                    })
+                elif operation == 'completions':
+                    if not fake._admit("completions"):
+                        return self._rate_limited()
+                    prompt = payload.get('prompt', '')
+                    prompt_tokens = len(prompt.split())
+                    text = " ".join(prompt.split()[-20:])
+                    if payload.get('stream'):
+                        return self._stream(engine, text.split())
+                    self._reply({
+                        "id": "cmpl-fake",
+                        "object": "text_completion",
+                        "model": engine,
+                        "choices": [{"text": f" {text}", "index": 0, "finish_reason": "stop", "logprobs": None}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+                    })
+                else:
+                    self._reply({"error": {"message": "not found"}}, 404)
+
+        return Handler
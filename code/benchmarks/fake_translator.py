@@ -0,0 +1,95 @@
+"""
+Local stand-in for the Azure Translator v3 REST API.
+
+Language detection is deterministic: a text starting with "xx:" (two letters and a
+colon) is detected as language "xx", anything else as "en". Translating prefixes
+the text with "[to] ". Every request is counted so callers can check round trips.
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LANGUAGES = {"en": "English", "es": "Spanish", "fr": "French", "pt": "Portuguese", "de": "German"}
+
+def detect(text):
+    if len(text) > 3 and text[2] == ':' and text[:2].isalpha():
+        return text[:2].lower()
+    return "en"
+
+class FakeTranslator:
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.requests = {"detect": 0, "translate": 0, "languages": 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately; avoid Nagle/delayed-ACK stalls
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/languages':
+                    fake._count('languages')
+                    time.sleep(fake.latency)
+                    self._reply({"translation": {k: {"name": v, "nativeName": v, "dir": "ltr"} for k, v in LANGUAGES.items()}})
+                else:
+                    self._reply({"error": "not found"}, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                items = json.loads(self.rfile.read(length) or b'[]')
+                time.sleep(fake.latency)
+                if url.path == '/detect':
+                    fake._count('detect')
+                    self._reply([{"language": detect(i['text']), "score": 1.0} for i in items])
+                elif url.path == '/translate':
+                    fake._count('translate')
+                    to = parse_qs(url.query).get('to', ['en'])[0]
+                    self._reply([{"translations": [{"text": f"[{to}] {i['text']}", "to": to}]} for i in items])
+                else:
+                    self._reply({"error": "not found"}, 404)
+
+        return Handler
@@ -0,0 +1,64 @@
+"""
+Import-time benchmark for the utilities package.
+
+Each module is imported in a fresh interpreter so nothing is shared between
+runs. Run from the code directory:
+
+    python -m benchmarks.import_time --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = [
+    "utilities.redisembeddings",
+    "utilities.azureblobstorage",
+    "utilities.formrecognizer",
+    "utilities.translator",
+    "utilities.utils",
+]
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_import(module, env):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", f"import {module}"], cwd=CODE_DIR, env=env, capture_output=True, text=True)
+    duration = time.perf_counter() - start
+    return duration, proc.returncode, proc.stderr.strip().splitlines()[-1:] if proc.returncode else []
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Point Redis at an unreachable address: importing must not need a server
+    env.setdefault("REDIS_ADDRESS", "127.0.0.1")
+
+    baseline = statistics.median(time_import("sys", env)[0] for _ in range(args.repeat))
+    results = {"interpreter_startup_s": baseline, "modules": {}}
+    print(f"{'module':<32} {'median (s)':>10} {'minus startup':>14}")
+    for module in MODULES:
+        runs = [time_import(module, env) for _ in range(args.repeat)]
+        failures = [r for r in runs if r[1] != 0]
+        median = statistics.median(r[0] for r in runs)
+        results["modules"][module] = {
+            "median_s": median,
+            "import_s": median - baseline,
+            "failed": len(failures),
+            "error": failures[0][2] if failures else None,
+        }
+        status = f"FAILED: {failures[0][2]}" if failures else ""
+        print(f"{module:<32} {median:>10.3f} {median - baseline:>14.3f} {status}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark for the local CPU embedding backend (utilities.embeddingmodels).
+
+For each variant it measures query latency (single texts, one at a time), bulk
+throughput (get_embeddings over --bulk chunks) and concurrent query throughput
+(--concurrency threads, merged into batches by the model):
+
+- openai:      the fake OpenAI server (benchmarks/fake_openai.py) with --latency per request
+- torch:       LOCAL_EMBEDDINGS_MODEL with transformers and torch
+- onnx:        the same model exported to ONNX
+- onnx-int8:   the ONNX model with int8 weights
+
+Local variants need the model in the Hugging Face cache (or network access),
+and torch for the first ONNX export. Variants whose dependencies are missing are
+skipped.
+
+    python -m benchmarks.local_embeddings --queries 200 --bulk 2000 --variant torch --variant onnx-int8
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.corpus import make_corpus, make_questions
+from benchmarks.e2e import RESULTS_DIR, git_commit, percentiles
+
+VARIANTS = ["openai", "torch", "onnx", "onnx-int8"]
+
+def run_variant(name, args, questions, chunks):
+    from utilities import utils, embeddingmodels
+    if name == "openai":
+        engine = "text-embedding-ada-002"
+    else:
+        engine = f"{embeddingmodels.LOCAL_PREFIX}{args.model}"
+        model = embeddingmodels.LocalEmbeddingModel(args.model, onnx=name != "torch", quantize=name == "onnx-int8", threads=args.threads)
+        embeddingmodels._local_models[engine] = model
+
+    utils.get_embedding("warm up", engine=engine)
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        utils.get_embedding(question, engine=engine)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda question: utils.get_embedding(question, engine=engine), questions))
+    concurrent_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    utils.get_embeddings(chunks, engine=engine)
+    bulk_s = time.perf_counter() - start
+    embeddingmodels._local_models.pop(engine, None)
+    return {
+        "query_latency_ms": percentiles(latencies),
+        "concurrent_qps": len(questions) / concurrent_s,
+        "bulk_texts_per_s": len(chunks) / bulk_s,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variant", action="append", choices=VARIANTS, help="Variants to run (default: all)")
+    parser.add_argument("--model", default=os.getenv("LOCAL_EMBEDDINGS_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"))
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bulk", type=int, default=2000, help="Chunks embedded with get_embeddings")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake OpenAI seconds per request")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/local-embeddings-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    from benchmarks.fake_openai import FakeOpenAI
+    fake = FakeOpenAI(latency=args.latency).start()
+    os.environ.update(OPENAI_API_BASE=fake.api_base, OPENAI_API_KEY="fake", OPENAI_HEALTHCHECK_INTERVAL="86400", SINGLEFLIGHT_ENABLED="false")
+    from utilities import utils
+    utils.initialize()
+
+    documents = make_corpus(args.bulk, seed=42)
+    chunks = [doc["text"] for doc in documents]
+    questions = [item["question"] for item in make_questions(documents, args.queries, seed=43)]
+
+    results = {}
+    print(f"{'variant':<10} {'query p50 ms':>13} {'query p99 ms':>13} {'concurrent q/s':>15} {'bulk texts/s':>13}")
+    for name in args.variant or VARIANTS:
+        try:
+            results[name] = run_variant(name, args, questions, chunks)
+        except ImportError as e:
+            print(f"{name:<10} skipped: {e}")
+            continue
+        result = results[name]
+        print(f"{name:<10} {result['query_latency_ms']['p50']:>13.1f} {result['query_latency_ms']['p99']:>13.1f} "
+              f"{result['concurrent_qps']:>15.1f} {result['bulk_texts_per_s']:>13.1f}")
+    fake.stop()
+
+    commit = git_commit()
+    report = {
+        "benchmark": "local_embeddings",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"local-embeddings-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
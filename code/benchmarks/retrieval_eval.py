@@ -0,0 +1,145 @@
+"""
+Retrieval quality and latency evaluation for search_semantic_redis.
+
+Takes a labelled JSONL file with one question per line:
+
+    {"question": "¿Cuándo es el retiro?", "relevant": ["agenda.pdf_chunk_2", "agenda.pdf_chunk_3"]}
+
+`relevant` holds chunk file names (as stored in Redis), Redis keys
+(`embedding:...`), or with --match source the original file names. Each search
+variant is run over every question. For each variant it reports recall@k, MRR,
+nDCG@k, search latency percentiles and the prompt tokens the QnA prompt would
+use, so that a retrieval change can be checked for quality loss.
+
+Runs against the Redis and OpenAI configured in the environment (.env).
+--fake-openai uses benchmarks/fake_openai.py instead, e.g. after
+benchmarks.e2e has loaded its synthetic corpus.
+
+    python -m benchmarks.retrieval_eval --labels labels.jsonl \\
+        --variant k3:k=3 --variant k5:k=5 --variant k10_ef50:k=10,ef_runtime=50 \\
+        --variant route:k=5,language_mode=route
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.e2e import RESULTS_DIR, PROMPT, git_commit, percentiles
+
+DEFAULT_VARIANTS = ["k3:k=3", "k5:k=5", "k10:k=10"]
+VARIANT_KEYS = {"k": int, "n_chunks": int, "ef_runtime": int, "language_mode": str}
+
+def parse_variant(spec):
+    name, _, options = spec.partition(":")
+    variant = {"name": name, "k": 3, "n_chunks": None, "ef_runtime": None, "language_mode": "off"}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key not in VARIANT_KEYS:
+            raise SystemExit(f"Unknown variant option {key!r}; expected one of {sorted(VARIANT_KEYS)}")
+        variant[key] = VARIANT_KEYS[key](value)
+    return variant
+
+def load_labels(path):
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [item for item in items if item.get("question") and item.get("relevant")]
+
+def ranking_metrics(retrieved, relevant, k):
+    """recall@k, reciprocal rank and nDCG@k with binary relevance."""
+    hits = [1 if item in relevant else 0 for item in retrieved[:k]]
+    recall = len(relevant & set(retrieved[:k])) / len(relevant)
+    rr = next((1.0 / (i + 1) for i, hit in enumerate(hits) if hit), 0.0)
+    dcg = sum(hit / math.log2(i + 2) for i, hit in enumerate(hits))
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(len(relevant), k)))
+    return recall, rr, dcg / idcg if idcg else 0.0
+
+def run_variant(variant, labels, args, utils, redisembeddings):
+    recalls, rrs, ndcgs, latencies, prompt_tokens, errors = [], [], [], [], [], 0
+    for item in labels:
+        start = time.perf_counter()
+        res = utils.search_semantic_redis(item["question"], n=variant["k"], pprint=False, language_mode=variant["language_mode"], ef_runtime=variant["ef_runtime"])
+        latencies.append(time.perf_counter() - start)
+        errors += 1 if res.error else 0
+        res_records = res.to_dicts()
+
+        if args.match == "source":
+            retrieved = list(dict.fromkeys(redisembeddings.get_source_filename(doc["filename"]) for doc in res_records))
+        elif args.match == "id":
+            retrieved = [doc["id"] for doc in res_records]
+        else:
+            retrieved = [doc["filename"] for doc in res_records]
+        recall, rr, ndcg = ranking_metrics(retrieved, set(item["relevant"]), variant["k"])
+        recalls.append(recall)
+        rrs.append(rr)
+        ndcgs.append(ndcg)
+
+        prompt, _ = utils.build_qna_prompt(item["question"], res, PROMPT, n_chunks=variant["n_chunks"])
+        prompt_tokens.append(utils.get_token_count(prompt))
+
+    k = variant["k"]
+    result = {
+        "variant": variant["name"],
+        "params": {key: variant[key] for key in VARIANT_KEYS},
+        "questions": len(labels),
+        "errors": errors,
+        f"recall@{k}": float(np.mean(recalls)),
+        "mrr": float(np.mean(rrs)),
+        f"ndcg@{k}": float(np.mean(ndcgs)),
+        "latency_ms": percentiles(latencies),
+        "prompt_tokens": {"mean": float(np.mean(prompt_tokens)), "p95": float(np.percentile(prompt_tokens, 95))},
+    }
+    print(f"{variant['name']:<16} recall@{k:<3}={result[f'recall@{k}']:.3f} mrr={result['mrr']:.3f} ndcg@{k}={result[f'ndcg@{k}']:.3f} "
+          f"p50/p95/p99={result['latency_ms']['p50']:.0f}/{result['latency_ms']['p95']:.0f}/{result['latency_ms']['p99']:.0f} ms "
+          f"prompt_tokens={result['prompt_tokens']['mean']:.0f}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", required=True, help="JSONL file with question/relevant pairs")
+    parser.add_argument("--variant", action="append", help="name:key=value,... with keys k, n_chunks, ef_runtime, language_mode")
+    parser.add_argument("--match", choices=["filename", "id", "source"], default="filename", help="What the labels identify")
+    parser.add_argument("--limit", type=int, help="Only evaluate the first N questions")
+    parser.add_argument("--fake-openai", action="store_true", help="Embed queries with the local fake OpenAI server")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/retrieval-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    if args.fake_openai:
+        from benchmarks.fake_openai import FakeOpenAI
+        fake = FakeOpenAI().start()
+        os.environ.update(OPENAI_API_BASE=fake.api_base, OPENAI_API_KEY="fake", OPENAI_HEALTHCHECK_INTERVAL="86400")
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+    from utilities import utils, redisembeddings
+
+    labels = load_labels(args.labels)[:args.limit]
+    if not labels:
+        sys.exit(f"No labelled questions found in {args.labels}")
+    utils.initialize()
+    redisembeddings.ensure_indexes()
+
+    variants = [parse_variant(spec) for spec in (args.variant or DEFAULT_VARIANTS)]
+    results = [run_variant(variant, labels, args, utils, redisembeddings) for variant in variants]
+
+    commit = git_commit()
+    report = {
+        "benchmark": "retrieval",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "labels": os.path.abspath(args.labels),
+        "match": args.match,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
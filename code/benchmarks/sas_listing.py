@@ -0,0 +1,110 @@
+"""
+Micro-benchmark for building SAS URLs over a large file listing.
+
+Compares, for N synthetic blobs (no network or Redis needed):
+
+- eager_blob_sas:       a new blob SAS signed per file (the old upload_file/BatchPushResults path)
+- eager_container_sas:  one container SAS and both URLs formatted per file (the old get_all_files)
+- cached_blob_sas:      get_sas_token per file, second pass (all cache hits)
+- lazy_listing:         BlobFile entries for every file, no URL read
+- paged_listing:        BlobFile entries for one page, URLs read (what list_files serves)
+
+us/file is always per listed file of the whole container, so paged_listing shows
+what browsing costs per page compared with building the full listing.
+
+Run from the code directory:
+
+    python -m benchmarks.sas_listing --files 100000 --page 100
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import time
+
+from benchmarks.e2e import AZURITE_ACCOUNT_KEY, RESULTS_DIR, git_commit
+
+def timed(func, repeat):
+    # Best of `repeat` runs, each after a full collection so earlier variants' garbage does not count
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return min(runs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--page", type=int, default=100, help="Files per page in paged_listing")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/sas-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    os.environ.update(
+        BLOB_ACCOUNT_NAME="devstoreaccount1",
+        BLOB_ACCOUNT_KEY=AZURITE_ACCOUNT_KEY,
+        BLOB_CONTAINER_NAME="benchmark",
+        SAS_CACHE_SIZE=str(args.files + 1),
+    )
+    os.environ.pop("BLOB_CONNECTION_STRING", None)
+    from azure.storage.blob import generate_blob_sas, generate_container_sas
+    from utilities import azureblobstorage
+
+    account, key, container = "devstoreaccount1", AZURITE_ACCOUNT_KEY, "benchmark"
+    container_url = azureblobstorage.get_blob_service_client().get_container_client(container).url
+    names = [f"folder/document-{i:06d}.pdf" for i in range(args.files)]
+    entries = [{"filename": name, "size": 1024, "converted": i % 2 == 0, "converted_format": "chunks", "embeddings_added": False} for i, name in enumerate(names)]
+    expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=3)
+
+    def eager_blob_sas():
+        for name in names:
+            f"{container_url}/{name}?{generate_blob_sas(account, container, name, account_key=key, permission='r', expiry=expiry)}"
+
+    def eager_container_sas():
+        sas = generate_container_sas(account, container, account_key=key, permission='r', expiry=expiry)
+        return [dict(entry, fullpath=f"{container_url}/{entry['filename']}?{sas}",
+                     converted_path=f"{container_url}/converted/{entry['filename']}.chunks?{sas}" if entry['converted'] else "")
+                for entry in entries]
+
+    def cached_blob_sas():
+        for name in names:
+            azureblobstorage.get_sas_token(container, name)
+
+    def lazy_listing():
+        return [azureblobstorage.BlobFile(entry, container_url, container) for entry in entries]
+
+    def paged_listing():
+        for file in [azureblobstorage.BlobFile(entry, container_url, container) for entry in entries[:args.page]]:
+            file['fullpath']
+            file['converted_path']
+
+    cached_blob_sas()  # fill the cache
+    results = {}
+    print(f"{'variant':<20} {'seconds':>9} {'us/file':>9}")
+    for name, func in (("eager_blob_sas", eager_blob_sas), ("eager_container_sas", eager_container_sas),
+                       ("cached_blob_sas", cached_blob_sas), ("lazy_listing", lazy_listing), ("paged_listing", paged_listing)):
+        seconds = timed(func, args.repeat)
+        results[name] = {"seconds": seconds, "us_per_file": seconds / args.files * 1e6}
+        print(f"{name:<20} {seconds:>9.3f} {results[name]['us_per_file']:>9.2f}")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "sas_listing",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "files": args.files,
+        "page": args.page,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"sas-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
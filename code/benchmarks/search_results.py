@@ -0,0 +1,108 @@
+"""
+Micro-benchmark for turning FT.SEARCH replies into search results.
+
+Parses synthetic KNN replies (no Redis needed) and compares, per search:
+
+- dataframe:  a pandas DataFrame per search, read with head().to_dict('records') (the old path)
+- records:    SearchResults of SearchResult records (what execute_query returns now)
+
+Each search parses the reply, builds the result and reads the top chunks the way
+build_qna_prompt does. It reports p50/p95/p99 latency and the memory allocated
+per search, measured with tracemalloc in a separate pass so it does not skew the
+timings. Run from the code directory:
+
+    python -m benchmarks.search_results --searches 10000 --k 5
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+from redis.commands.search.result import Result
+
+from benchmarks.e2e import RESULTS_DIR, git_commit, percentiles
+
+def knn_reply(k, text_size):
+    # Same shape as the raw FT.SEARCH reply for execute_query's fields
+    reply = [k]
+    for i in range(k):
+        reply += [f"embedding:doc-{i}.pdf_chunk_{i}".encode(),
+                  [b"vector_score", f"{0.1 + i / 100:.6f}".encode(), b"text", ("lorem ipsum " * (text_size // 12)).encode(),
+                   b"filename", f"doc-{i}.pdf_chunk_{i}".encode()]]
+    return reply
+
+def dataframe_search(reply, n_chunks):
+    docs = Result(reply, True).docs
+    res = pd.DataFrame(list(map(lambda x: {'id': x.id, 'text': x.text, 'filename': x.filename, 'vector_score': x.vector_score}, docs)))
+    top_docs = res.head(n_chunks).to_dict('records')
+    return [doc['text'] for doc in top_docs], [doc['filename'] for doc in top_docs]
+
+def records_search(reply, n_chunks, redisembeddings):
+    res = redisembeddings._knn_results(Result(reply, True).docs)
+    top_docs = res[:n_chunks]
+    return [doc.text for doc in top_docs], [doc.filename for doc in top_docs]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--searches", type=int, default=10000)
+    parser.add_argument("--k", type=int, default=5, help="Results per search")
+    parser.add_argument("--n-chunks", type=int, default=3, help="Chunks read per search, as in the QnA prompt")
+    parser.add_argument("--text-size", type=int, default=1500, help="Characters per chunk")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/search-results-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    from utilities import redisembeddings
+
+    reply = knn_reply(args.k, args.text_size)
+    variants = {
+        "dataframe": lambda: dataframe_search(reply, args.n_chunks),
+        "records": lambda: records_search(reply, args.n_chunks, redisembeddings),
+    }
+    assert variants["dataframe"]() == variants["records"](), "Both paths must return the same chunks"
+
+    results = {}
+    print(f"{'variant':<10} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'KiB/search':>11}")
+    for name, search in variants.items():
+        for _ in range(min(1000, args.searches)):
+            search()  # warm up
+        gc.collect()
+        latencies = []
+        for _ in range(args.searches):
+            start = time.perf_counter()
+            search()
+            latencies.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        allocated = 0
+        for _ in range(min(1000, args.searches)):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            search()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        # percentiles() reports milliseconds
+        latency_us = {key: value * 1000 for key, value in percentiles(latencies).items()}
+        results[name] = {"latency_us": latency_us, "peak_bytes_per_search": allocated / min(1000, args.searches)}
+        print(f"{name:<10} {latency_us['p50']:>8.1f} {latency_us['p95']:>8.1f} {latency_us['p99']:>8.1f} {results[name]['peak_bytes_per_search'] / 1024:>11.1f}")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "search_results",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"search-results-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark for index snapshots (utilities.snapshot).
+
+Writes a synthetic snapshot of --chunks chunks with random --dim vectors, then
+times three steps. It reads the snapshot without Redis (file throughput). It
+restores it into redis-stack with import_index, which includes indexing. It
+exports the restored index again. The restore drops the embeddings index first,
+so point it at a dedicated Redis and pass --reset. Without --reset, only the
+read step runs.
+
+    python -m benchmarks.snapshot_restore --chunks 1000000 --dim 1536 --workers 8 --reset
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpus import make_corpus
+from benchmarks.e2e import RESULTS_DIR, git_commit, indexed_documents, reset_index
+
+def write_snapshot(path, chunks, dim, batch_size, seed=42):
+    from utilities.snapshot import SnapshotWriter
+    rng = np.random.default_rng(seed)
+    texts = [doc["text"] for doc in make_corpus(1000, seed=seed, words_per_doc=150)]
+    with SnapshotWriter(path, dim, model="benchmark") as writer:
+        for start in range(0, chunks, batch_size):
+            rows = range(start, min(chunks, start + batch_size))
+            vectors = rng.standard_normal((len(rows), dim), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            metadata = [{"text": texts[i % len(texts)], "filename": f"bench/doc_{i // 20:06d}.pdf_chunk_{i % 20}",
+                         "source": f"bench/doc_{i // 20:06d}.pdf", "language": "es"} for i in rows]
+            writer.write([f"embedding:bench{i:08d}" for i in rows], vectors, metadata)
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4, help="Import pipelines in flight")
+    parser.add_argument("--snapshot", help="Directory for the synthetic snapshot (default: a temporary directory, removed at the end)")
+    parser.add_argument("--redis-address", default=os.getenv("REDIS_ADDRESS", "localhost"))
+    parser.add_argument("--reset", action="store_true", help="Drop the embeddings index and restore the snapshot into it")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/snapshot-restore-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    os.environ.update(REDIS_ADDRESS=args.redis_address, EMBEDDINGS_DIMENSION=str(args.dim))
+    from utilities import redisembeddings, snapshot
+
+    path = args.snapshot or tempfile.mkdtemp(prefix="snapshot-")
+    results = {}
+    try:
+        start = time.perf_counter()
+        write_snapshot(path, args.chunks, args.dim, args.batch_size)
+        results["write_s"] = time.perf_counter() - start
+        results["snapshot_bytes"] = directory_size(path)
+        print(f"snapshot: {args.chunks} chunks, {results['snapshot_bytes'] / 2**20:.0f} MiB, written in {results['write_s']:.1f}s")
+
+        start = time.perf_counter()
+        for _, vectors, _ in snapshot.iter_snapshot(path, args.batch_size):
+            np.asarray(vectors).sum()
+        results["read_s"] = time.perf_counter() - start
+        print(f"read:     {args.chunks / results['read_s']:>10.0f} chunks/s ({results['read_s']:.1f}s)")
+
+        if args.reset:
+            reset_index(redisembeddings)
+            start = time.perf_counter()
+            restored = snapshot.import_index(path, args.batch_size, args.workers)
+            results["import_s"] = time.perf_counter() - start
+            results["indexed"] = indexed_documents(redisembeddings)
+            print(f"import:   {restored / results['import_s']:>10.0f} chunks/s ({results['import_s']:.1f}s, {results['indexed']} indexed)")
+
+            export_path = tempfile.mkdtemp(prefix="snapshot-export-")
+            try:
+                start = time.perf_counter()
+                exported = snapshot.export_index(export_path, args.batch_size)
+                results["export_s"] = time.perf_counter() - start
+                print(f"export:   {exported / results['export_s']:>10.0f} chunks/s ({results['export_s']:.1f}s)")
+            finally:
+                shutil.rmtree(export_path, ignore_errors=True)
+        else:
+            print("Pass --reset with a dedicated Redis to time the restore.", file=sys.stderr)
+    finally:
+        if not args.snapshot:
+            shutil.rmtree(path, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "benchmark": "snapshot_restore",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"snapshot-restore-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark for map-reduce summarisation (utilities.summarizer).
+
+Summarises one long synthetic document through the fake OpenAI server with
+--latency seconds per completion. Each --workers value is one run. The benchmark
+reports wall time, completions sent and reduce levels. The summary cache is
+off, so every run sends the same prompts.
+
+    python -m benchmarks.summarize --words 60000 --latency 0.5 --workers 1 --workers 8
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+from benchmarks.corpus import make_corpus
+from benchmarks.e2e import RESULTS_DIR, git_commit
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=60000, help="Length of the document")
+    parser.add_argument("--workers", type=int, action="append", help="Map and reduce threads (default: 1 and 8)")
+    parser.add_argument("--chunk-tokens", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake OpenAI seconds per completion")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/summarize-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    from benchmarks.fake_openai import FakeOpenAI
+    fake = FakeOpenAI(latency=args.latency).start()
+    os.environ.update(OPENAI_API_BASE=fake.api_base, OPENAI_API_KEY="fake", OPENAI_HEALTHCHECK_INTERVAL="86400", SUMMARY_CACHE="false")
+    from utilities import utils, summarizer
+    utils.initialize()
+
+    text = " ".join(doc["text"] for doc in make_corpus(max(1, args.words // 200), seed=42))
+    results = {}
+    print(f"{'workers':>8} {'seconds':>9} {'chunks':>7} {'levels':>7} {'completions':>12}")
+    for workers in args.workers or [1, 8]:
+        start = time.perf_counter()
+        result = summarizer.summarize_text(text, workers=workers, chunk_tokens=args.chunk_tokens)
+        seconds = time.perf_counter() - start
+        results[workers] = {"seconds": seconds, "chunks": result["chunks"], "levels": result["levels"], "completions": result["completions"]}
+        print(f"{workers:>8} {seconds:>9.2f} {result['chunks']:>7} {result['levels']:>7} {result['completions']:>12}")
+    fake.stop()
+
+    commit = git_commit()
+    report = {
+        "benchmark": "summarize",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"summarize-{commit}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Round-trip benchmark for utilities.translator against a local Translator stand-in.
+
+Compares translating texts one at a time with translate_batch(), checks both return
+the same translations, and shows how many requests each path needs. Run from the code
+directory:
+
+    python -m benchmarks.translator_batching --texts 500 --latency 0.02
+"""
+import argparse
+import os
+import time
+
+from benchmarks.fake_translator import FakeTranslator
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated seconds per request")
+    parser.add_argument("--redis-cache", action="store_true", help="Also use the Redis translation cache")
+    args = parser.parse_args()
+
+    fake = FakeTranslator(latency=args.latency).start()
+    os.environ.update(TRANSLATE_ENDPOINT=fake.endpoint, TRANSLATE_KEY="fake", TRANSLATE_REGION="local")
+    os.environ['TRANSLATION_REDIS_CACHE'] = 'true' if args.redis_cache else 'false'
+    from utilities import translator
+
+    texts = [f"es: documento número {i}" if i % 2 else f"document number {i}" for i in range(args.texts)]
+
+    start = time.perf_counter()
+    one_by_one = [translator.translate(text, 'en') for text in texts]
+    one_by_one_s = time.perf_counter() - start
+    one_by_one_requests = dict(fake.requests)
+
+    translator._translation_cache.clear()
+    fake.requests.update(detect=0, translate=0)
+    start = time.perf_counter()
+    batched = translator.translate_batch(texts, 'en')
+    batched_s = time.perf_counter() - start
+    batched_requests = dict(fake.requests)
+
+    fake.requests.update(detect=0, translate=0)
+    start = time.perf_counter()
+    translator.translate_batch(texts, 'en')
+    cached_s = time.perf_counter() - start
+    cached_requests = fake.requests['detect'] + fake.requests['translate']
+
+    for _ in range(3):
+        translator.get_available_languages()
+
+    assert batched == one_by_one, "batched translations differ from one-by-one translations"
+    assert fake.requests['languages'] == 1, "language list was not memoised"
+    fake.stop()
+
+    print(f"{'path':<12} {'seconds':>8} {'detect':>7} {'translate':>10}")
+    print(f"{'one-by-one':<12} {one_by_one_s:>8.3f} {one_by_one_requests['detect']:>7} {one_by_one_requests['translate']:>10}")
+    print(f"{'batched':<12} {batched_s:>8.3f} {batched_requests['detect']:>7} {batched_requests['translate']:>10}")
+    print(f"{'cached':<12} {cached_s:>8.3f} {'requests: ' + str(cached_requests):>18}")
+
+if __name__ == "__main__":
+    main()
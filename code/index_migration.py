@@ -0,0 +1,60 @@
+"""
+Migrate the embeddings index to a new model or new index parameters without
+downtime (see utilities/indexmigration.py).
+
+    python index_migration.py status
+    python index_migration.py start --doc-model text-embedding-3-small --query-model text-embedding-3-small
+    python index_migration.py build --rate 100
+    python index_migration.py switch
+    python index_migration.py retire
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+
+from utilities import indexmigration
+
+def print_progress(stats):
+    eta = f"{stats['eta'] / 60:.1f} min" if stats["eta"] is not None else "?"
+    print(f"\r{stats['scanned']}/{stats['total']} chunks, {stats['embedded']} embedded, {stats['rate']:.1f}/s, ETA {eta}   ",
+          end="", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "start", "build", "switch", "retire", "abort"])
+    parser.add_argument("--doc-model", help="start: embeddings engine for documents (default: OPENAI_EMBEDDINGS_ENGINE_DOC)")
+    parser.add_argument("--query-model", help="start: embeddings engine for queries (default: the document engine)")
+    parser.add_argument("--dimension", type=int, help="start: vector dimension (default: measured with one embedding)")
+    parser.add_argument("--distance-metric", default="COSINE", choices=["COSINE", "IP", "L2"])
+    parser.add_argument("--m", type=int, help="start: HNSW M")
+    parser.add_argument("--ef-construction", type=int, help="start: HNSW EF_CONSTRUCTION")
+    parser.add_argument("--rate", type=float, default=indexmigration.INDEX_MIGRATION_RATE, help="build: chunks per second, 0 for no limit")
+    parser.add_argument("--batch-size", type=int, default=indexmigration.INDEX_MIGRATION_BATCH)
+    parser.add_argument("--no-catch-up", action="store_true", help="switch: do not embed the chunks stored since the build")
+    parser.add_argument("--force", action="store_true", help="retire: ignore INDEX_RETIRE_GRACE")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "status":
+        for row in indexmigration.status():
+            print(f"{row['name']:<24} {row['state']:<9} {row['chunks']:>9} chunks  {row['doc_model']} ({row['dimension']}), "
+                  f"field {row['field']}, {row['indexing_failures']} indexing failures")
+    elif args.command == "start":
+        hnsw_params = {name: value for name, value in (("M", args.m), ("EF_CONSTRUCTION", args.ef_construction)) if value}
+        version = indexmigration.start_migration(args.doc_model, args.query_model, args.dimension, args.distance_metric, hnsw_params)
+        print(f"{version.name} created; run `build` next")
+    elif args.command == "build":
+        stats = indexmigration.build(rate=args.rate, batch_size=args.batch_size, progress=print_progress)
+        print(f"\n{stats['embedded']} embedded, {stats['skipped']} already done, {stats['failed']} failed")
+    elif args.command == "switch":
+        previous = indexmigration.switch(catch_up=not args.no_catch_up, batch_size=args.batch_size)
+        print(f"Active index switched; {previous.name} can be retired after {indexmigration.INDEX_RETIRE_GRACE}s")
+    elif args.command == "retire":
+        print(f"Dropped: {', '.join(indexmigration.retire(args.force, args.batch_size)) or 'nothing'}")
+    else:
+        print(f"Aborted {indexmigration.abort(batch_size=args.batch_size).name}")
+
+if __name__ == "__main__":
+    main()
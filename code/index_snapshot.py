@@ -0,0 +1,32 @@
+"""
+Export or import a snapshot of the embeddings index (see utilities/snapshot.py).
+
+    python index_snapshot.py export /backups/index-2023-03-01
+    python index_snapshot.py import /backups/index-2023-03-01 --workers 8
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+
+from utilities.snapshot import SNAPSHOT_BATCH_SIZE, SNAPSHOT_WORKERS, export_index, import_index
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Snapshot directory")
+    parser.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=SNAPSHOT_WORKERS, help="Import pipelines in flight")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export":
+        count = export_index(args.path, args.batch_size, progress=lambda done: print(f"\r{done} chunks", end="", flush=True))
+    else:
+        count = import_index(args.path, args.batch_size, args.workers,
+                             progress=lambda done, total: print(f"\r{done}/{total} chunks", end="", flush=True))
+    print(f"\n{args.command}: {count} chunks")
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,21 @@ import pandas as pd
 import os, json, re, io
 from os import path
 import zipfile
-from utilities import utils, redisembeddings
+from utilities import utils, redisembeddings, webcache
+from utilities.tracing import setup_tracing
 from utilities.formrecognizer import analyze_read
-from utilities.azureblobstorage import upload_file, get_all_files, upsert_blob_metadata
+from utilities.azureblobstorage import upload_file, upload_files, get_all_files, upsert_blob_metadata
 import requests
 import mimetypes
 
+setup_tracing("qna-webapp")
+
 def calcular_embeddings():
     """
     Calcula y almacena embeddings para el texto en sesión
     """
-    embeddings = utils.chunk_and_embed(st.session_state['texto_documento'])
-    if embeddings:
-        # Almacenar embeddings en Redis
-        redisembeddings.set_document(embeddings)
+    # Calcular y almacenar embeddings en Redis (uno por chunk si el texto es largo)
+    if utils.add_embeddings(st.session_state['texto_documento'], ""):
         st.success("Embeddings calculados y almacenados correctamente")
         
         # Mostrar conteo de tokens
@@ -62,6 +63,8 @@ try:
         page_icon="🧠"
     )
 
+    webcache.initialize()
+
     # Sección 1: Añadir documento individual
     with st.expander("Añadir un documento a la base de conocimientos", expanded=True):
         st.info("Para documentos PDF grandes, usa la opción 'Añadir documentos en lote' más abajo.")
@@ -91,7 +94,7 @@ try:
                     st.success(f"Documento {nombre_archivo} añadido a la base de conocimientos.")
                 else:
                     # Procesar otros tipos de archivos
-                    if utils.convert_file_and_add_embeddings(url_archivo, nombre_archivo):
+                    if utils.convert_file_and_add_embeddings(url_archivo, nombre_archivo, data=bytes_data):
                         st.success(f"Documento {nombre_archivo} procesado y añadido a la base de conocimientos.")
                     else:
                         st.error(f"Error al procesar el documento {nombre_archivo}")
@@ -120,31 +123,47 @@ try:
         )
         
         if archivos_subidos:
-            for archivo in archivos_subidos:
-                bytes_data = archivo.getvalue()
-                nombre_archivo = archivo.name
-                tipo_contenido = mimetypes.MimeTypes().guess_type(nombre_archivo)[0]
-                upload_file(bytes_data, nombre_archivo, content_type=tipo_contenido)
-                st.success(f"Archivo {nombre_archivo} subido correctamente")
+            # Cada ejecución de la página repite el bucle: solo se suben los archivos nuevos de la sesión
+            subidos = st.session_state.setdefault('archivos_lote_subidos', set())
+            nuevos = [archivo for archivo in archivos_subidos if (archivo.name, archivo.size) not in subidos]
+            if nuevos:
+                barra = st.progress(0)
+                estado = st.empty()
+
+                def mostrar_progreso(archivos):
+                    enviados = sum(archivo['sent'] for archivo in archivos)
+                    total = sum(archivo['bytes'] for archivo in archivos) or 1
+                    completados = sum(1 for archivo in archivos if archivo['done'])
+                    barra.progress(min(100, int(100 * enviados / total)))
+                    estado.text(f"{completados}/{len(archivos)} archivos, {enviados / 2**20:.1f} de {total / 2**20:.1f} MB")
+
+                # Los archivos se envían en paralelo directamente desde el buffer de subida, sin copiarlos
+                resultados = upload_files([(archivo, archivo.name, mimetypes.MimeTypes().guess_type(archivo.name)[0]) for archivo in nuevos],
+                                          progress=mostrar_progreso)
+                for archivo, resultado in zip(nuevos, resultados):
+                    if resultado['error']:
+                        st.error(f"Error subiendo {resultado['name']}: {resultado['error']}")
+                    else:
+                        subidos.add((archivo.name, archivo.size))
+                        st.success(f"Archivo {resultado['name']} subido correctamente ({resultado['seconds']:.1f}s)")
         
         st.button("Procesar todos los archivos", on_click=procesar_archivos_remotos,
                   help="Inicia el procesamiento asincrónico de todos los archivos subidos")
 
     # Sección 4: Gestión de documentos
     with st.expander("Documentos en la Base de Conocimientos", expanded=False):
-        # Obtener documentos de Redis
-        documentos = redisembeddings.get_documents()
+        # Obtener documentos de Redis (caché del proceso, compartida entre sesiones)
+        documentos = webcache.get_documents()
         
         if len(documentos) == 0:
             st.info("No se encontraron documentos. Añade contenido usando las opciones superiores.")
         else:
             # Mostrar tabla con documentos
-            df = pd.DataFrame(documentos)
-            st.dataframe(df[['filename', 'text']].head(1000), height=400)
+            st.dataframe(documentos[['filename', 'text']].head(1000), height=400)
             
-            # Opción para eliminar documentos
-            documentos_lista = [doc['filename'] for doc in documentos]
-            seleccionado = st.selectbox("Seleccionar documento para eliminar", documentos_lista, key='documento_a_eliminar')
+            # Opción para eliminar documentos, por ID y mostrando el nombre del fragmento
+            nombres = dict(zip(documentos['id'], documentos['filename']))
+            seleccionado = st.selectbox("Seleccionar documento para eliminar", list(nombres), format_func=nombres.get, key='documento_a_eliminar')
             st.button("Eliminar documento seleccionado", on_click=eliminar_documento, 
                       help="Elimina permanentemente el documento de la base de conocimientos")
 
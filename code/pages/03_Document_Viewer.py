@@ -1,10 +1,14 @@
 import streamlit as st
 from urllib.error import URLError
 import pandas as pd
-from utilities.azureblobstorage import get_all_files
-from utilities import utils
+from utilities.azureblobstorage import ensure_catalog, sync_catalog
+from utilities.webcache import list_files
+from utilities.tracing import setup_tracing
+from utilities import utils, convertedtext
 import os
 
+setup_tracing("qna-webapp")
+
 ########## INICIO - PRINCIPAL ##########
 try:
     # Configurar página
@@ -47,63 +51,88 @@ try:
         st.error("Error de conexión con el servicio de embeddings. Verifica la configuración.")
         st.stop()
 
-    # Obtener y mostrar documentos
+    # Obtener y mostrar documentos, una página del catálogo cada vez
     st.subheader("Documentos en el repositorio")
+    TAMANO_PAGINA = 100
+    columnas = ['filename', 'tamaño', 'modificado', 'converted', 'embeddings_added']
+    nombres_columnas = {
+        'filename': 'Nombre',
+        'tamaño': 'Tamaño',
+        'modificado': 'Última Modificación',
+        'converted': 'Convertido',
+        'embeddings_added': 'Embeddings'
+    }
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        termino = st.text_input("Buscar por nombre:")
+    with col2:
+        st.text("")  # Espaciador
+        if st.button("Sincronizar", help="Vuelve a leer el contenedor de Blob Storage para incluir archivos subidos fuera de la aplicación"):
+            with st.spinner("Sincronizando catálogo..."):
+                sync_catalog()
+
     with st.spinner("Cargando documentos..."):
-        documentos = get_all_files()
-        
-        if documentos.empty:
+        ensure_catalog()
+        _, total = list_files(0, 0, search=termino)
+        _, total_convertidos = list_files(0, 0, converted=True)
+        _, total_embeddings = list_files(0, 0, embeddings_added=True)
+
+        if total == 0:
             st.info("No se encontraron documentos. Sube archivos usando la opción 'Añadir Documentos'.")
             st.stop()
-        
+
+        paginas = max(1, -(-total // TAMANO_PAGINA))
+        pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1)
+        archivos, _ = list_files((pagina - 1) * TAMANO_PAGINA, TAMANO_PAGINA, search=termino)
+        documentos = pd.DataFrame(archivos)
+
         # Procesar metadatos
         documentos['tamaño'] = documentos['size'].apply(lambda x: f"{x/1024:.1f} KB")
-        documentos['subido'] = pd.to_datetime(documentos['creation_time']).dt.strftime('%Y-%m-%d %H:%M')
-        
+        documentos['modificado'] = pd.to_datetime(documentos['last_modified'], unit='s').dt.strftime('%Y-%m-%d %H:%M')
+
         # Mostrar tabla con documentos
-        columnas = ['name', 'tamaño', 'subido', 'converted', 'embeddings_added']
-        documentos_mostrar = documentos[columnas].rename(columns={
-            'name': 'Nombre',
-            'tamaño': 'Tamaño',
-            'subido': 'Fecha de Subida',
-            'converted': 'Convertido',
-            'embeddings_added': 'Embeddings'
-        })
-        
         st.dataframe(
-            documentos_mostrar,
+            documentos[columnas].rename(columns=nombres_columnas),
             use_container_width=True,
             height=600
         )
-        
+
         # Estadísticas
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total Documentos", len(documentos))
-        col2.metric("Documentos Procesados", documentos['converted'].sum())
-        col3.metric("Con Embeddings", documentos['embeddings_added'].sum())
-        
-        # Filtros de búsqueda
-        with st.expander("Buscar Documentos", expanded=False):
-            termino = st.text_input("Buscar por nombre:")
-            if termino:
-                filtrados = documentos[documentos['name'].str.contains(termino, case=False)]
-                st.dataframe(filtrados[columnas].rename(columns={
-                    'name': 'Nombre',
-                    'tamaño': 'Tamaño',
-                    'subido': 'Fecha de Subida',
-                    'converted': 'Convertido',
-                    'embeddings_added': 'Embeddings'
-                }))
-        
-        # Descargar lista completa
+        col1.metric("Total Documentos", total)
+        col2.metric("Documentos Procesados", total_convertidos)
+        col3.metric("Con Embeddings", total_embeddings)
+
+        # Descargar la página actual
         csv = documentos[columnas].to_csv(index=False).encode('utf-8')
         st.download_button(
-            label="Descargar lista completa (CSV)",
+            label="Descargar página (CSV)",
             data=csv,
-            file_name="documentos.csv",
+            file_name=f"documentos_{pagina}.csv",
             mime="text/csv"
         )
 
+    # Texto convertido, leído por rangos: solo se descargan los fragmentos que se muestran
+    convertidos = [archivo['filename'] for archivo in archivos if archivo['converted']]
+    if convertidos:
+        st.subheader("Texto convertido")
+        FRAGMENTOS_POR_VISTA = 5
+        seleccionado = st.selectbox("Documento:", convertidos)
+        indice = convertedtext.read_index(seleccionado)
+        # Los documentos convertidos con el formato ZIP anterior no tienen índice
+        vistas = max(1, -(-len(indice['chunks']) // FRAGMENTOS_POR_VISTA)) if indice else None
+        vista = st.number_input(f"Fragmentos ({FRAGMENTOS_POR_VISTA} por vista), vista" + (f" de {vistas}" if vistas else ""),
+                                min_value=1, max_value=vistas, value=1)
+        inicio = (vista - 1) * FRAGMENTOS_POR_VISTA
+        with st.spinner("Leyendo texto convertido..."):
+            fragmentos = convertedtext.read_chunks(seleccionado, inicio, inicio + FRAGMENTOS_POR_VISTA, indice)
+        if not fragmentos:
+            st.info("No hay texto convertido en esta vista.")
+        for posicion, fragmento in enumerate(fragmentos, inicio):
+            paginas = f", páginas {fragmento['pages'][0]}-{fragmento['pages'][1]}" if fragmento.get('pages') else ""
+            st.text_area(f"Fragmento {fragmento['index']}{paginas}", fragmento['text'], height=200, key=f"fragmento_{seleccionado}_{posicion}")
+
 except URLError as e:
     st.error(
         f"""
@@ -1,9 +1,12 @@
 import streamlit as st
 from urllib.error import URLError
 import pandas as pd
-from utilities import redisembeddings
+from utilities import redisembeddings, webcache
+from utilities.tracing import setup_tracing
 import os
 
+setup_tracing("qna-webapp")
+
 def eliminar_documento():
     """
     Elimina un documento de la base de conocimientos usando su ID
@@ -13,18 +16,31 @@ def eliminar_documento():
         if redisembeddings.delete_document(id_documento):
             st.success(f"Documento con ID {id_documento} eliminado correctamente")
             # Actualizar los datos mostrados
-            st.session_state.documentos = obtener_documentos()
+            webcache.invalidate_documents()
             st.experimental_rerun()
         else:
             st.error(f"Error al eliminar el documento con ID {id_documento}")
 
+def eliminar_archivo():
+    """
+    Elimina todos los fragmentos de un archivo de la base de conocimientos
+    """
+    if 'archivo_a_eliminar' in st.session_state:
+        archivo = st.session_state['archivo_a_eliminar']
+        eliminados = redisembeddings.delete_file(archivo)
+        if eliminados:
+            st.success(f"Se eliminaron {eliminados} fragmentos del archivo {archivo}")
+            webcache.invalidate_documents()
+        else:
+            st.error(f"No se encontraron fragmentos del archivo {archivo}")
+
 def obtener_documentos():
     """
-    Obtiene todos los documentos de Redis y los convierte en DataFrame
+    Obtiene todos los documentos de Redis como DataFrame, compartido entre sesiones
     """
-    documentos = redisembeddings.get_documents()
-    if documentos:
-        return pd.DataFrame(documentos)
+    documentos = webcache.get_documents()
+    if documentos is not None and len(documentos) > 0:
+        return documentos
     return pd.DataFrame()
 
 try:
@@ -53,12 +69,11 @@ try:
     Cada entrada representa un fragmento de texto con su representación vectorial asociada.
     """)
     
-    # Obtener documentos (con caché para mejorar rendimiento)
-    if 'documentos' not in st.session_state:
-        with st.spinner("Cargando embeddings..."):
-            st.session_state.documentos = obtener_documentos()
-    
-    documentos = st.session_state.documentos
+    webcache.initialize()
+
+    # Obtener documentos (caché del proceso, una sola copia para todas las sesiones)
+    with st.spinner("Cargando embeddings..."):
+        documentos = obtener_documentos()
     
     # Mostrar mensaje si no hay documentos
     if documentos.empty:
@@ -73,6 +88,8 @@ try:
     col1, col2, col3 = st.columns(3)
     col1.metric("Total Documentos", len(documentos))
     col2.metric("Campos por Documento", len(documentos.columns) if not documentos.empty else 0)
+    activo, en_construccion = redisembeddings.get_index_state()
+    col3.metric("Índice activo", activo.name, f"migrando a {en_construccion.name}" if en_construccion else None, delta_color="off")
     
     # Sección de gestión
     with st.expander("Gestión de Documentos", expanded=True):
@@ -85,7 +102,7 @@ try:
                 data=documentos.to_csv(index=False, encoding='utf-8'),
                 file_name="embeddings.csv",
                 mime="text/csv",
-                help="Descarga todos los embeddings en formato CSV"
+                help="Descarga el texto de los fragmentos en CSV, sin vectores. Para una copia completa del índice usa index_snapshot.py"
             )
         
         with col2:
@@ -110,6 +127,27 @@ try:
                 help="Elimina permanentemente el documento seleccionado"
             )
     
+    # Eliminar todos los fragmentos de un archivo
+    if 'filename' in documentos.columns:
+        with st.expander("Eliminar Archivo Completo"):
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                archivos = sorted(documentos['filename'].dropna().map(redisembeddings.get_source_filename).unique())
+                st.selectbox(
+                    "Selecciona un archivo para eliminar todos sus fragmentos",
+                    options=archivos,
+                    key='archivo_a_eliminar'
+                )
+            with col2:
+                st.text("")  # Espaciador
+                st.text("")  # Espaciador
+                st.button(
+                    "Eliminar Archivo",
+                    on_click=eliminar_archivo,
+                    type="primary",
+                    help="Elimina permanentemente todos los fragmentos del archivo seleccionado"
+                )
+
     # Información adicional
     st.info("""
     **Notas:**
@@ -2,7 +2,11 @@ import streamlit as st
 from urllib.error import URLError
 import os
 import pandas as pd
+from datetime import datetime
 from utilities import utils
+from utilities.tracing import setup_tracing
+
+setup_tracing("qna-webapp")
 
 try:
     # Configuración de la página
@@ -88,11 +92,12 @@ try:
             os.environ['OPENAI_API_KEY'] = new_api_key
             os.environ['OPENAI_API_VERSION'] = new_api_version
             os.environ['OPENAI_EMBEDDINGS_ENGINE_DOC'] = new_embeddings_engine
+            utils.initialize()
             st.success("¡Configuración guardada correctamente!")
         
         if test_connection:
             with st.spinner("Probando conexión con OpenAI..."):
-                if utils.initialize():
+                if utils.initialize(force=True) and utils.check_openai_health():
                     st.success("Conexión exitosa con el servicio de OpenAI")
                 else:
                     st.error("Error al conectar con OpenAI. Verifica la configuración.")
@@ -126,8 +131,19 @@ try:
         
         # Información de estado
         st.markdown("### Verificación de Servicios")
+        # Estado de salud en caché, actualizado en segundo plano por utils.initialize()
+        utils.initialize()
+        salud = utils.get_health_state()
+        if salud['healthy'] is None:
+            estado_openai = "Verificación pendiente"
+        elif salud['healthy']:
+            estado_openai = f"Conectado ({salud['models']} modelos)"
+        else:
+            estado_openai = f"❌ Error: {salud['error']}"
+        if salud['checked_at']:
+            estado_openai += f" · última verificación {datetime.fromtimestamp(salud['checked_at']).strftime('%H:%M:%S')}"
         services_status = {
-            "Azure OpenAI": "Conectado" if os.getenv('OPENAI_API_BASE') else "❌ No configurado",
+            "Azure OpenAI": estado_openai,
             "Azure Storage": "Conectado" if os.getenv('AZURE_STORAGE_ACCOUNT') else "❌ No configurado",
             "Redis Database": "Conectado" if os.getenv('REDIS_HOST') else "❌ No configurado"
         }
@@ -1,7 +1,10 @@
 import streamlit as st
-from utilities import utils
+from utilities import summarizer, webcache
+from utilities.tracing import setup_tracing
 import os
 
+setup_tracing("qna-webapp")
+
 # Configuración de la página
 st.set_page_config(
     page_title="Resumen de Documentos",
@@ -64,62 +67,77 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Modelo configurado para los resúmenes
+MODEL = os.getenv('OPENAI_ENGINES', 'gpt-3.5-turbo-instruct')
+ORIGEN_TEXTO = "Texto pegado"
+ORIGEN_DOCUMENTO = "Documento guardado"
+ETAPAS = {"map": "Resumiendo fragmentos", "final": "Redactando el resumen final"}
+
 def generar_resumen():
-    """Genera el resumen usando el modelo de IA"""
-    with st.spinner("Generando resumen..."):
-        try:
-            # Obtener modelo configurado
-            model = os.getenv('OPENAI_ENGINES', 'gpt-3.5-turbo-instruct')
-            
-            # Generar respuesta
-            _, response = utils.get_completion(
-                prompt=obtener_prompt(),
-                max_tokens=500,
-                model=model
-            )
-            
-            if response and 'choices' in response and len(response['choices']) > 0:
-                st.session_state['resumen'] = response['choices'][0]['text'].encode().decode()
-            else:
-                st.session_state['resumen'] = "❌ Error: No se recibió respuesta válida"
-                
-        except Exception as e:
-            st.session_state['resumen'] = f"❌ Error: {str(e)}"
+    """Genera el resumen usando el modelo de IA, por fragmentos en paralelo si el texto es largo"""
+    barra = st.progress(0.0)
+    estado = st.empty()
+
+    def progreso(etapa, hechos, total):
+        nombre = ETAPAS.get(etapa) or f"Combinando resúmenes (nivel {etapa.split('-')[-1]})"
+        estado.caption(f"{nombre}: {hechos}/{total}")
+        barra.progress(hechos / total)
+
+    opciones = {
+        "style": st.session_state.get('tipo_resumen', summarizer.DEFAULT_STYLE),
+        "model": MODEL,
+        "max_tokens": 500,
+        "progress": progreso,
+    }
+    try:
+        if st.session_state.get('origen') == ORIGEN_DOCUMENTO:
+            documento = st.session_state.get('documento')
+            if not documento:
+                st.session_state['resumen'] = "❌ Error: Selecciona un documento"
+                return
+            resultado = summarizer.summarize_document(documento, **opciones)
+        else:
+            texto = st.session_state.get('texto', '')
+            if not texto.strip():
+                st.session_state['resumen'] = "❌ Error: Por favor ingresa algún texto para resumir"
+                return
+            resultado = summarizer.summarize_text(texto, **opciones)
+
+        if resultado['summary']:
+            st.session_state['resumen'] = resultado['summary']
+            st.session_state['detalle_resumen'] = resultado
+        else:
+            st.session_state['resumen'] = "❌ Error: No se recibió respuesta válida"
+    except Exception as e:
+        # Los fragmentos ya resumidos quedan en caché para el siguiente intento
+        st.session_state['resumen'] = f"❌ Error: {str(e)}"
+    finally:
+        barra.empty()
+        estado.empty()
 
 def limpiar_resumen():
     """Borra el resumen de la sesión actual"""
     st.session_state.pop('resumen', None)
+    st.session_state.pop('detalle_resumen', None)
 
 def obtener_prompt():
     """Genera el prompt basado en el texto y tipo de resumen"""
-    texto = st.session_state.get('texto', '')
-    tipo_resumen = st.session_state.get('tipo_resumen', 'Resumen básico')
-    
-    if not texto:
-        return "Por favor ingresa algún texto para resumir"
-    
-    # Plantillas de prompts en español
-    prompts = {
-        "Resumen básico": f"Resume el siguiente texto de manera concisa:\n\n{texto}\n\nResumen:",
-        "Puntos clave": f"Extrae los puntos clave del siguiente texto en formato de lista con viñetas:\n\n{texto}\n\nPuntos clave:",
-        "Explicación sencilla": f"Explica el siguiente texto de manera simple, como si se lo estuvieras contando a un estudiante de secundaria:\n\n{texto}\n\nExplicación:",
-        "Resumen ejecutivo": f"Crea un resumen ejecutivo (máximo 100 palabras) del siguiente texto:\n\n{texto}\n\nResumen ejecutivo:",
-        "Análisis crítico": f"Realiza un análisis crítico del siguiente texto, destacando fortalezas y debilidades:\n\n{texto}\n\nAnálisis:"
-    }
-    
-    return prompts.get(tipo_resumen, prompts["Resumen básico"])
+    tipo_resumen = st.session_state.get('tipo_resumen', summarizer.DEFAULT_STYLE)
+    if st.session_state.get('origen') == ORIGEN_DOCUMENTO:
+        texto = f"[fragmentos de {st.session_state.get('documento') or 'el documento'}, o sus resúmenes parciales]"
+    else:
+        texto = st.session_state.get('texto', '')
+        if not texto:
+            return "Por favor ingresa algún texto para resumir"
+    return summarizer.style_prompt(tipo_resumen, texto)
+
+webcache.initialize(MODEL)
 
 # Título de la aplicación
 st.markdown('<div class="header"><h1>📝 Resumen de Documentos</h1><p>Genera resúmenes automáticos usando IA</p></div>', unsafe_allow_html=True)
 
 # Selector de tipo de resumen
-tipos_resumen = [
-    "Resumen básico",
-    "Puntos clave",
-    "Explicación sencilla",
-    "Resumen ejecutivo",
-    "Análisis crítico"
-]
+tipos_resumen = list(summarizer.SUMMARY_STYLES)
 
 st.selectbox(
     "Selecciona el tipo de resumen:",
@@ -129,14 +147,25 @@ st.selectbox(
     help="Elige cómo quieres que se genere el resumen"
 )
 
-# Área de texto para entrada
-st.text_area(
-    "Texto a resumir:",
-    height=250,
-    key='texto',
-    placeholder="Pega aquí el texto que deseas resumir...",
-    help="Ingresa cualquier texto que desees resumir o analizar"
-)
+st.radio("Origen del texto:", [ORIGEN_TEXTO, ORIGEN_DOCUMENTO], key='origen', horizontal=True)
+
+if st.session_state.get('origen') == ORIGEN_DOCUMENTO:
+    # Los fragmentos se leen de Redis; no hace falta el archivo original
+    st.selectbox(
+        "Documento a resumir:",
+        options=webcache.get_sources(),
+        key='documento',
+        help="Documentos ya añadidos a la base de conocimientos"
+    )
+else:
+    # Área de texto para entrada
+    st.text_area(
+        "Texto a resumir:",
+        height=250,
+        key='texto',
+        placeholder="Pega aquí el texto que deseas resumir...",
+        help="Ingresa cualquier texto que desees resumir o analizar"
+    )
 
 # Botones de acción
 col1, col2 = st.columns(2)
@@ -158,6 +187,10 @@ with col2:
 if 'resumen' in st.session_state:
     st.markdown("### Resultado del Resumen")
     st.markdown(f'<div class="result-card">{st.session_state["resumen"]}</div>', unsafe_allow_html=True)
+    detalle = st.session_state.get('detalle_resumen')
+    if detalle and detalle['chunks'] > 1:
+        st.caption(f"{detalle['chunks']} fragmentos, {detalle['levels']} niveles de combinación, "
+                   f"{detalle['completions']} llamadas al modelo y {detalle['cached']} resultados en caché")
 
 # Mostrar el prompt utilizado
 st.markdown("### Prompt Utilizado")
@@ -166,7 +199,7 @@ st.markdown(f'<div class="prompt-card">{obtener_prompt()}</div>', unsafe_allow_h
 # Sección de información adicional
 with st.expander("💡 Consejos para mejores resultados"):
     st.markdown("""
-    - **Textos largos**: Para documentos extensos (>1000 palabras), considera dividirlos en secciones
+    - **Textos largos**: Los documentos extensos se resumen por fragmentos en paralelo y luego se combinan
     - **Especificidad**: Cuanto más específico sea tu texto, mejor será el resumen
     - **Idioma**: La herramienta funciona mejor con textos en español
     - **Personalización**: Si necesitas un formato específico, menciónalo en el texto
@@ -2,8 +2,11 @@ import streamlit as st
 from urllib.error import URLError
 import pandas as pd
 from utilities import utils
+from utilities.tracing import setup_tracing
 import os
 
+setup_tracing("qna-webapp")
+
 def clear_summary():
     st.session_state['summary'] = ""
 
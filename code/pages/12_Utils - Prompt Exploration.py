@@ -1,9 +1,13 @@
 import streamlit as st
 import pandas as pd
-from utilities import utils, redisembeddings
+from utilities import utils, redisembeddings, webcache
+from utilities.batchprompts import run_prompt_batch
+from utilities.tracing import setup_tracing
 import os
 import json
 
+setup_tracing("qna-webapp")
+
 # Configuración de la página
 st.set_page_config(
     page_title="Explorador de Prompts - Comunidad Religiosa",
@@ -69,7 +73,8 @@ st.markdown("""
 def limpiar_resultados():
     """Borra los resultados de la sesión actual"""
     st.session_state.pop('resultado', None)
-    st.session_state.pop('resultados_procesados', None)
+    st.session_state.pop('trabajo', None)
+    st.session_state.pop('resumen_trabajo', None)
 
 def ejecutar_prompt():
     """Ejecuta el prompt en el documento actual"""
@@ -79,14 +84,14 @@ def ejecutar_prompt():
             modelo = os.getenv('OPENAI_ENGINES', 'gpt-3.5-turbo-instruct')
             
             # Generar respuesta
-            _, respuesta = utils.get_completion(
+            respuesta = utils.get_completion(
                 prompt=obtener_prompt(),
                 max_tokens=1000,
                 model=modelo
             )
             
-            if respuesta and 'choices' in respuesta and len(respuesta['choices']) > 0:
-                st.session_state['resultado'] = respuesta['choices'][0]['text'].encode().decode()
+            if respuesta:
+                st.session_state['resultado'] = respuesta
             else:
                 st.session_state['resultado'] = "❌ Error: No se recibió respuesta válida"
                 
@@ -95,7 +100,8 @@ def ejecutar_prompt():
 
 def procesar_todos():
     """Procesa todos los documentos seleccionados"""
-    if 'documentos' not in st.session_state or st.session_state['documentos'].empty:
+    documentos = webcache.get_documents()
+    if documentos.empty:
         st.error("No hay documentos disponibles para procesar")
         return
         
@@ -105,31 +111,27 @@ def procesar_todos():
         
     with st.spinner(f"Procesando {len(st.session_state['documentos_seleccionados'])} documentos..."):
         try:
-            resultados = []
             modelo = os.getenv('OPENAI_ENGINES', 'gpt-3.5-turbo-instruct')
+            seleccionados = documentos[documentos['filename'].map(redisembeddings.get_source_filename).isin(st.session_state['documentos_seleccionados'])]
+            barra = st.progress(0.0)
             
-            for _, doc in st.session_state['documentos'].iterrows():
-                if doc['filename'] in st.session_state['documentos_seleccionados']:
-                    prompt_completo = f"{doc['text']}\n{st.session_state['prompt']}"
-                    
-                    # Ejecutar prompt
-                    _, respuesta = utils.get_completion(
-                        prompt=prompt_completo,
-                        max_tokens=1000,
-                        model=modelo
-                    )
-                    
-                    if respuesta and 'choices' in respuesta and len(respuesta['choices']) > 0:
-                        resultado = respuesta['choices'][0]['text'].encode().decode()
-                        resultados.append({
-                            'id_documento': doc['id'],
-                            'nombre_documento': doc['filename'],
-                            'resultado': resultado
-                        })
+            # Los resultados se guardan en Redis a medida que terminan; si el proceso se
+            # interrumpe, volver a ejecutar el mismo prompt solo procesa los pendientes
+            resumen = run_prompt_batch(
+                seleccionados[['id', 'filename', 'text']].to_dict('records'),
+                prompt=st.session_state['prompt'],
+                model=modelo,
+                max_tokens=1000,
+                progress=lambda hechos, total: barra.progress(hechos / total if total else 1.0)
+            )
             
-            # Guardar resultados en sesión
-            st.session_state['resultados_procesados'] = pd.DataFrame(resultados)
-            st.success(f"Procesados {len(resultados)} documentos con éxito")
+            st.session_state['trabajo'] = resumen['job']
+            st.session_state['resumen_trabajo'] = resumen
+            st.session_state['pagina_resultados'] = 1
+            if resumen['failed']:
+                st.warning(f"Procesados {resumen['completed']} documentos, {resumen['failed']} con errores. Vuelve a procesar para reintentarlos.")
+            else:
+                st.success(f"Procesados {resumen['completed']} documentos con éxito ({resumen['skipped']} ya tenían resultado)")
             
         except Exception as e:
             st.error(f"Error al procesar documentos: {str(e)}")
@@ -145,12 +147,9 @@ def cargar_ejemplo_prompt(ejemplo):
 # Título de la aplicación
 st.markdown('<div class="header"><h1>⛪ Explorador de Prompts para Comunidades Religiosas</h1></div>', unsafe_allow_html=True)
 
-# Obtener documentos de Redis
-if 'documentos' not in st.session_state:
-    documentos = redisembeddings.get_documents()
-    st.session_state['documentos'] = documentos
-else:
-    documentos = st.session_state['documentos']
+# Obtener documentos de Redis (caché del proceso, una sola copia para todas las sesiones)
+webcache.initialize()
+documentos = webcache.get_documents()
 
 # Mostrar advertencia si no hay documentos
 if documentos.empty:
@@ -164,7 +163,7 @@ with col1:
     st.subheader("Documentos Disponibles")
     
     # Filtrar nombres base de documentos
-    nombres_base = sorted(set([doc.partition('_chunk_')[0] for doc in documentos['filename']]))
+    nombres_base = sorted(set([redisembeddings.get_source_filename(doc) for doc in documentos['filename']]))
     
     # Seleccionar documentos
     documentos_seleccionados = st.multiselect(
@@ -234,27 +233,34 @@ if 'resultado' in st.session_state:
     st.markdown("**Resultado del texto adicional:**")
     st.markdown(f'<div class="card">{st.session_state["resultado"]}</div>', unsafe_allow_html=True)
 
-# Resultados de documentos procesados
-if 'resultados_procesados' in st.session_state and not st.session_state['resultados_procesados'].empty:
-    st.markdown("**Resultados de documentos procesados:**")
+# Resultados de documentos procesados, leídos por páginas del índice de prompts
+if 'trabajo' in st.session_state:
+    TAMANO_PAGINA = 50
+    _, total_resultados = redisembeddings.get_prompt_results_page(0, 0, job=st.session_state['trabajo'])
+    paginas = max(1, -(-total_resultados // TAMANO_PAGINA))
+    pagina = st.number_input("Página de resultados", min_value=1, max_value=paginas, key='pagina_resultados')
+    resultados, _ = redisembeddings.get_prompt_results_page((pagina - 1) * TAMANO_PAGINA, TAMANO_PAGINA, job=st.session_state['trabajo'])
+
+if 'trabajo' in st.session_state and not resultados.empty:
+    st.markdown(f"**Resultados de documentos procesados** ({total_resultados} en total):")
     
     # Mostrar como tabla
-    st.dataframe(st.session_state['resultados_procesados'], height=300)
+    st.dataframe(resultados[['filename', 'result']], height=300)
     
     # Botón de descarga
-    csv = st.session_state['resultados_procesados'].to_csv(index=False).encode('utf-8')
+    csv = resultados.to_csv(index=False).encode('utf-8')
     st.download_button(
-        label="📥 Descargar resultados (CSV)",
+        label="📥 Descargar página (CSV)",
         data=csv,
-        file_name="resultados_prompts.csv",
+        file_name=f"resultados_prompts_{pagina}.csv",
         mime="text/csv"
     )
     
     # Mostrar detalles
     with st.expander("Ver detalles de resultados"):
-        for _, fila in st.session_state['resultados_procesados'].iterrows():
-            st.markdown(f"**Documento:** {fila['nombre_documento']}")
-            st.markdown(f'<div class="card">{fila["resultado"]}</div>', unsafe_allow_html=True)
+        for _, fila in resultados.iterrows():
+            st.markdown(f"**Documento:** {fila['filename']}")
+            st.markdown(f'<div class="card">{fila["result"]}</div>', unsafe_allow_html=True)
             st.divider()
 
 # JavaScript para cargar ejemplos
@@ -0,0 +1,84 @@
+import openai
+import pytest
+
+testclient = pytest.importorskip("starlette.testclient")
+
+import api
+from utilities import utils
+from utilities.redisembeddings import SearchResult, SearchResults
+
+KEY = "secret"
+RESULTS = SearchResults([SearchResult("doc:a", "The sky is blue.", "a.pdf_chunk_0", 0.1)])
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "API_KEY", KEY)
+    monkeypatch.setattr(api, "ALLOWED_MODELS", {api.DEFAULT_MODEL, "gpt-4"})
+    # Redis and OpenAI: the search behind both endpoints and the completion
+    searches, completions = [], []
+    monkeypatch.setattr(utils, "_search_redis", lambda query, n, language_mode, ef_runtime: searches.append((query, n)) or RESULTS)
+    monkeypatch.setattr(utils, "DEDUP_QUERY", False)
+
+    def completion(prompt, model, tokens_response, temperature):
+        completions.append((prompt, model, tokens_response))
+        return openai.util.convert_to_openai_object({"choices": [{"text": " Blue. "}], "usage": {"total_tokens": 10}})
+    monkeypatch.setattr(utils, "_answer_completion", completion)
+    # Not used as a context manager, so the startup hook (OpenAI and Redis checks) does not run
+    client = testclient.TestClient(api.app)
+    client.searches, client.completions = searches, completions
+    return client
+
+def auth(key=KEY):
+    return {"Authorization": f"Bearer {key}"}
+
+@pytest.mark.parametrize("path", ["/search", "/answer", "/ingest"])
+def test_missing_key_is_rejected(client, path):
+    response = client.post(path, json={"question": "q"})
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+def test_wrong_key_is_rejected(client):
+    assert client.post("/search", json={"question": "q"}, headers=auth("wrong")).status_code == 401
+    assert client.post("/search", json={"question": "q"}, headers={"X-API-Key": "wrong"}).status_code == 401
+    assert client.searches == []
+
+def test_no_configured_key_rejects_everything(client, monkeypatch):
+    monkeypatch.setattr(api, "API_KEY", None)
+    assert client.post("/search", json={"question": "q"}, headers=auth("")).status_code == 401
+
+@pytest.mark.parametrize("path, body", [
+    ("/search", {}),
+    ("/search", {"question": "q", "k": 0}),
+    ("/search", {"question": "q", "k": "many"}),
+    ("/search", {"questions": "q"}),
+    ("/answer", {"question": " "}),
+    ("/answer", {"question": "q", "temperature": 3}),
+    ("/answer", {"question": "q", "model": "some-other-deployment"}),
+    ("/ingest", {}),
+])
+def test_invalid_requests_are_rejected(client, path, body):
+    response = client.post(path, json=body, headers=auth())
+    assert response.status_code == 400
+    assert response.json()["error"]
+
+def test_body_must_be_a_json_object(client):
+    assert client.post("/search", content=b"not json", headers=auth()).status_code == 400
+    assert client.post("/search", json=["q"], headers=auth()).status_code == 400
+
+def test_search(client):
+    response = client.post("/search", json={"question": "What colour is the sky?", "k": 1}, headers={"X-API-Key": KEY})
+    assert response.status_code == 200
+    assert response.json() == {"results": RESULTS.to_dicts(), "error": None}
+    assert client.searches == [("What colour is the sky?", 1)]
+
+def test_answer(client):
+    response = client.post("/answer", json={"question": "What colour is the sky?", "model": "gpt-4", "max_tokens": 50}, headers=auth())
+    assert response.status_code == 200
+    assert response.json() == {"answer": "Blue.", "sources": "Fuentes:\n- a.pdf_chunk_0", "usage": {"total_tokens": 10}}
+    prompt, model, max_tokens = client.completions[0]
+    assert "The sky is blue." in prompt and "What colour is the sky?" in prompt
+    assert (model, max_tokens) == ("gpt-4", 50)
+
+def test_answer_uses_the_default_model(client):
+    assert client.post("/answer", json={"question": "q"}, headers=auth()).status_code == 200
+    assert client.completions[0][1] == api.DEFAULT_MODEL
@@ -0,0 +1,64 @@
+import io
+import time
+
+import pytest
+from azure.storage.blob import BlobClient, BlobServiceClient
+
+from utilities import azureblobstorage
+
+@pytest.fixture(autouse=True)
+def account(monkeypatch):
+    monkeypatch.setenv("BLOB_CONTAINER_NAME", "documents")
+    client = BlobServiceClient(account_url="https://account.blob.core.windows.net")
+    monkeypatch.setattr(azureblobstorage, "get_blob_service_client", lambda: client)
+
+@pytest.mark.parametrize("url, name", [
+    ("https://account.blob.core.windows.net/documents/report.pdf?sv=2021&sig=x", "report.pdf"),
+    ("https://ACCOUNT.blob.core.windows.net/documents/Q1%20report%2C%20final.pdf", "Q1 report, final.pdf"),
+    ("https://account.blob.core.windows.net/other/report.pdf", None),
+    ("https://account.blob.core.windows.net/documents-old/report.pdf", None),
+    ("https://evil.example.com/documents/report.pdf", None),
+    ("http://account.blob.core.windows.net/documents/report.pdf", None),
+    ("http://169.254.169.254/metadata/instance", None),
+    ("https://account.blob.core.windows.net/documents/converted/report.pdf.chunks", None),
+    ("https://account.blob.core.windows.net/documents/", None),
+])
+def test_only_blobs_of_the_configured_container_are_accepted(url, name):
+    assert azureblobstorage.blob_name_from_url(url) == name
+
+@pytest.fixture
+def uploads(monkeypatch):
+    monkeypatch.setenv("BLOB_ACCOUNT_NAME", "account")
+    monkeypatch.setenv("BLOB_ACCOUNT_KEY", "a2V5")
+    catalogued = []
+    monkeypatch.setattr(azureblobstorage.blobcatalog, "upsert_entry", lambda name, **fields: catalogued.append(name))
+
+    def upload_blob(self, data, length=None, progress_hook=None, **kwargs):
+        # Later files finish first, and the hook only reports half of each file
+        time.sleep({"a.pdf": 0.2, "b.pdf": 0.1}.get(self.blob_name, 0))
+        if self.blob_name == "bad.pdf":
+            raise IOError("connection reset")
+        progress_hook(length // 2, length)
+        return {"etag": '"0x1"', "last_modified": None}
+    monkeypatch.setattr(BlobClient, "upload_blob", upload_blob)
+    return catalogued
+
+def test_upload_files_keeps_the_order_and_survives_a_failure(uploads):
+    files = [(b"a" * 10, "a.pdf", "application/pdf"), (io.BytesIO(b"b" * 20), "b.pdf", "application/pdf"),
+             (b"x" * 5, "bad.pdf", "application/pdf"), (b"c" * 30, "c.txt", "text/plain")]
+    snapshots = []
+
+    statuses = azureblobstorage.upload_files(files, workers=4, progress=lambda statuses: snapshots.append([dict(s) for s in statuses]))
+
+    assert [status["name"] for status in statuses] == ["a.pdf", "b.pdf", "bad.pdf", "c.txt"]
+    assert all(status["done"] and status["seconds"] is not None for status in statuses)
+    failed = statuses[2]
+    assert failed["error"] == "connection reset" and failed["url"] is None and failed["sent"] == 0
+    for status in statuses[:2] + statuses[3:]:
+        assert status["error"] is None
+        assert status["url"].startswith(f"https://account.blob.core.windows.net/documents/{status['name']}?")
+        assert status["sent"] == status["bytes"]
+    assert [status["bytes"] for status in statuses] == [10, 20, 5, 30]
+    assert sorted(uploads) == ["a.pdf", "b.pdf", "c.txt"]
+    # The last callback sees every file finished
+    assert snapshots and all(status["done"] for status in snapshots[-1])
@@ -0,0 +1,92 @@
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+
+from utilities import convertedtext
+
+class FakeDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def chunks(self):
+        for start in range(0, len(self.data), 7):
+            yield self.data[start:start + 7]
+
+class FakeBlobClient:
+    def __init__(self, store, name):
+        self.store, self.name = store, name
+        self.staged = {}
+
+    def stage_block(self, block_id, data):
+        self.staged[block_id] = data
+
+    def commit_block_list(self, blocks, content_settings=None):
+        self.store[self.name] = b"".join(self.staged[block.id] for block in blocks)
+
+    def upload_blob(self, data, overwrite=False, content_settings=None):
+        self.store[self.name] = data.encode() if isinstance(data, str) else data
+
+    def download_blob(self, offset=None, length=None):
+        if self.name not in self.store:
+            raise ResourceNotFoundError("missing")
+        self.store.reads.append((self.name, offset, length))
+        data = self.store[self.name]
+        return FakeDownload(data if offset is None else data[offset:offset + length])
+
+class FakeStore(dict):
+    def __init__(self):
+        super().__init__()
+        self.reads = []
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(convertedtext, "_blob_client", lambda name: FakeBlobClient(store, name))
+    return store
+
+def write(compression, count=10):
+    # A small block size so the records span several staged blocks
+    writer = convertedtext.ConvertedTextWriter("doc.pdf", compression=compression, block_size=64)
+    for i in range(count):
+        writer.add(i, f"text of chunk {i} " * (i + 1), pages=(i + 1, i + 2))
+    return writer.close()
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+def test_read_chunk_by_index(store, compression):
+    index = write(compression)
+    store.reads.clear()
+
+    chunk = convertedtext.read_chunk("doc.pdf", 3, index)
+    assert chunk == {"index": 3, "text": "text of chunk 3 " * 4, "pages": [4, 5]}
+    entry = index["chunks"][3]
+    assert store.reads == [("converted/doc.pdf.chunks", entry["offset"], entry["length"])]
+    assert convertedtext.read_chunk("doc.pdf", 42, index) is None
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+def test_read_chunks_by_range(store, compression):
+    write(compression)
+    store.reads.clear()
+
+    chunks = convertedtext.read_chunks("doc.pdf", 2, 5)
+    assert [chunk["index"] for chunk in chunks] == [2, 3, 4]
+    assert [chunk["text"] for chunk in chunks] == [f"text of chunk {i} " * (i + 1) for i in (2, 3, 4)]
+    # The index, then one range request for the three records
+    reads = list(store.reads)
+    index = convertedtext.read_index("doc.pdf")
+    first, last = index["chunks"][2], index["chunks"][4]
+    assert reads[0] == ("converted/doc.pdf.chunks.json", None, None)
+    assert reads[1:] == [("converted/doc.pdf.chunks", first["offset"], last["offset"] + last["length"] - first["offset"])]
+
+def test_read_chunks_past_the_end(store):
+    index = write("zlib", count=3)
+    assert [chunk["index"] for chunk in convertedtext.read_chunks("doc.pdf", 2, 10, index)] == [2]
+    assert convertedtext.read_chunks("doc.pdf", 5, 10, index) == []
+
+def test_iter_chunks_matches_the_range_reads(store):
+    index = write("zlib")
+    assert list(convertedtext.iter_chunks("doc.pdf", index)) == convertedtext.read_chunks("doc.pdf", 0, 10, index)
+
+def test_missing_index(store):
+    assert convertedtext.read_index("other.pdf") is None
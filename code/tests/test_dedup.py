@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utilities import dedup, redisembeddings
+from utilities.redisembeddings import SearchResult, SearchResults, document_key, set_document
+
+TEXT = " ".join(f"word{i}" for i in range(200))
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    conn = fakeredis.FakeRedis()
+    monkeypatch.setattr(redisembeddings, "get_redis_conn", lambda: conn)
+    monkeypatch.setattr(dedup, "DEDUP_MODE", "link")
+    return conn
+
+def ingest(filename, text=TEXT):
+    item = {"text": text, "filename": filename, "language": "en", "search_embeddings": [0.1, 0.2]}
+    if dedup.check_chunk(item, redisembeddings.get_redis_conn()):
+        dedup.link_duplicate(item, redisembeddings.get_redis_conn())
+    else:
+        set_document(item)
+    return item
+
+def test_duplicate_is_stored_as_a_reference(redis_conn):
+    original = ingest("a.pdf_chunk_0")
+    copy = ingest("b.pdf_chunk_0")
+
+    assert copy["duplicate_of"] == document_key(original)
+    record = redis_conn.hgetall(document_key(copy))
+    assert record[b"source"] == b"b.pdf"
+    assert record[b"text"] == TEXT.encode()
+    assert b"embeddings" not in record
+    assert redis_conn.smembers(f"dedup:links:{document_key(original)}") == {document_key(copy).encode()}
+
+def test_chunks_of_the_same_file_are_not_candidates(redis_conn):
+    ingest("a.pdf_chunk_0")
+    assert "duplicate_of" not in ingest("a.pdf_chunk_1")
+
+def test_deleting_the_original_hands_the_passage_over(redis_conn):
+    original, first, second = ingest("a.pdf_chunk_0"), ingest("b.pdf_chunk_0"), ingest("c.pdf_chunk_0")
+    redisembeddings.delete_document(document_key(original))
+
+    heir, other = sorted([document_key(first), document_key(second)])
+    assert redis_conn.hget(heir, "embeddings") is not None
+    assert redis_conn.hget(heir, "duplicate_of") is None
+    assert redis_conn.hget(other, "duplicate_of") == heir.encode()
+    assert redis_conn.smembers(f"dedup:links:{heir}") == {other.encode()}
+    assert not redis_conn.exists(f"dedup:links:{document_key(original)}")
+    # The heir is now the one later duplicates match
+    assert ingest("d.pdf_chunk_0")["duplicate_of"] == heir
+
+def test_deleted_chunks_leave_their_buckets(redis_conn):
+    original = ingest("a.pdf_chunk_0")
+    redisembeddings.delete_document(document_key(original))
+    for key in redis_conn.scan_iter(match="dedup:*"):
+        assert document_key(original).encode() not in redis_conn.smembers(key)
+    assert "duplicate_of" not in ingest("b.pdf_chunk_0")
+
+def test_collapse_uses_the_stored_signatures(redis_conn, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_MODE", "off")
+    first, second = ingest("a.pdf_chunk_0"), ingest("b.pdf_chunk_0")
+    results = SearchResults([SearchResult(document_key(first), TEXT, "a.pdf_chunk_0", 0.1),
+                             SearchResult(document_key(second), TEXT, "b.pdf_chunk_0", 0.2)])
+    monkeypatch.setattr(dedup, "signature", lambda text: pytest.fail("signature recomputed"))
+
+    collapsed = dedup.collapse(results, redis_conn=redis_conn)
+    assert [result.filename for result in collapsed] == ["a.pdf_chunk_0"]
+    assert isinstance(collapsed, SearchResults)
@@ -0,0 +1,52 @@
+import threading
+
+import numpy as np
+import pytest
+
+from utilities import embeddingmodels
+
+@pytest.fixture
+def override(monkeypatch):
+    monkeypatch.setattr(embeddingmodels, "EMBEDDINGS_BACKEND", "openai")
+    monkeypatch.setenv("OPENAI_EMBEDDINGS_ENGINE_DOC", "my-ada-deployment")
+    monkeypatch.setattr(embeddingmodels, "EMBEDDINGS_DIMENSION", "1536")
+    embeddingmodels.embedding_dimension.cache_clear()
+    yield
+    embeddingmodels.embedding_dimension.cache_clear()
+
+def test_override_applies_to_the_configured_document_engine(override):
+    assert embeddingmodels.embedding_dimension() == 1536
+    assert embeddingmodels.embedding_dimension("my-ada-deployment") == 1536
+
+def test_other_engines_keep_their_dimension(override):
+    assert embeddingmodels.embedding_dimension("text-embedding-3-large") == 3072
+
+class WindowTokenizer:
+    """Whitespace tokenizer with the windowing output of a fast tokenizer; token ids are the numbers in the text."""
+    is_fast = True
+
+    def __call__(self, texts, padding, truncation, max_length, return_tensors, return_overflowing_tokens):
+        windows, samples = [], []
+        for sample, text in enumerate(texts):
+            ids = [int(word) for word in text.split()]
+            for start in range(0, len(ids), max_length):
+                windows.append(ids[start:start + max_length])
+                samples.append(sample)
+        width = max(map(len, windows))
+        return {
+            "input_ids": np.array([ids + [0] * (width - len(ids)) for ids in windows]),
+            "attention_mask": np.array([[1] * len(ids) + [0] * (width - len(ids)) for ids in windows]),
+            "overflow_to_sample_mapping": np.array(samples),
+        }
+
+def test_long_texts_are_embedded_in_windows(monkeypatch):
+    model = embeddingmodels.LocalEmbeddingModel.__new__(embeddingmodels.LocalEmbeddingModel)
+    model.name, model.batch_size, model.max_length, model.dimension = "fake", 2, 2, 2
+    model.tokenizer = WindowTokenizer()
+    model._lock = threading.Lock()
+    # Each token's hidden state is (id, 1): the pooled vector is (mean id over every window, 1)
+    model._run = lambda batch: np.stack([batch["input_ids"], np.ones_like(batch["input_ids"])], axis=-1).astype(np.float32)
+
+    vectors = model.embed(["1 2 3 4 5", "7"])
+    expected = np.array([[3.0, 1.0], [7.0, 1.0]])
+    np.testing.assert_allclose(vectors, expected / np.linalg.norm(expected, axis=1, keepdims=True), rtol=1e-6)
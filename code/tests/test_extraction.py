@@ -0,0 +1,38 @@
+from utilities import extraction
+
+class Response:
+    def __init__(self, blocks, headers):
+        self.blocks, self.headers = blocks, headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield from self.blocks
+
+def extract(monkeypatch, response, data=None):
+    sent_to_ocr = []
+    monkeypatch.setattr(extraction, "LOCAL_EXTRACTION_MAX_BYTES", 10)
+    monkeypatch.setattr(extraction.requests, "get", lambda url, **kwargs: response)
+    monkeypatch.setattr(extraction, "extract_pages", lambda path, extension: ["text " * 20])
+    monkeypatch.setattr(extraction, "iter_analyze_read", lambda url: iter(sent_to_ocr.append(url) or []))
+    list(extraction.iter_extract("https://blob/doc.pdf", "doc.pdf", data))
+    return sent_to_ocr
+
+def test_declared_size_over_the_limit_goes_to_form_recognizer(monkeypatch):
+    assert extract(monkeypatch, Response([b"x" * 20], {"Content-Length": "20"})) == ["https://blob/doc.pdf"]
+
+def test_download_growing_past_the_limit_goes_to_form_recognizer(monkeypatch):
+    assert extract(monkeypatch, Response([b"x" * 6, b"x" * 6], {})) == ["https://blob/doc.pdf"]
+
+def test_uploaded_data_over_the_limit_goes_to_form_recognizer(monkeypatch):
+    assert extract(monkeypatch, None, data=b"x" * 11) == ["https://blob/doc.pdf"]
+
+def test_small_documents_are_read_locally(monkeypatch):
+    assert extract(monkeypatch, Response([b"x" * 6], {"Content-Length": "6"})) == []
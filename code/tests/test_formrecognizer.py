@@ -0,0 +1,42 @@
+import pytest
+from azure.core.exceptions import HttpResponseError, ODataV4Format
+
+from utilities import formrecognizer
+
+class Page:
+    pass
+
+class Layout:
+    def __init__(self, pages):
+        self.pages = [Page() for _ in range(pages)]
+        self.paragraphs = []
+        self.tables = []
+
+class Poller:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def result(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+def error(code, message):
+    e = HttpResponseError(message=f"({code}) {message}")
+    e.error = ODataV4Format({"code": "InvalidRequest", "message": "Invalid request.", "innererror": {"code": code, "message": message}})
+    return e
+
+def analyze(monkeypatch, outcomes):
+    class Client:
+        def begin_analyze_document_from_url(self, model, url, pages):
+            return Poller(outcomes.pop(0))
+    monkeypatch.setattr(formrecognizer, "_get_client", Client)
+    return list(formrecognizer.iter_analyze_read("url", pages_per_request=2, concurrent_requests=1))
+
+def test_stops_at_a_window_past_the_last_page(monkeypatch):
+    past_end = error("InvalidParameter", "The parameter pages is invalid: The page range exceeds the number of pages in the document.")
+    assert analyze(monkeypatch, [Layout(2), past_end]) == []
+
+def test_other_errors_after_the_first_window_are_raised(monkeypatch):
+    with pytest.raises(HttpResponseError):
+        analyze(monkeypatch, [Layout(2), error("InternalServerError", "An unexpected error occurred.")])
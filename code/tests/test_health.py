@@ -0,0 +1,31 @@
+import threading
+import time
+
+import pytest
+
+from utilities import utils
+
+class Models:
+    data = [object()]
+
+@pytest.fixture(autouse=True)
+def health_thread(monkeypatch):
+    yield
+    # Depends on monkeypatch so the thread stops before the real openai.Model.list is restored
+    utils.shutdown_health_check()
+    assert not any(thread.name == "openai-healthcheck" for thread in threading.enumerate())
+
+def test_health_is_probed_again_without_another_initialize(monkeypatch):
+    calls = []
+    monkeypatch.setenv("OPENAI_API_BASE", "https://example.openai.azure.com/")
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setattr(utils, "OPENAI_HEALTHCHECK_INTERVAL", 0.05)
+    monkeypatch.setattr(utils.openai.Model, "list", lambda: calls.append(1) or Models())
+
+    # Streamlit caches initialize in a singleton, so it runs once per process
+    utils.initialize(force=True)
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(calls) >= 3
+    assert utils.get_health_state()["healthy"] is True
@@ -0,0 +1,36 @@
+import pytest
+
+from utilities import ingestion
+
+@pytest.fixture
+def stages(monkeypatch):
+    stored = []
+    monkeypatch.setattr(ingestion, "iter_extract", lambda url, filename, data: iter(
+        [{"index": i, "text": f"page {i}", "pages": (i + 1, i + 1)} for i in range(3)]))
+    # split_text loads a tiktoken encoding from the network; one chunk per page is enough here
+    monkeypatch.setattr(ingestion, "split_text", lambda text, filename: [(text, filename)])
+    monkeypatch.setattr(ingestion, "get_redis_conn", lambda: None)
+    monkeypatch.setattr(ingestion, "check_chunk", lambda item, redis_conn: False)
+    monkeypatch.setattr(ingestion, "embed_chunk", lambda item: True)
+    monkeypatch.setattr(ingestion, "store_chunk", stored.append)
+    return stored
+
+class BrokenWriter:
+    def __init__(self, filename):
+        pass
+
+    def add(self, index, text, pages):
+        raise IOError("blob storage unavailable")
+
+def test_archive_failure_does_not_stop_the_ingest(stages, monkeypatch):
+    monkeypatch.setattr(ingestion, "ConvertedTextWriter", BrokenWriter)
+    # A queue of one makes extract block on the archive if it stopped reading
+    assert ingestion.ingest_document("", "doc.pdf", embed_workers=1, queue_size=1) == 3
+    assert [item["filename"] for item in stages] == ["doc.pdf_chunk_0", "doc.pdf_chunk_1", "doc.pdf_chunk_2"]
+
+def test_other_stage_failures_are_raised(stages, monkeypatch):
+    def broken(item):
+        raise RuntimeError("redis down")
+    monkeypatch.setattr(ingestion, "store_chunk", broken)
+    with pytest.raises(RuntimeError):
+        ingestion.ingest_document("", "doc.pdf", embed_workers=1, archive=False)
@@ -0,0 +1,52 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utilities import redisembeddings
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    conn = fakeredis.FakeRedis()
+    monkeypatch.setattr(redisembeddings, "get_redis_conn", lambda: conn)
+    return conn
+
+def test_source_tag_keeps_commas_and_case():
+    args = redisembeddings._source_field().redis_args()
+    assert args[args.index("SEPARATOR") + 1] == "|"
+    assert "CASESENSITIVE" in args
+
+def test_backfill_tags_chunks_stored_before_the_source_tag(redis_conn):
+    redis_conn.hset("embedding:1", mapping={"text": "a", "filename": "Q1, Report.pdf_chunk_0_part_1"})
+    redis_conn.hset("embedding:2", mapping={"text": "b", "filename": "notes.txt", "source": "notes.txt"})
+
+    assert redisembeddings.backfill_sources(batch_size=1) == 1
+    assert redis_conn.hget("embedding:1", "source") == b"Q1, Report.pdf"
+    assert redisembeddings.backfill_sources() == 0
+
+def test_prompt_results_store_their_id(redis_conn):
+    redisembeddings.add_prompt_results([{"id": "job:2", "result": "r", "filename": "b.pdf", "job": "job"}])
+    assert redis_conn.hget("prompt:job:2", "result_id") == b"job:2"
+
+def test_backfill_stores_the_id_of_older_prompt_results(redis_conn):
+    redis_conn.hset("prompt:job:1", mapping={"result": "r", "filename": "a.pdf"})
+    redisembeddings.add_prompt_result("job:2", "r", "b.pdf")
+
+    assert redisembeddings.backfill_prompt_ids(batch_size=1) == 1
+    assert redis_conn.hget("prompt:job:1", "result_id") == b"job:1"
+    assert redisembeddings.backfill_prompt_ids() == 0
+
+def test_prompt_results_are_sorted_by_redis(monkeypatch):
+    queries = []
+
+    class Index:
+        def search(self, query):
+            queries.append(query)
+            doc = type("Document", (), {"id": "prompt:job:1", "filename": "a.pdf", "prompt": "p", "result": "r"})
+            return type("Result", (), {"docs": [doc], "total": 1})
+
+    monkeypatch.setattr(redisembeddings, "get_index", lambda name: Index())
+    page, total = redisembeddings.get_prompt_results_page(50, 50, job="job")
+    assert total == 1 and list(page["id"]) == ["prompt:job:1"]
+    args = queries[0].get_args()
+    assert args[args.index("SORTBY") + 1] == "result_id"
+    assert {"SORTABLE", "NOINDEX"} <= set(redisembeddings._result_id_field().redis_args())
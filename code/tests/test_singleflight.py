@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utilities import redisembeddings, singleflight
+from utilities.singleflight import SingleFlight
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redisembeddings, "get_redis_conn", lambda: fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_REDIS", True)
+    return server
+
+def test_two_processes_share_one_upstream_call(shared_redis):
+    # Two instances stand for two processes: they share Redis, not their in-memory flights
+    leader, follower = SingleFlight("embedding", shared=True), SingleFlight("embedding", shared=True)
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        time.sleep(0.3)
+        return [0.1, 0.2]
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(leader.do("question", upstream)))
+    first.start()
+    time.sleep(0.05)
+    results.append(follower.do("question", upstream))
+    first.join()
+
+    assert results == [[0.1, 0.2], [0.1, 0.2]]
+    assert len(calls) == 1
+
+def test_published_result_is_reused_after_the_leader_finished(shared_redis):
+    # Within SINGLEFLIGHT_RESULT_TTL the published result acts as a short cache
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        return None
+
+    assert SingleFlight("completion", shared=True).do("question", upstream) is None
+    assert SingleFlight("completion", shared=True).do("question", upstream) is None
+    assert len(calls) == 1
+
+def test_published_result_expires(shared_redis, monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_RESULT_TTL", 0.1)
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        return len(calls)
+
+    assert SingleFlight("completion", shared=True).do("question", upstream) == 1
+    time.sleep(0.2)
+    assert SingleFlight("completion", shared=True).do("question", upstream) == 2
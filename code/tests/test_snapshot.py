@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("pyarrow")
+
+from utilities import dedup, redisembeddings, snapshot
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    conn = fakeredis.FakeRedis()
+    monkeypatch.setattr(redisembeddings, "get_redis_conn", lambda: conn)
+    monkeypatch.setattr(snapshot, "get_redis_conn", lambda: conn)
+    # fakeredis has no RediSearch; the chunks are plain hashes either way
+    monkeypatch.setattr(snapshot, "ensure_indexes", lambda: None)
+    return conn
+
+def test_export_import_round_trip_keeps_reference_records(redis_conn, tmp_path):
+    dimension = redisembeddings.active_index().dimension
+    vector = np.arange(dimension, dtype=np.float32)
+    sig = dedup.signature("the same passage in two files")
+    redis_conn.hset("embedding:original", mapping={
+        "text": "the same passage in two files", "filename": "a.pdf_chunk_0", "source": "a.pdf", "language": "en",
+        "embeddings": vector.tobytes(), "minhash": sig.tobytes()})
+    redis_conn.hset("embedding:reference", mapping={
+        "text": "the same passage in two files", "filename": "b.pdf_chunk_0", "source": "b.pdf",
+        "duplicate_of": "embedding:original"})
+    redis_conn.hset("embedding:other-dimension", mapping={"text": "t", "filename": "c.pdf_chunk_0", "embeddings": b"\0" * 8})
+    before = {key: redis_conn.hgetall(key) for key in (b"embedding:original", b"embedding:reference")}
+
+    assert snapshot.export_index(str(tmp_path), batch_size=2) == 2
+    redis_conn.flushall()
+    assert snapshot.import_index(str(tmp_path), batch_size=1, workers=2) == 2
+
+    assert {key: redis_conn.hgetall(key) for key in before} == before
+    assert not redis_conn.exists("embedding:other-dimension")
+    assert redis_conn.smembers("dedup:links:embedding:original") == {b"embedding:reference"}
+    for band_key in dedup._band_keys(sig):
+        assert redis_conn.smembers(band_key) == {b"embedding:original"}
+    # The restored reference still hands the passage over when the original goes
+    redisembeddings.delete_document("embedding:original")
+    assert redis_conn.hget("embedding:reference", "embeddings") == vector.tobytes()
@@ -0,0 +1,89 @@
+from urllib.parse import parse_qs
+
+import pytest
+
+from utilities import translator
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+class FakeSession:
+    """Detects Spanish by a leading "hola" and "translates" by upper-casing."""
+    requests = []
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, params=None, headers=None, json=None):
+        texts = [item['text'] for item in json]
+        FakeSession.requests.append((url.split('?')[0].rsplit('/', 1)[1], params, texts))
+        if '/detect' in url:
+            return FakeResponse([{'language': 'es' if text.startswith('hola') else 'en'} for text in texts])
+        return FakeResponse([{'translations': [{'text': text.upper()}]} for text in texts])
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setenv("TRANSLATE_ENDPOINT", "https://translator.example.com")
+    monkeypatch.setenv("TRANSLATE_KEY", "key")
+    monkeypatch.setenv("TRANSLATE_REGION", "westeurope")
+    monkeypatch.setattr(translator.requests, "Session", FakeSession)
+    monkeypatch.setattr(translator, "TRANSLATION_REDIS_CACHE", False)
+    translator.get_session.cache_clear()
+    translator._translation_cache.clear()
+    FakeSession.requests = []
+    yield FakeSession.requests
+    translator.get_session.cache_clear()
+    translator._translation_cache.clear()
+
+def test_batches_respect_the_element_limit(session, monkeypatch):
+    monkeypatch.setattr(translator, "DETECT_MAX_ELEMENTS", 2)
+    monkeypatch.setattr(translator, "TRANSLATE_MAX_ELEMENTS", 3)
+    texts = [f"hola {i}" for i in range(5)] + ["hello"]
+
+    assert translator.translate_batch(texts, language='en') == [f"HOLA {i}" for i in range(5)] + ["hello"]
+    assert [(kind, len(sent)) for kind, _, sent in session] == [("detect", 2), ("detect", 2), ("detect", 2), ("translate", 3), ("translate", 2)]
+    params = parse_qs(session[-1][1])
+    assert (params['from'], params['to']) == (['es'], ['en'])
+
+def test_batches_respect_the_character_limit(session, monkeypatch):
+    monkeypatch.setattr(translator, "MAX_CHARS_PER_REQUEST", 20)
+    texts = ["hola " + "a" * 10, "hola " + "b" * 10, "hola"]
+
+    translator.translate_batch(texts, language='en', source='es')
+    # No detection with a known source; the first two texts do not fit in one request
+    assert [sent for _, _, sent in session] == [[texts[0]], texts[1:]]
+    assert all(sum(map(len, sent)) <= 20 for _, _, sent in session)
+
+def test_cached_translations_send_no_request(session):
+    assert translator.translate_batch(["hola", "hola mundo", "hola"], language='en') == ["HOLA", "HOLA MUNDO", "HOLA"]
+    # Duplicates are sent once
+    assert [sent for _, _, sent in session] == [["hola", "hola mundo"], ["hola", "hola mundo"]]
+    session.clear()
+
+    assert translator.translate("hola mundo", language='en') == "HOLA MUNDO"
+    assert translator.translate_batch(["hola", "hola mundo"], language='en') == ["HOLA", "HOLA MUNDO"]
+    assert session == []
+
+    # Only the texts that are not cached are sent
+    assert translator.translate_batch(["hola", "hola otra vez"], language='en') == ["HOLA", "HOLA OTRA VEZ"]
+    assert [sent for _, _, sent in session] == [["hola otra vez"], ["hola otra vez"]]
+
+def test_redis_cache_is_shared_between_processes(session, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    conn = fakeredis.FakeRedis()
+    monkeypatch.setattr(translator, "get_redis_conn", lambda: conn)
+    monkeypatch.setattr(translator, "TRANSLATION_REDIS_CACHE", True)
+    translator.translate("hola", language='en')
+    session.clear()
+
+    # Another process starts with an empty in-process cache
+    translator._translation_cache.clear()
+    assert translator.translate("hola", language='en') == "HOLA"
+    assert session == []
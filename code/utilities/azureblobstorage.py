@@ -1,65 +1,267 @@
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
+from functools import lru_cache
+from urllib.parse import unquote, urlparse
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, generate_blob_sas, generate_container_sas, ContentSettings
+from utilities import blobcatalog
+from utilities.tracing import span, traced
 
-def upload_file(bytes_data, file_name, content_type='application/pdf'):
+# Maximum age (seconds) of the blob catalogue before callers that need every file resync it
+CATALOG_SYNC_INTERVAL = int(os.getenv('CATALOG_SYNC_INTERVAL', 3600))
+
+# Lifetime of generated SAS tokens, and how long before expiry a cached token is replaced
+SAS_TOKEN_TTL = int(os.getenv('SAS_TOKEN_TTL', 3 * 3600))
+SAS_REFRESH_MARGIN = int(os.getenv('SAS_REFRESH_MARGIN', 15 * 60))
+SAS_CACHE_SIZE = int(os.getenv('SAS_CACHE_SIZE', 10000))
+
+# Blobs above BLOB_SINGLE_PUT_SIZE bytes are uploaded as BLOB_BLOCK_SIZE-byte blocks, BLOB_MAX_CONCURRENCY at a time.
+# Blocks above 4 MiB let the SDK read them straight from the source stream instead of buffering copies.
+BLOB_BLOCK_SIZE = int(os.getenv('BLOB_BLOCK_SIZE', 8 * 1024 * 1024))
+BLOB_SINGLE_PUT_SIZE = int(os.getenv('BLOB_SINGLE_PUT_SIZE', 16 * 1024 * 1024))
+BLOB_MAX_CONCURRENCY = int(os.getenv('BLOB_MAX_CONCURRENCY', 4))
+# Files uploaded at the same time by upload_files
+BLOB_UPLOAD_WORKERS = int(os.getenv('BLOB_UPLOAD_WORKERS', 8))
+# Seconds between progress callbacks of upload_files, besides one per finished file
+BLOB_PROGRESS_INTERVAL = 0.5
+
+_sas_cache = OrderedDict()
+_sas_lock = threading.Lock()
+
+def get_connection_string():
+    # BLOB_CONNECTION_STRING points to other endpoints, e.g. Azurite for local runs and benchmarks
+    if os.getenv('BLOB_CONNECTION_STRING'):
+        return os.environ['BLOB_CONNECTION_STRING']
     account_name = os.environ['BLOB_ACCOUNT_NAME']
     account_key = os.environ['BLOB_ACCOUNT_KEY']
-    connect_str = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
+    return f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
+
+@lru_cache(maxsize=None)
+def _get_blob_service_client(connect_str):
+    return BlobServiceClient.from_connection_string(connect_str, max_block_size=BLOB_BLOCK_SIZE, max_single_put_size=BLOB_SINGLE_PUT_SIZE)
+
+def get_blob_service_client() -> BlobServiceClient:
+    # One client (and connection pool) per connection string, shared by all calls
+    return _get_blob_service_client(get_connection_string())
+
+def get_sas_token(container_name, blob_name=None, permission="r"):
+    """SAS token for a container (blob_name None) or a blob, reused until it is close to expiry."""
+    account_name = os.environ['BLOB_ACCOUNT_NAME']
+    key = (account_name, container_name, blob_name, permission)
+    now = datetime.utcnow()
+    with _sas_lock:
+        cached = _sas_cache.get(key)
+        if cached and cached[1] - now > timedelta(seconds=SAS_REFRESH_MARGIN):
+            _sas_cache.move_to_end(key)
+            return cached[0]
+    account_key = os.environ['BLOB_ACCOUNT_KEY']
+    expiry = now + timedelta(seconds=SAS_TOKEN_TTL)
+    if blob_name is None:
+        token = generate_container_sas(account_name, container_name, account_key=account_key, permission=permission, expiry=expiry)
+    else:
+        token = generate_blob_sas(account_name, container_name, blob_name, account_key=account_key, permission=permission, expiry=expiry)
+    with _sas_lock:
+        _sas_cache[key] = (token, expiry)
+        _sas_cache.move_to_end(key)
+        while len(_sas_cache) > SAS_CACHE_SIZE:
+            _sas_cache.popitem(last=False)
+    return token
+
+def get_blob_sas_url(file_name, permission="r", container_name=None):
+    """URL of a blob with a cached blob-scoped SAS."""
+    container_name = container_name or os.environ['BLOB_CONTAINER_NAME']
+    blob_client = get_blob_service_client().get_blob_client(container=container_name, blob=file_name)
+    return blob_client.url + '?' + get_sas_token(container_name, file_name, permission)
+
+def blob_name_from_url(url):
+    """Name of the blob `url` points to in the configured container, or None for any other URL.
+
+    The query string (a SAS) is ignored: callers build their own with get_blob_sas_url.
+    """
     container_name = os.environ['BLOB_CONTAINER_NAME']
-    # Create the BlobServiceClient object
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
+    expected = urlparse(get_blob_service_client().get_container_client(container_name).url)
+    parsed = urlparse(url)
+    prefix = expected.path.rstrip('/') + '/'
+    if (parsed.scheme, parsed.netloc.lower()) != (expected.scheme, expected.netloc.lower()) or not parsed.path.startswith(prefix):
+        return None
+    name = unquote(parsed.path[len(prefix):])
+    return name if name and not name.startswith('converted/') else None
+
+class BlobFile(dict):
+    """A listed document. `fullpath` and `converted_path` are signed on first access, not when listed."""
+
+    __slots__ = ('_container',)
+
+    def __init__(self, entry, container_url, container_name):
+        dict.__init__(self, entry)
+        self._container = (container_url, container_name)
+
+    def _url(self, name):
+        container_url, container_name = self._container
+        return f"{container_url}/{name}?{get_sas_token(container_name)}" if name else ""
+
+    def __missing__(self, key):
+        if key == 'fullpath':
+            value = self._url(self['filename'])
+        elif key == 'converted_path':
+            value = self._url(_converted_blob_name(self))
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def fullpath(self):
+        return self['fullpath']
+
+    @property
+    def converted_path(self):
+        return self['converted_path']
+
+def _data_length(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    # Seekable file, e.g. a Streamlit upload: sent from the start, whatever was read before
+    length = data.seek(0, os.SEEK_END)
+    data.seek(0)
+    return length
+
+def upload_file(bytes_data, file_name, content_type='application/pdf', max_concurrency=BLOB_MAX_CONCURRENCY, progress=None):
+    """Upload a document and return its URL with a read SAS.
+
+    `bytes_data` is bytes or a seekable binary file, which is streamed without copying it.
+    `progress(sent, total)` is called from the uploading thread after each block.
+    """
+    container_name = os.environ['BLOB_CONTAINER_NAME']
+    blob_service_client = get_blob_service_client()
     # Create a blob client using the local file name as the name for the blob
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
+    length = _data_length(bytes_data)
     # Upload the created file
-    blob_client.upload_blob(bytes_data,overwrite=True, content_settings=ContentSettings(content_type=content_type))
+    with span("blob.upload", bytes=length, content_type=content_type):
+        result = blob_client.upload_blob(bytes_data, length=length, overwrite=True, content_settings=ContentSettings(content_type=content_type),
+                                         max_concurrency=max_concurrency, progress_hook=progress)
+    if not file_name.startswith('converted/'):
+        # Overwriting a blob clears its metadata, so the document starts unprocessed again
+        blobcatalog.upsert_entry(file_name, size=length, etag=result.get('etag'), last_modified=result.get('last_modified'), metadata={"converted": False, "embeddings_added": False})
 
-    return blob_client.url + '?' + generate_blob_sas(account_name, container_name, file_name,account_key=account_key,  permission="r", expiry=datetime.utcnow() + timedelta(hours=3))
+    return blob_client.url + '?' + get_sas_token(container_name, file_name)
 
-def get_all_files():
-    # Get all files in the container from Azure Blob Storage
-    account_name = os.environ['BLOB_ACCOUNT_NAME']
-    account_key = os.environ['BLOB_ACCOUNT_KEY']
-    connect_str = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
+def _upload_one(status, data, content_type, max_concurrency):
+    def record(sent, total):
+        status["sent"] = sent
+    start = time.perf_counter()
+    try:
+        status["url"] = upload_file(data, status["name"], content_type, max_concurrency, progress=record)
+        status["sent"] = status["bytes"]
+    except Exception as e:
+        status["error"] = str(e)
+    status["seconds"] = time.perf_counter() - start
+    status["done"] = True
+
+@traced("blob.upload_files")
+def upload_files(files, workers=BLOB_UPLOAD_WORKERS, max_concurrency=BLOB_MAX_CONCURRENCY, progress=None):
+    """Upload many documents at the same time. `files` holds (data, file_name, content_type) tuples.
+
+    Returns one status dict per file, in order: name, bytes, sent, seconds, done, and url
+    or error. A failed file does not stop the others. `progress(statuses)` is called
+    from the calling thread whenever a file finishes and every BLOB_PROGRESS_INTERVAL
+    seconds, so it can update a UI.
+    """
+    files = list(files)
+    statuses = [{"name": name, "bytes": _data_length(data), "sent": 0, "seconds": None, "done": False, "url": None, "error": None}
+                for data, name, _ in files]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files) or 1))) as pool:
+        pending = {pool.submit(_upload_one, status, data, content_type, max_concurrency)
+                   for status, (data, _, content_type) in zip(statuses, files)}
+        while pending:
+            _, pending = wait(pending, timeout=BLOB_PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            if progress:
+                progress(statuses)
+    return statuses
+
+@traced("blob.sync_catalog")
+def sync_catalog(batch_size=1000):
+    """Rebuild the blob catalogue from a full walk of the container. Returns the number of documents."""
     container_name = os.environ['BLOB_CONTAINER_NAME']
-    # Create the BlobServiceClient object
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-    # Get files in the container
-    container_client = blob_service_client.get_container_client(container_name)
-    blob_list = container_client.list_blobs(include='metadata')
-    # sas = generate_blob_sas(account_name, container_name, blob.name,account_key=account_key,  permission="r", expiry=datetime.utcnow() + timedelta(hours=3))
-    sas = generate_container_sas(account_name, container_name,account_key=account_key,  permission="r", expiry=datetime.utcnow() + timedelta(hours=3))
-    files = []
-    converted_files = {}
-    for blob in blob_list:
-        if not blob.name.startswith('converted/'):
-            files.append({
-                "filename" : blob.name,
-                "converted": blob.metadata.get('converted', 'false') == 'true' if blob.metadata else False,
-                "embeddings_added": blob.metadata.get('embeddings_added', 'false') == 'true' if blob.metadata else False,
-                "fullpath": f"https://{account_name}.blob.core.windows.net/{container_name}/{blob.name}?{sas}",
-                "converted_path": ""
-                })
-        else:
-            converted_files[blob.name] = f"https://{account_name}.blob.core.windows.net/{container_name}/{blob.name}?{sas}"
+    container_client = get_blob_service_client().get_container_client(container_name)
+    seen = set()
+    converted = set()
+    batch = []
+    for blob in container_client.list_blobs(include='metadata'):
+        if blob.name.startswith('converted/'):
+            converted.add(blob.name)
+            continue
+        seen.add(blob.name)
+        metadata = blob.metadata or {}
+        batch.append({"name": blob.name, "size": blob.size, "etag": blob.etag, "last_modified": blob.last_modified, "metadata": {
+            "converted": metadata.get('converted', 'false'),
+            "embeddings_added": metadata.get('embeddings_added', 'false'),
+            "converted_format": metadata.get('converted_format'),
+        }})
+        if len(batch) >= batch_size:
+            blobcatalog.upsert_entries(batch)
+            batch = []
+    if batch:
+        blobcatalog.upsert_entries(batch)
+
+    # Documents whose converted text exists but whose metadata was never updated
+    blobcatalog.upsert_entries([{"name": name, "metadata": {"converted": True, "converted_format": "chunks" if f"converted/{name}.chunks" in converted else "zip"}}
+                                for name in seen if f"converted/{name}.chunks" in converted or f"converted/{name}.zip" in converted])
+    blobcatalog.remove_entries([name for name in blobcatalog.catalog_names() if name not in seen])
+    blobcatalog.mark_synced()
+    return len(seen)
+
+def ensure_catalog(max_age=CATALOG_SYNC_INTERVAL):
+    """Sync the catalogue if it was never built or is older than `max_age` seconds."""
+    synced = blobcatalog.last_synced()
+    if synced is None or time.time() - synced > max_age:
+        sync_catalog()
+
+def _converted_blob_name(entry):
+    if not entry['converted']:
+        return ""
+    return f"converted/{entry['filename']}.zip" if entry.get('converted_format') == 'zip' else f"converted/{entry['filename']}.chunks"
+
+@traced("blob.list")
+def list_files(offset=0, limit=50, search=None, converted=None, embeddings_added=None, sort_by="name", ascending=True):
+    """One page of documents from the blob catalogue, as (files, total).
 
-    for file in files:
-        converted_filename = f"converted/{file['filename']}.zip"
-        if converted_filename in converted_files:
-            file['converted'] = True
-            file['converted_path'] = converted_files[converted_filename]
-    
-    return files
+    Files are `BlobFile`s, whose SAS URLs are only built when read, with a cached container SAS.
+    """
+    container_name = os.environ['BLOB_CONTAINER_NAME']
+    entries, total = blobcatalog.query_entries(offset, limit, search=search, converted=converted, embeddings_added=embeddings_added, sort_by=sort_by, ascending=ascending)
+    container_url = get_blob_service_client().get_container_client(container_name).url
+    return [BlobFile(entry, container_url, container_name) for entry in entries], total
+
+def get_all_files(page_size=1000, max_age=CATALOG_SYNC_INTERVAL, **filters):
+    # Every document in the catalogue, resynced when older than max_age seconds; prefer list_files for browsing
+    ensure_catalog(max_age)
+    files = []
+    while True:
+        page, total = list_files(len(files), page_size, **filters)
+        files += page
+        if not page or len(files) >= total:
+            return files
 
+@traced("blob.upsert_metadata")
 def upsert_blob_metadata(file_name, metadata):
-    account_name = os.environ['BLOB_ACCOUNT_NAME']
-    account_key = os.environ['BLOB_ACCOUNT_KEY']
-    connect_str = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
     container_name = os.environ['BLOB_CONTAINER_NAME']
-    blob_client = BlobServiceClient.from_connection_string(connect_str).get_blob_client(container=container_name, blob=file_name)
+    blob_client = get_blob_service_client().get_blob_client(container=container_name, blob=file_name)
 
     # Read metadata from the blob
     blob_metadata = blob_client.get_blob_properties().metadata
     blob_metadata.update(metadata)
     # Add metadata to the blob
-    blob_client.set_blob_metadata(metadata= blob_metadata)
\ No newline at end of file
+    result = blob_client.set_blob_metadata(metadata= blob_metadata)
+    if not file_name.startswith('converted/'):
+        blobcatalog.upsert_entry(file_name, etag=result.get('etag'), last_modified=result.get('last_modified'), metadata=blob_metadata)
\ No newline at end of file
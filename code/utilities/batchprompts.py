@@ -0,0 +1,68 @@
+"""
+Batch prompt execution over stored document chunks.
+
+`run_prompt_batch` runs one prompt against many chunks with a pool of workers.
+Every completion goes through the deployment's rate limiter, and results are
+written to the prompt index in pipelined batches as they complete. Each run
+belongs to a job whose id is derived from the prompt, model and max_tokens, and
+results are keyed by job and chunk. Running the same job again after a crash or
+an interrupted page only completes the chunks that have no result yet.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import logging
+import os
+
+from utilities import redisembeddings
+from utilities.tracing import span
+from utilities.utils import create_completion
+
+logger = logging.getLogger(__name__)
+
+PROMPT_BATCH_WORKERS = int(os.getenv('PROMPT_BATCH_WORKERS', 4))
+PROMPT_WRITE_BATCH = int(os.getenv('PROMPT_WRITE_BATCH', 20))
+
+def prompt_job_id(prompt: str, model: str, max_tokens: int) -> str:
+    return hashlib.sha1(f"{model}\n{max_tokens}\n{prompt}".encode('utf-8')).hexdigest()[:16]
+
+def _run_one(doc, prompt, model, max_tokens):
+    return create_completion(f"{doc['text']}\n{prompt}", max_tokens=max_tokens, model=model)
+
+def run_prompt_batch(documents, prompt: str, model: str, max_tokens: int=1000, job: str=None,
+                     workers: int=PROMPT_BATCH_WORKERS, write_batch: int=PROMPT_WRITE_BATCH, progress=None) -> dict:
+    """Run `prompt` over every document (dicts with id, filename and text) and store the results.
+
+    Documents that already have a result for this job are skipped. `progress(done, total)`
+    is called from the calling thread after each completion. Returns a summary with the
+    job id and the number of completed, skipped and failed documents.
+    """
+    job = job or prompt_job_id(prompt, model, max_tokens)
+    documents = {f"{job}:{doc['id']}": doc for doc in documents}
+    done_ids = redisembeddings.existing_prompt_results(documents)
+    pending = {id: doc for id, doc in documents.items() if id not in done_ids}
+    summary = {"job": job, "total": len(documents), "skipped": len(done_ids), "completed": 0, "failed": 0, "errors": []}
+
+    with span("prompts.batch", job=job, documents=len(documents), pending=len(pending)):
+        buffer = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(_run_one, doc, prompt, model, max_tokens): id for id, doc in pending.items()}
+            for future in as_completed(futures):
+                id = futures[future]
+                try:
+                    result = future.result()
+                    buffer.append({"id": id, "result": result, "filename": pending[id]['filename'], "prompt": prompt, "job": job})
+                    summary["completed"] += 1
+                except Exception as e:
+                    # Left without a result, so the next run of the job retries it
+                    logger.warning(f"Prompt failed for {pending[id]['filename']}: {e}")
+                    summary["failed"] += 1
+                    if len(summary["errors"]) < 5:
+                        summary["errors"].append(f"{pending[id]['filename']}: {e}")
+                if len(buffer) >= write_batch:
+                    redisembeddings.add_prompt_results(buffer)
+                    buffer = []
+                if progress:
+                    progress(summary["skipped"] + summary["completed"] + summary["failed"], summary["total"])
+        if buffer:
+            redisembeddings.add_prompt_results(buffer)
+    return summary
@@ -0,0 +1,154 @@
+"""
+Catalogue of the documents in the blob container, held in Redis.
+
+Every uploaded document has a `catalog:{blob name}` hash with its size, etag,
+last modification time and processing state (converted, embeddings_added). The
+upload and metadata helpers in utilities.azureblobstorage update it as files
+move through ingestion, and a RediSearch index over it serves sorted, filtered
+pages. Listing no longer walks the whole container. `azureblobstorage.sync_catalog`
+rebuilds it from the container for blobs that were added outside the app.
+"""
+import logging
+import re
+import threading
+import time
+
+from redis.exceptions import RedisError, ResponseError
+from redis.commands.search.field import TextField, TagField, NumericField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+from utilities.redisembeddings import get_redis_conn, escape_tag
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
+
+catalog_index_name = "catalog-index"
+CATALOG_PREFIX = "catalog:"
+CATALOG_SYNC_KEY = "catalog-sync:last"
+# Bumped on every catalogue change, so cached listings can tell they are stale
+CATALOG_VERSION_KEY = "catalog-sync:version"
+
+_index_ready = False
+_index_lock = threading.Lock()
+
+def catalog_key(name: str) -> str:
+    return f"{CATALOG_PREFIX}{name}"
+
+def ensure_catalog_index() -> None:
+    global _index_ready
+    if _index_ready:
+        return
+    with _index_lock:
+        if _index_ready:
+            return
+        try:
+            get_redis_conn().ft(catalog_index_name).info()
+        except ResponseError:
+            logger.info(f"Index {catalog_index_name} does not exist, creating it")
+            get_redis_conn().ft(catalog_index_name).create_index(
+                fields=[
+                    TextField(name="name", sortable=True),
+                    NumericField(name="size", sortable=True),
+                    NumericField(name="last_modified", sortable=True),
+                    TagField(name="converted"),
+                    TagField(name="embeddings_added"),
+                ],
+                definition=IndexDefinition(prefix=[CATALOG_PREFIX], index_type=IndexType.HASH)
+            )
+        _index_ready = True
+
+def _flag(value) -> str:
+    return "true" if value in (True, "true") else "false"
+
+def _mapping(name, size=None, etag=None, last_modified=None, metadata=None):
+    mapping = {"name": name}
+    if size is not None:
+        mapping["size"] = size
+    if etag:
+        mapping["etag"] = etag.strip('"')
+    if last_modified is not None:
+        mapping["last_modified"] = last_modified.timestamp() if hasattr(last_modified, 'timestamp') else last_modified
+    for field in ("converted", "embeddings_added"):
+        if metadata is not None and field in metadata:
+            mapping[field] = _flag(metadata[field])
+    if metadata and metadata.get("converted_format"):
+        mapping["converted_format"] = metadata["converted_format"]
+    return mapping
+
+def upsert_entries(entries) -> None:
+    """Write catalogue entries in one pipeline. Each entry is a dict with name and any of
+    size, etag, last_modified and metadata. Fields that are not given keep their value."""
+    try:
+        ensure_catalog_index()
+        pipe = get_redis_conn().pipeline(transaction=False)
+        for entry in entries:
+            pipe.hset(catalog_key(entry["name"]), mapping=_mapping(**entry))
+            # New entries start unprocessed, existing ones keep their state
+            pipe.hsetnx(catalog_key(entry["name"]), "converted", "false")
+            pipe.hsetnx(catalog_key(entry["name"]), "embeddings_added", "false")
+        pipe.incr(CATALOG_VERSION_KEY)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Blob catalogue unavailable in Redis: {e}")
+
+def upsert_entry(name, **fields) -> None:
+    upsert_entries([dict(fields, name=name)])
+
+def remove_entries(names) -> None:
+    try:
+        pipe = get_redis_conn().pipeline(transaction=False)
+        for name in names:
+            pipe.unlink(catalog_key(name))
+        pipe.incr(CATALOG_VERSION_KEY)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Blob catalogue unavailable in Redis: {e}")
+
+def catalog_names():
+    """Names of every catalogued blob, read with SCAN."""
+    redis_conn = get_redis_conn()
+    for key in redis_conn.scan_iter(match=f"{CATALOG_PREFIX}*", count=1000):
+        yield key.decode('utf-8')[len(CATALOG_PREFIX):]
+
+def catalog_version() -> int:
+    """Value of the catalogue change counter. It changes whenever an entry is written or removed."""
+    return int(get_redis_conn().get(CATALOG_VERSION_KEY) or 0)
+
+def mark_synced() -> None:
+    get_redis_conn().set(CATALOG_SYNC_KEY, time.time())
+
+def last_synced() -> float:
+    """Epoch seconds of the last full sync with the container, or None if it never ran."""
+    value = get_redis_conn().get(CATALOG_SYNC_KEY)
+    return float(value) if value is not None else None
+
+def _search_terms(search):
+    # Prefix matches need at least two characters
+    words = [word for word in re.findall(r'[^\W_]+', search or '', re.UNICODE) if len(word) > 1]
+    return " ".join(f"{word}*" for word in words)
+
+def query_entries(offset: int=0, limit: int=50, search: str=None, converted: bool=None, embeddings_added: bool=None, sort_by: str="name", ascending: bool=True):
+    """One page of catalogue entries and the total that match, as (list of dicts, total)."""
+    ensure_catalog_index()
+    filters = []
+    if search and _search_terms(search):
+        filters.append(f"@name:({_search_terms(search)})")
+    if converted is not None:
+        filters.append(f"@converted:{{{escape_tag(_flag(converted))}}}")
+    if embeddings_added is not None:
+        filters.append(f"@embeddings_added:{{{escape_tag(_flag(embeddings_added))}}}")
+    query = Query(" ".join(filters) or "*").sort_by(sort_by, asc=ascending).paging(offset, limit).dialect(2)
+    with span("redis.catalog_query", offset=offset, limit=limit):
+        results = get_redis_conn().ft(catalog_index_name).search(query)
+    entries = []
+    for doc in results.docs:
+        entries.append({
+            "filename": doc.name,
+            "size": int(float(getattr(doc, 'size', 0) or 0)),
+            "etag": getattr(doc, 'etag', None),
+            "last_modified": float(getattr(doc, 'last_modified', 0) or 0),
+            "converted": getattr(doc, 'converted', 'false') == 'true',
+            "converted_format": getattr(doc, 'converted_format', None),
+            "embeddings_added": getattr(doc, 'embeddings_added', 'false') == 'true',
+        })
+    return entries, results.total
@@ -0,0 +1,169 @@
+"""
+Seekable storage for the text extracted from converted documents.
+
+A converted document is stored as two blobs:
+
+- `converted/{filename}.chunks`: one record per chunk, concatenated. A record is
+  a JSON object ({"index", "text", "pages"}) ending in a newline, compressed on
+  its own with zlib when CONVERTED_TEXT_COMPRESSION=zlib. Uncompressed files
+  are plain JSONL.
+- `converted/{filename}.chunks.json`: the index, with the compression and the
+  offset, length, pages and character count of every record.
+
+Records are written with staged blocks, so the whole document is never held in
+memory. Single chunks, or a run of consecutive chunks, are read with one HTTP
+range request for their bytes (the document viewer pages through them this way).
+The index is uploaded last, so an index blob means the records are complete.
+"""
+import base64
+import io
+import json
+import os
+import zipfile
+import zlib
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock, ContentSettings
+from utilities.azureblobstorage import get_blob_service_client
+from utilities.tracing import span
+
+CONVERTED_TEXT_COMPRESSION = os.getenv('CONVERTED_TEXT_COMPRESSION', 'zlib')
+CONVERTED_TEXT_BLOCK_SIZE = int(os.getenv('CONVERTED_TEXT_BLOCK_SIZE', 4 * 1024 * 1024))
+FORMAT_VERSION = 1
+
+def records_blob_name(filename: str) -> str:
+    return f"converted/{filename}.chunks"
+
+def index_blob_name(filename: str) -> str:
+    return f"converted/{filename}.chunks.json"
+
+def _blob_client(name):
+    return get_blob_service_client().get_blob_client(container=os.environ['BLOB_CONTAINER_NAME'], blob=name)
+
+def _encode(record, compression):
+    data = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+    return zlib.compress(data) if compression == 'zlib' else data
+
+def _decode(data, compression):
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    return json.loads(data.decode('utf-8'))
+
+class ConvertedTextWriter:
+    """Streams chunk records of one document to blob storage. Call `add` in chunk order, then `close`."""
+
+    def __init__(self, filename: str, compression: str=CONVERTED_TEXT_COMPRESSION, block_size: int=CONVERTED_TEXT_BLOCK_SIZE):
+        if compression not in ('zlib', 'none'):
+            raise ValueError(f"Unsupported compression {compression!r}")
+        self.filename = filename
+        self.compression = compression
+        self.block_size = block_size
+        self.entries = []
+        self._client = _blob_client(records_blob_name(filename))
+        self._buffer = bytearray()
+        self._blocks = []
+        self._offset = 0
+
+    def add(self, index: int, text: str, pages=None):
+        data = _encode({"index": index, "text": text, "pages": list(pages) if pages else None}, self.compression)
+        self.entries.append({"index": index, "offset": self._offset, "length": len(data), "pages": list(pages) if pages else None, "chars": len(text)})
+        self._offset += len(data)
+        self._buffer += data
+        if len(self._buffer) >= self.block_size:
+            self._stage()
+
+    def _stage(self):
+        block_id = base64.b64encode(f"{len(self._blocks):08d}".encode()).decode()
+        with span("blob.stage_block", bytes=len(self._buffer)):
+            self._client.stage_block(block_id, bytes(self._buffer))
+        self._blocks.append(BlobBlock(block_id=block_id))
+        self._buffer = bytearray()
+
+    def close(self) -> dict:
+        """Commit the records and upload the index. Returns the index."""
+        if self._buffer:
+            self._stage()
+        content_type = 'application/jsonl' if self.compression == 'none' else 'application/octet-stream'
+        with span("blob.commit_block_list", blocks=len(self._blocks)):
+            self._client.commit_block_list(self._blocks, content_settings=ContentSettings(content_type=content_type))
+        index = {"version": FORMAT_VERSION, "filename": self.filename, "compression": self.compression, "chunks": self.entries}
+        _blob_client(index_blob_name(self.filename)).upload_blob(json.dumps(index), overwrite=True, content_settings=ContentSettings(content_type='application/json'))
+        return index
+
+def read_index(filename: str) -> dict:
+    """The index of a converted document, or None if it was not converted to this format."""
+    try:
+        return json.loads(_blob_client(index_blob_name(filename)).download_blob().readall())
+    except ResourceNotFoundError:
+        return None
+
+def read_chunk(filename: str, chunk_index: int, index: dict=None) -> dict:
+    """One chunk record ({"index", "text", "pages"}), fetched with a range request. None if missing.
+
+    Documents converted before this format existed are read from their ZIP archive.
+    """
+    index = index or read_index(filename)
+    if index is None:
+        return _read_legacy_chunk(filename, chunk_index)
+    entry = next((e for e in index['chunks'] if e['index'] == chunk_index), None)
+    if entry is None:
+        return None
+    with span("blob.read_range", bytes=entry['length']):
+        data = _blob_client(records_blob_name(filename)).download_blob(offset=entry['offset'], length=entry['length']).readall()
+    return _decode(data, index['compression'])
+
+def read_chunks(filename: str, start: int, stop: int, index: dict=None) -> list:
+    """The chunk records at positions start to stop - 1 of a document, fetched with one range request.
+
+    Positions count the stored chunks in document order, from 0.
+    """
+    index = index or read_index(filename)
+    if index is None:
+        return [chunk for position, chunk in enumerate(_iter_legacy_chunks(filename)) if start <= position < stop]
+    entries = index['chunks'][start:stop]
+    if not entries:
+        return []
+    # Records are stored back to back, so consecutive chunks are one contiguous byte range
+    offset = entries[0]['offset']
+    length = entries[-1]['offset'] + entries[-1]['length'] - offset
+    with span("blob.read_range", bytes=length, chunks=len(entries)):
+        data = _blob_client(records_blob_name(filename)).download_blob(offset=offset, length=length).readall()
+    return [_decode(data[e['offset'] - offset:e['offset'] - offset + e['length']], index['compression']) for e in entries]
+
+def iter_chunks(filename: str, index: dict=None):
+    """Every chunk record of a document, in order, streamed from the records blob."""
+    index = index or read_index(filename)
+    if index is None:
+        yield from _iter_legacy_chunks(filename)
+        return
+    stream = _blob_client(records_blob_name(filename)).download_blob()
+    buffer = b''
+    entries = iter(index['chunks'])
+    entry = next(entries, None)
+    for data in stream.chunks():
+        buffer += data
+        while entry is not None and len(buffer) >= entry['length']:
+            yield _decode(buffer[:entry['length']], index['compression'])
+            buffer = buffer[entry['length']:]
+            entry = next(entries, None)
+
+def _legacy_archive(filename):
+    try:
+        data = _blob_client(f"converted/{filename}.zip").download_blob().readall()
+    except ResourceNotFoundError:
+        return None
+    return zipfile.ZipFile(io.BytesIO(data))
+
+def _iter_legacy_chunks(filename):
+    archive = _legacy_archive(filename)
+    if archive is None:
+        return
+    names = sorted(archive.namelist(), key=lambda name: int(name[len('chunk_'):-len('.txt')]))
+    for name in names:
+        yield {"index": int(name[len('chunk_'):-len('.txt')]), "text": archive.read(name).decode('utf-8'), "pages": None}
+
+def _read_legacy_chunk(filename, chunk_index):
+    archive = _legacy_archive(filename)
+    if archive is None or f"chunk_{chunk_index}.txt" not in archive.namelist():
+        return None
+    return {"index": chunk_index, "text": archive.read(f"chunk_{chunk_index}.txt").decode('utf-8'), "pages": None}
@@ -0,0 +1,247 @@
+"""
+Near-duplicate detection for chunks, with MinHash signatures and LSH buckets in Redis.
+
+Many documents repeat the same passages: disclaimers, templated letters, new
+versions of the same manual. At ingest, each chunk gets a MinHash signature of
+its word shingles. The signature is split into DEDUP_BANDS bands, and every band
+is hashed into a Redis set (`dedup:{band}:{bucket}`) holding the keys of the
+chunks that fall in it. Chunks that share a bucket are candidates. A candidate
+whose signatures agree on at least DEDUP_THRESHOLD of their positions (the
+estimated Jaccard similarity) is a duplicate. Chunks of the same original file
+are never candidates, so a new version of a file does not match its old chunks.
+
+- DEDUP_MODE=off (default): every chunk is embedded, as before.
+- DEDUP_MODE=link: the duplicate is stored as a reference record (text, file
+  name, source, language and `duplicate_of`) without vectors, and its key is
+  added to `dedup:links:{chunk key}` of the chunk it repeats. The file still has
+  all its chunks for listing, summaries and deletes; searches find the passage
+  through the chunk it repeats.
+- DEDUP_MODE=skip: the duplicate is dropped.
+
+Deleting chunks goes through `forget`: they leave their buckets and links, and
+when a chunk with linked duplicates is deleted, the first remaining duplicate
+takes over its vectors, signature and buckets, so the passage stays searchable.
+
+At query time, `collapse` drops near-duplicates from the results of one search,
+so the top k holds k different passages. With DEDUP_QUERY=true (the default unless
+DEDUP_MODE=off), searches fetch DEDUP_QUERY_OVERFETCH times k results, collapse them
+and keep the first k.
+Results are compared by the signatures stored at ingest.
+"""
+import hashlib
+import logging
+import os
+import re
+
+import numpy as np
+from redis.exceptions import RedisError
+
+from utilities.redisembeddings import DOCUMENTS_VERSION_KEY, document_key, get_source_filename
+from utilities.tracing import record_cache
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MODE = os.getenv('DEDUP_MODE', 'off').lower()
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', 0.85))
+DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', 128))
+DEDUP_BANDS = int(os.getenv('DEDUP_BANDS', 16))
+DEDUP_SHINGLE_WORDS = int(os.getenv('DEDUP_SHINGLE_WORDS', 5))
+# Over-fetching and comparing signatures costs every search; on by default only with dedup at ingest
+DEDUP_QUERY = os.getenv('DEDUP_QUERY', str(DEDUP_MODE != 'off')).lower() == 'true'
+DEDUP_QUERY_OVERFETCH = int(os.getenv('DEDUP_QUERY_OVERFETCH', 2))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_random = np.random.RandomState(1)
+# Fixed seed: signatures are stored in Redis and compared across processes and releases
+_A = _random.randint(1, _MERSENNE_PRIME, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_B = _random.randint(0, _MERSENNE_PRIME, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_WORD_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+def _shingle_hashes(text):
+    words = _WORD_RE.findall(text.lower())
+    size = min(DEDUP_SHINGLE_WORDS, len(words)) or 1
+    shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.array([int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little') for shingle in shingles], dtype=np.uint64)
+
+def signature(text: str) -> np.ndarray:
+    """MinHash signature of the word shingles of `text`, as DEDUP_NUM_PERM uint32 values."""
+    hashes = _shingle_hashes(text)
+    # (a * x + b) mod p for every permutation and shingle. a and b span the whole field; the product
+    # wraps around 2**64, which keeps the permutations independent enough and stays in uint64
+    permuted = (np.outer(hashes, _A) + _B) % _MERSENNE_PRIME
+    return (permuted.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return float(np.mean(a == b))
+
+def _band_keys(sig):
+    rows = len(sig) // DEDUP_BANDS
+    return [f"dedup:{band}:{hashlib.blake2b(sig[band * rows:(band + 1) * rows].tobytes(), digest_size=8).hexdigest()}"
+            for band in range(DEDUP_BANDS)]
+
+def find_duplicate(text: str, key: str, redis_conn, source: str=None):
+    """Check `text`, to be stored under `key`, against the stored chunks of other files than `source`.
+
+    Returns (key of the chunk it repeats or None, signature). When it is not a duplicate, `key`
+    is added to its buckets; it becomes a match for later chunks once stored with its signature.
+    """
+    sig = signature(text)
+    if DEDUP_MODE == 'off':
+        return None, sig
+    try:
+        band_keys = _band_keys(sig)
+        pipe = redis_conn.pipeline(transaction=False)
+        for band_key in band_keys:
+            pipe.smembers(band_key)
+        candidates = set().union(*pipe.execute())
+        candidates.discard(key.encode('utf-8'))
+        candidates = sorted(candidates)
+
+        if candidates:
+            pipe = redis_conn.pipeline(transaction=False)
+            for candidate in candidates:
+                pipe.hmget(candidate, "minhash", "source")
+            for candidate, (stored, candidate_source) in zip(candidates, pipe.execute()):
+                # None: deleted since, or not stored yet by another worker
+                if stored is None or (source and candidate_source is not None and candidate_source.decode('utf-8') == source):
+                    continue
+                if similarity(sig, np.frombuffer(stored, dtype=np.uint32)) >= DEDUP_THRESHOLD:
+                    record_cache("dedup", True)
+                    return candidate.decode('utf-8'), sig
+
+        record_cache("dedup", False)
+        pipe = redis_conn.pipeline(transaction=False)
+        for band_key in band_keys:
+            pipe.sadd(band_key, key)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Near-duplicate check unavailable, the chunk is stored: {e}")
+    return None, sig
+
+def check_chunk(item: dict, redis_conn) -> bool:
+    """Check a chunk ({"text", "filename"}) before it is embedded. Returns True when it is a duplicate.
+
+    Sets item["duplicate_of"] for a duplicate, and item["minhash"] for a chunk to store.
+    """
+    source = get_source_filename(item["filename"]) if item["filename"] else None
+    duplicate_of, sig = find_duplicate(item["text"], document_key(item), redis_conn, source)
+    if duplicate_of:
+        item["duplicate_of"] = duplicate_of
+        return True
+    item["minhash"] = sig
+    return False
+
+def link_duplicate(item: dict, redis_conn) -> None:
+    """Record that the chunk `item` repeats the stored chunk item["duplicate_of"].
+
+    With DEDUP_MODE=link the chunk is stored as a reference record without vectors.
+    """
+    if DEDUP_MODE == 'link':
+        key = document_key(item)
+        mapping = {"text": item["text"], "filename": item["filename"], "duplicate_of": item["duplicate_of"]}
+        if item["filename"]:
+            mapping["source"] = get_source_filename(item["filename"])
+        if item.get("language"):
+            mapping["language"] = item["language"]
+        # A chunk stored before under the same key (an older version of the file) is replaced
+        forget([key], redis_conn)
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.unlink(key)
+        pipe.hset(key, mapping=mapping)
+        pipe.sadd(f"dedup:links:{item['duplicate_of']}", key)
+        pipe.incr(DOCUMENTS_VERSION_KEY)
+        pipe.execute()
+    logger.info(f"Chunk {item['filename']} is a near-duplicate of {item['duplicate_of']}; not embedded")
+
+# Fields of a chunk that belong to its own file; the others (vectors, signature) move to an heir
+_RECORD_FIELDS = {b"text", b"filename", b"source", b"language", b"duplicate_of"}
+
+def forget(keys, redis_conn) -> None:
+    """Remove chunks about to be deleted from the buckets and links of near-duplicate detection.
+
+    A chunk with linked duplicates hands its vectors, signature and buckets to the first of them
+    that is not deleted too; the others are linked to that one.
+    """
+    keys = [key.decode('utf-8') if isinstance(key, bytes) else key for key in keys]
+    if not keys:
+        return
+    deleting = set(keys)
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, "minhash", "duplicate_of")
+        pipe.smembers(f"dedup:links:{key}")
+    values = pipe.execute()
+
+    pipe = redis_conn.pipeline(transaction=False)
+    orphans = []
+    for key, (minhash, duplicate_of), links in zip(keys, values[::2], values[1::2]):
+        if duplicate_of is not None:
+            pipe.srem(f"dedup:links:{duplicate_of.decode('utf-8')}", key)
+        if minhash is not None:
+            for band_key in _band_keys(np.frombuffer(minhash, dtype=np.uint32)):
+                pipe.srem(band_key, key)
+        links = sorted(link.decode('utf-8') for link in links if link.decode('utf-8') not in deleting)
+        if links:
+            orphans.append((key, links))
+        else:
+            pipe.unlink(f"dedup:links:{key}")
+    pipe.execute()
+    for key, links in orphans:
+        _hand_over(redis_conn, key, links)
+
+def _hand_over(redis_conn, key, links):
+    # Links written by older releases hold file names, and a key stored again since is no longer a reference
+    pipe = redis_conn.pipeline(transaction=False)
+    for link in links:
+        pipe.hget(link, "duplicate_of")
+    links = [link for link, duplicate_of in zip(links, pipe.execute()) if duplicate_of == key.encode('utf-8')]
+    stored = redis_conn.hgetall(key)
+    pipe = redis_conn.pipeline(transaction=True)
+    pipe.unlink(f"dedup:links:{key}")
+    if links:
+        heir, others = links[0], links[1:]
+        inherited = {field: value for field, value in stored.items() if field not in _RECORD_FIELDS}
+        if inherited:
+            pipe.hset(heir, mapping=inherited)
+        pipe.hdel(heir, "duplicate_of")
+        if b"minhash" in stored:
+            for band_key in _band_keys(np.frombuffer(stored[b"minhash"], dtype=np.uint32)):
+                pipe.sadd(band_key, heir)
+        for other in others:
+            pipe.hset(other, "duplicate_of", heir)
+        if others:
+            pipe.sadd(f"dedup:links:{heir}", *others)
+    pipe.execute()
+
+def _stored_signatures(results, redis_conn):
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for result in results:
+            pipe.hget(result.id, "minhash")
+        stored = pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Stored signatures unavailable, computing them: {e}")
+        stored = [None] * len(results)
+    # Chunks stored before signatures existed get one from their text
+    return [np.frombuffer(value, dtype=np.uint32) if value is not None else signature(result.text)
+            for result, value in zip(results, stored)]
+
+def collapse(results, threshold: float=DEDUP_THRESHOLD, redis_conn=None):
+    """The results without near-duplicates of a better-ranked result, in the same order and type.
+
+    With `redis_conn`, results are compared by the signatures stored with their chunks.
+    """
+    if redis_conn is not None:
+        signatures = _stored_signatures(results, redis_conn)
+    else:
+        signatures = [signature(result.text) for result in results]
+    kept, seen = [], []
+    for result, sig in zip(results, signatures):
+        if any(similarity(sig, other) >= threshold for other in seen):
+            continue
+        kept.append(result)
+        seen.append(sig)
+    if len(kept) == len(results):
+        return results
+    return type(results)(kept)
@@ -0,0 +1,261 @@
+"""
+Embedding models: which engine embeds documents and queries, its vector
+dimension, and a local CPU backend.
+
+EMBEDDINGS_BACKEND selects where embeddings are computed:
+
+- openai (default): the Azure OpenAI deployments in OPENAI_EMBEDDINGS_ENGINE_DOC
+  and OPENAI_EMBEDDINGS_ENGINE_QUERY.
+- local: LOCAL_EMBEDDINGS_MODEL, a Hugging Face sentence-embedding model run
+  on the CPU with transformers, mean-pooled and L2-normalised. It needs torch
+  (requirements-local.txt). With LOCAL_EMBEDDINGS_ONNX=true the model is
+  exported to ONNX once (int8 weights with LOCAL_EMBEDDINGS_QUANTIZE=true) and
+  run with onnxruntime; once exported, torch is no longer needed.
+
+Texts longer than LOCAL_EMBEDDINGS_MAX_LENGTH tokens are embedded in windows of
+that length and their token vectors averaged, so whole chunks are embedded.
+
+Local engines are named `local:<model>`, so they go through the same `engine`
+arguments as OpenAI deployments. Texts are embedded in length-sorted batches.
+Concurrent single-text calls (queries, ingestion workers) are merged into the
+next forward pass. LOCAL_EMBEDDINGS_THREADS sets the size of the intra-op
+thread pool.
+
+The index dimension comes from the document engine. For local models it is read
+from the model config. For OpenAI it comes from a table of known models, or from
+one probe request for other deployment names. EMBEDDINGS_DIMENSION overrides it
+for the configured document engine only; other engines, such as the target of an
+index migration, keep their own dimension.
+"""
+from concurrent.futures import Future
+from functools import lru_cache
+from queue import Queue, Empty
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_BACKEND = os.getenv('EMBEDDINGS_BACKEND', 'openai').lower()
+EMBEDDINGS_DIMENSION = os.getenv('EMBEDDINGS_DIMENSION')
+LOCAL_EMBEDDINGS_MODEL = os.getenv('LOCAL_EMBEDDINGS_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+LOCAL_EMBEDDINGS_BATCH_SIZE = int(os.getenv('LOCAL_EMBEDDINGS_BATCH_SIZE', 32))
+LOCAL_EMBEDDINGS_THREADS = int(os.getenv('LOCAL_EMBEDDINGS_THREADS', os.cpu_count() or 1))
+LOCAL_EMBEDDINGS_MAX_LENGTH = int(os.getenv('LOCAL_EMBEDDINGS_MAX_LENGTH', 512))
+LOCAL_EMBEDDINGS_ONNX = os.getenv('LOCAL_EMBEDDINGS_ONNX', 'false').lower() == 'true'
+LOCAL_EMBEDDINGS_QUANTIZE = os.getenv('LOCAL_EMBEDDINGS_QUANTIZE', 'false').lower() == 'true'
+LOCAL_EMBEDDINGS_CACHE = os.getenv('LOCAL_EMBEDDINGS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'qna-embeddings'))
+
+LOCAL_PREFIX = "local:"
+
+OPENAI_EMBEDDING_DIMS = {
+    "text-search-davinci-doc-001": 12288,
+    "text-search-davinci-query-001": 12288,
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+def get_embeddings_models() -> dict:
+    """Engines for documents and queries. Both must produce vectors of the same space."""
+    if EMBEDDINGS_BACKEND == 'local':
+        engine = f"{LOCAL_PREFIX}{LOCAL_EMBEDDINGS_MODEL}"
+        return {"doc": engine, "query": engine}
+    return {
+        "doc": os.getenv('OPENAI_EMBEDDINGS_ENGINE_DOC', 'text-embedding-ada-002'),
+        "query": os.getenv('OPENAI_EMBEDDINGS_ENGINE_QUERY', 'text-embedding-ada-002'),
+    }
+
+def is_local(engine: str) -> bool:
+    return bool(engine) and engine.startswith(LOCAL_PREFIX)
+
+@lru_cache(maxsize=None)
+def embedding_dimension(engine: str=None) -> int:
+    """Length of the vectors `engine` (by default the document engine) produces."""
+    configured = get_embeddings_models()["doc"]
+    engine = engine or configured
+    if EMBEDDINGS_DIMENSION and engine == configured:
+        return int(EMBEDDINGS_DIMENSION)
+    if is_local(engine):
+        from transformers import AutoConfig
+        return AutoConfig.from_pretrained(engine[len(LOCAL_PREFIX):]).hidden_size
+    if engine in OPENAI_EMBEDDING_DIMS:
+        return OPENAI_EMBEDDING_DIMS[engine]
+    # Azure deployment names are free-form: ask the deployment once
+    import openai
+    logger.info(f"Probing the embedding dimension of deployment {engine}")
+    response = openai.Embedding.create(input=["dimension"], engine=engine)
+    return len(response["data"][0]["embedding"])
+
+class LocalEmbeddingModel:
+    """A sentence-embedding model run on the CPU. Thread-safe."""
+
+    def __init__(self, name: str, batch_size: int=LOCAL_EMBEDDINGS_BATCH_SIZE, threads: int=LOCAL_EMBEDDINGS_THREADS,
+                 onnx: bool=LOCAL_EMBEDDINGS_ONNX, quantize: bool=LOCAL_EMBEDDINGS_QUANTIZE, max_length: int=LOCAL_EMBEDDINGS_MAX_LENGTH):
+        from transformers import AutoConfig, AutoTokenizer
+        self.name = name
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+        self.max_length = min(max_length, self.tokenizer.model_max_length)
+        self.dimension = AutoConfig.from_pretrained(name).hidden_size
+        if onnx:
+            self._session = _onnx_session(name, self.tokenizer, quantize, threads)
+            self._input_names = [i.name for i in self._session.get_inputs()]
+            self._run = self._run_onnx
+        else:
+            import torch
+            from transformers import AutoModel
+            torch.set_num_threads(threads)
+            self._model = AutoModel.from_pretrained(name).eval()
+            self._run = self._run_torch
+        # One forward pass at a time; the intra-op thread pool parallelises inside it
+        self._lock = threading.Lock()
+        self._pending = Queue()
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
+    def embed(self, texts) -> np.ndarray:
+        """Embeddings of `texts` as a float32 array, one row per text, in order."""
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Sorted by length, so each batch pads to texts of similar length
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            vectors[rows] = self._forward([texts[i] for i in rows])
+        return vectors
+
+    def embed_one(self, text: str) -> list:
+        """Embedding of one text. Calls made while a batch is running go together in the next one."""
+        future = Future()
+        self._pending.put((text, future))
+        self._start_batcher()
+        return future.result().tolist()
+
+    def _start_batcher(self):
+        if self._batcher is not None:
+            return
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = threading.Thread(target=self._batch_loop, name="local-embeddings", daemon=True)
+                self._batcher.start()
+
+    def _batch_loop(self):
+        while True:
+            items = [self._pending.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._pending.get_nowait())
+                except Empty:
+                    break
+            try:
+                vectors = self._forward([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(items, vectors):
+                future.set_result(vector)
+
+    def _forward(self, texts):
+        # Chunks run to thousands of tokens, far over max_length: fast tokenizers cut them into windows of
+        # max_length tokens, and a text's vector is the mean over the tokens of all its windows
+        windows = self.tokenizer.is_fast
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors='np',
+                                 return_overflowing_tokens=windows)
+        samples = encoded.pop('overflow_to_sample_mapping', None)
+        if samples is None:
+            samples = np.arange(len(texts))
+            truncated = int((encoded['attention_mask'].sum(axis=1) >= self.max_length).sum())
+            if truncated:
+                logger.warning(f"{truncated} texts cut at {self.max_length} tokens by {self.name}, which has no fast tokenizer")
+        sums = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        counts = np.zeros((len(texts), 1), dtype=np.float32)
+        for start in range(0, len(samples), self.batch_size):
+            batch = {key: value[start:start + self.batch_size] for key, value in encoded.items()}
+            with self._lock, span("local.embedding", model=self.name, texts=len(texts), windows=len(batch['attention_mask'])):
+                hidden = self._run(batch)
+            # Mean pooling over the real tokens, then L2 normalisation (cosine distance in the index)
+            mask = batch['attention_mask'][..., None].astype(np.float32)
+            np.add.at(sums, samples[start:start + self.batch_size], (hidden * mask).sum(axis=1))
+            np.add.at(counts, samples[start:start + self.batch_size], mask.sum(axis=1))
+        pooled = sums / np.clip(counts, 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def _run_torch(self, encoded):
+        import torch
+        with torch.inference_mode():
+            output = self._model(**{key: torch.from_numpy(value) for key, value in encoded.items()})
+        return output.last_hidden_state.numpy()
+
+    def _run_onnx(self, encoded):
+        return self._session.run(None, {name: encoded[name] for name in self._input_names})[0]
+
+def _onnx_session(name, tokenizer, quantize, threads):
+    import onnxruntime
+    directory = os.path.join(LOCAL_EMBEDDINGS_CACHE, re.sub(r'[^\w.-]', '_', name))
+    path = os.path.join(directory, "model.onnx")
+    if not os.path.exists(path):
+        _export_onnx(name, tokenizer, directory, path)
+    if quantize:
+        quantized = os.path.join(directory, "model.int8.onnx")
+        if not os.path.exists(quantized):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            logger.info(f"Quantizing {name} to int8")
+            quantize_dynamic(path, quantized + ".tmp", weight_type=QuantType.QInt8)
+            os.replace(quantized + ".tmp", quantized)
+        path = quantized
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+def _export_onnx(name, tokenizer, directory, path):
+    try:
+        import torch
+    except ImportError:
+        raise ImportError(f"Exporting {name} to ONNX needs torch (requirements-local.txt). Export it once where torch is "
+                          f"installed and copy {directory} to LOCAL_EMBEDDINGS_CACHE; running the ONNX model needs only onnxruntime")
+    from transformers import AutoModel
+
+    class Encoder(torch.nn.Module):
+        def __init__(self, model, input_names):
+            super().__init__()
+            self.model = model
+            self.input_names = input_names
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(self.input_names, inputs))).last_hidden_state
+
+    logger.info(f"Exporting {name} to ONNX in {directory}")
+    sample = tokenizer(["export sample"], return_tensors='pt')
+    input_names = list(sample.keys())
+    os.makedirs(directory, exist_ok=True)
+    # Written under a temporary name, so a concurrent worker never loads a partial file
+    torch.onnx.export(
+        Encoder(AutoModel.from_pretrained(name).eval(), input_names),
+        tuple(sample[key] for key in input_names),
+        path + ".tmp",
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes={key: {0: "batch", 1: "sequence"} for key in input_names + ["last_hidden_state"]},
+        opset_version=14,
+    )
+    os.replace(path + ".tmp", path)
+
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+def get_local_model(engine: str) -> LocalEmbeddingModel:
+    """The loaded model for a `local:<model>` engine, once per process."""
+    model = _local_models.get(engine)
+    if model is None:
+        with _local_models_lock:
+            model = _local_models.get(engine)
+            if model is None:
+                with span("local.embedding.load", model=engine):
+                    model = _local_models[engine] = LocalEmbeddingModel(engine[len(LOCAL_PREFIX):] if is_local(engine) else engine)
+    return model
@@ -0,0 +1,215 @@
+"""
+Text extraction router: reads born-digital documents locally and sends only
+scans to Form Recognizer.
+
+PDF, DOCX and PPTX files are downloaded once to a temporary file and parsed in a
+process pool of LOCAL_EXTRACTION_WORKERS processes. Long PDFs are split into page
+ranges parsed in parallel. The output has the same page-bucketed shape as
+formrecognizer.iter_analyze_read, with one chunk per PAGES_PER_EMBEDDINGS pages.
+Slides count as pages. DOCX files have no stored layout. Their pages come from
+the page breaks Word saved, or from every DOCX_CHARS_PER_PAGE characters when
+there are none.
+
+A PDF has a usable text layer when at least LOCAL_EXTRACTION_MIN_TEXT_PAGES of its
+pages hold LOCAL_EXTRACTION_MIN_PAGE_CHARS characters, mostly letters and digits
+(broken font encodings produce symbols). Office files need that many characters in
+total. Scanned PDFs, images, Office files without text and files the parsers
+cannot read go to Form Recognizer, as before.
+
+Files over LOCAL_EXTRACTION_MAX_BYTES are not downloaded past that size and go to
+Form Recognizer. Parsing needs pypdf, python-docx and python-pptx. Without them
+every file goes to Form Recognizer.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import requests
+
+from utilities.formrecognizer import PAGES_PER_EMBEDDINGS, iter_analyze_read
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
+
+LOCAL_EXTRACTION = os.getenv('LOCAL_EXTRACTION', 'true').lower() == 'true'
+LOCAL_EXTRACTION_WORKERS = int(os.getenv('LOCAL_EXTRACTION_WORKERS', os.cpu_count() or 1))
+LOCAL_EXTRACTION_PAGES_PER_TASK = int(os.getenv('LOCAL_EXTRACTION_PAGES_PER_TASK', 16))
+LOCAL_EXTRACTION_MIN_PAGE_CHARS = int(os.getenv('LOCAL_EXTRACTION_MIN_PAGE_CHARS', 50))
+LOCAL_EXTRACTION_MIN_TEXT_PAGES = float(os.getenv('LOCAL_EXTRACTION_MIN_TEXT_PAGES', 0.9))
+DOCX_CHARS_PER_PAGE = int(os.getenv('DOCX_CHARS_PER_PAGE', 3000))
+# Seconds to wait for the document download
+LOCAL_EXTRACTION_TIMEOUT = int(os.getenv('LOCAL_EXTRACTION_TIMEOUT', 60))
+# Larger documents are not downloaded or parsed here; Form Recognizer reads them
+LOCAL_EXTRACTION_MAX_BYTES = int(os.getenv('LOCAL_EXTRACTION_MAX_BYTES', 100 * 2**20))
+
+LOCAL_FORMATS = ('.pdf', '.docx', '.pptx')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the app and the functions host run other threads
+            _pool = ProcessPoolExecutor(max_workers=max(1, LOCAL_EXTRACTION_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _table_text(rows) -> str:
+    # Same pipe layout as the tables of Form Recognizer chunks
+    return "".join("| " + " | ".join(cell.strip() for cell in row) + " |\n" for row in rows)
+
+def _pdf_page_count(path) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+def _pdf_pages(path, start, stop) -> list:
+    from pypdf import PdfReader
+    pages = PdfReader(path).pages
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+def _docx_pages(path) -> list:
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    document = docx.Document(path)
+    body = document.element.body
+    breaks = './/w:lastRenderedPageBreak | .//w:br[@w:type="page"]'
+    # Documents Word never paginated have no break markers; fall back to a character budget
+    use_breaks = bool(body.xpath(breaks))
+    pages, current, size = [], [], 0
+    for element in body.iterchildren():
+        if element.tag.endswith('}p'):
+            paragraph = Paragraph(element, document)
+            if use_breaks and current and element.xpath(breaks):
+                pages.append("\n".join(current))
+                current, size = [], 0
+            text = paragraph.text
+        elif element.tag.endswith('}tbl'):
+            text = _table_text([cell.text for cell in row.cells] for row in Table(element, document).rows)
+        else:
+            continue
+        if not text.strip():
+            continue
+        if not use_breaks and current and size + len(text) > DOCX_CHARS_PER_PAGE:
+            pages.append("\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += len(text)
+    if current:
+        pages.append("\n".join(current))
+    return pages
+
+def _pptx_pages(path) -> list:
+    from pptx import Presentation
+    pages = []
+    for slide in Presentation(path).slides:
+        texts = []
+        for shape in slide.shapes:
+            if shape.has_text_frame and shape.text_frame.text.strip():
+                texts.append(shape.text_frame.text)
+            elif getattr(shape, "has_table", False) and shape.has_table:
+                texts.append(_table_text([cell.text for cell in row.cells] for row in shape.table.rows))
+        if slide.has_notes_slide and slide.notes_slide.notes_text_frame.text.strip():
+            texts.append(slide.notes_slide.notes_text_frame.text)
+        pages.append("\n".join(texts))
+    return pages
+
+def _is_text_page(text) -> bool:
+    characters = [c for c in text if not c.isspace()]
+    if len(characters) < LOCAL_EXTRACTION_MIN_PAGE_CHARS:
+        return False
+    return sum(1 for c in characters if c.isalnum()) >= len(characters) / 2
+
+def has_text_layer(pages, extension: str='.pdf') -> bool:
+    """Whether locally extracted pages are good enough to skip OCR."""
+    if not pages:
+        return False
+    if extension != '.pdf':
+        # Office text is never an OCR layer; slides with only a title or a picture are normal
+        return _is_text_page("".join(pages))
+    return sum(1 for page in pages if _is_text_page(page)) >= LOCAL_EXTRACTION_MIN_TEXT_PAGES * len(pages)
+
+def extract_pages(path: str, extension: str) -> list:
+    """Text of each page of a local PDF, DOCX or PPTX file, parsed in the process pool."""
+    pool = _get_pool()
+    if extension == '.pdf':
+        count = _pdf_page_count(path)
+        step = max(1, LOCAL_EXTRACTION_PAGES_PER_TASK)
+        futures = [pool.submit(_pdf_pages, path, start, min(count, start + step)) for start in range(0, count, step)]
+        return [page for future in futures for page in future.result()]
+    if extension == '.docx':
+        return pool.submit(_docx_pages, path).result()
+    return pool.submit(_pptx_pages, path).result()
+
+def _chunks(pages):
+    # Same buckets as iter_analyze_read: chunk i holds pages i*P+1 to (i+1)*P
+    for index in range(0, -(-len(pages) // PAGES_PER_EMBEDDINGS)):
+        text = "\n".join(page for page in pages[index * PAGES_PER_EMBEDDINGS:(index + 1) * PAGES_PER_EMBEDDINGS] if page.strip())
+        if text:
+            yield {"index": index, "text": text + "\n", "pages": (index * PAGES_PER_EMBEDDINGS + 1, (index + 1) * PAGES_PER_EMBEDDINGS)}
+
+class _TooLarge(Exception):
+    pass
+
+def _download(url, path, max_bytes=None):
+    max_bytes = LOCAL_EXTRACTION_MAX_BYTES if max_bytes is None else max_bytes
+    with requests.get(url, stream=True, timeout=LOCAL_EXTRACTION_TIMEOUT) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise _TooLarge(f"{int(length)} bytes")
+        received = 0
+        with open(path, "wb") as f:
+            # Content-Length may be missing or wrong; the count of bytes received is what holds
+            for block in response.iter_content(chunk_size=1 << 20):
+                received += len(block)
+                if received > max_bytes:
+                    raise _TooLarge(f"more than {max_bytes} bytes")
+                f.write(block)
+
+def _local_pages(url, filename, data, extension):
+    # Page texts, or None when the document needs OCR
+    if data is not None and len(data) > LOCAL_EXTRACTION_MAX_BYTES:
+        logger.info(f"{filename} is larger than LOCAL_EXTRACTION_MAX_BYTES, using Form Recognizer")
+        return None
+    fd, path = tempfile.mkstemp(suffix=extension)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if data is not None:
+                f.write(data)
+        if data is None:
+            _download(url, path)
+        pages = extract_pages(path, extension)
+    except _TooLarge as e:
+        logger.info(f"{filename} is larger than LOCAL_EXTRACTION_MAX_BYTES ({e}), using Form Recognizer")
+        return None
+    except Exception as e:
+        logger.warning(f"Local extraction of {filename} failed, using Form Recognizer: {e}")
+        return None
+    finally:
+        os.remove(path)
+    return pages if has_text_layer(pages, extension) else None
+
+def iter_extract(url: str, filename: str, data: bytes=None):
+    """Chunks of a document, like formrecognizer.iter_analyze_read, read locally when possible.
+
+    `url` must be readable by Form Recognizer. `data` holds the file contents when the
+    caller already has them, which saves the download.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    pages = None
+    if LOCAL_EXTRACTION and extension in LOCAL_FORMATS:
+        with span("extraction.local", filename=filename) as current:
+            pages = _local_pages(url, filename, data, extension)
+            current.set_attribute("text_layer", pages is not None)
+            if pages is not None:
+                current.set_attribute("pages", len(pages))
+    if pages is not None:
+        logger.info(f"{filename}: {len(pages)} pages extracted locally")
+        yield from _chunks(pages)
+    else:
+        yield from iter_analyze_read(url)
@@ -1,28 +1,44 @@
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
 from azure.ai.formrecognizer import DocumentAnalysisClient
+from collections import deque
+import logging
 import os
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
 
 PAGES_PER_EMBEDDINGS = int(os.getenv('PAGES_PER_EMBEDDINGS', 2))
 SECTION_TO_EXCLUDE = ['title', 'sectionHeading', 'footnote', 'pageHeader', 'pageFooter', 'pageNumber']
 
-def analyze_read(formUrl):
+# Pages per analyze request (rounded up to whole chunks) and requests polled at the same time
+FORM_RECOGNIZER_PAGES_PER_REQUEST = int(os.getenv('FORM_RECOGNIZER_PAGES_PER_REQUEST', 8))
+FORM_RECOGNIZER_CONCURRENT_REQUESTS = int(os.getenv('FORM_RECOGNIZER_CONCURRENT_REQUESTS', 2))
+
+# Inner error of a request for pages past the end of the document:
+# "The parameter pages is invalid: The page range exceeds the number of pages in the document."
+_PAGE_RANGE_ERROR_CODES = ('InvalidParameter', 'InvalidPageRange')
 
-    document_analysis_client = DocumentAnalysisClient(
+def _is_past_last_page(error: HttpResponseError) -> bool:
+    odata = error.error
+    if odata is None:
+        return False
+    inner = odata.innererror or {}
+    code, message = inner.get('code') or odata.code, inner.get('message') or odata.message or ''
+    return code in _PAGE_RANGE_ERROR_CODES and 'pages' in message.lower()
+
+def _get_client():
+    return DocumentAnalysisClient(
         endpoint=os.environ['FORM_RECOGNIZER_ENDPOINT'], credential=AzureKeyCredential(os.environ['FORM_RECOGNIZER_KEY'])
     )
-    
-    poller = document_analysis_client.begin_analyze_document_from_url(
-            "prebuilt-layout", formUrl)
-    layout = poller.result()
 
-    results = []
-    page_result = ''
+def _layout_chunks(layout):
+    # Text of each group of PAGES_PER_EMBEDDINGS pages, keyed by chunk number
+    results = {}
     for p in layout.paragraphs:
         page_number = p.bounding_regions[0].page_number
         output_file_id = int((page_number - 1 ) / PAGES_PER_EMBEDDINGS)
-
-        if len(results) < output_file_id + 1:
-            results.append('')
+        results.setdefault(output_file_id, '')
 
         if p.role not in SECTION_TO_EXCLUDE:
             results[output_file_id] += f"{p.content}\n"
@@ -30,9 +46,7 @@ def analyze_read(formUrl):
     for t in layout.tables:
         page_number = t.bounding_regions[0].page_number
         output_file_id = int((page_number - 1 ) / PAGES_PER_EMBEDDINGS)
-        
-        if len(results) < output_file_id + 1:
-            results.append('')
+        results.setdefault(output_file_id, '')
         previous_cell_row=0
         rowcontent='| '
         tablecontent = ''
@@ -46,3 +60,57 @@ def analyze_read(formUrl):
                 previous_cell_row += 1
         results[output_file_id] += f"{tablecontent}|"
     return results
+
+def iter_analyze_read(formUrl, pages_per_request: int=FORM_RECOGNIZER_PAGES_PER_REQUEST, concurrent_requests: int=FORM_RECOGNIZER_CONCURRENT_REQUESTS):
+    """Analyze a document in page windows and yield its chunks as soon as each window is done.
+
+    Yields dicts with `index` (chunk number), `text` and `pages` (first and last page of the chunk),
+    in document order. Up to `concurrent_requests` windows are analysed at the same time, so
+    callers can embed the first pages while later ones are still in OCR.
+    """
+    document_analysis_client = _get_client()
+    # Windows hold whole chunks so that no chunk is split across two requests
+    window = max(1, -(-pages_per_request // PAGES_PER_EMBEDDINGS)) * PAGES_PER_EMBEDDINGS
+    in_flight = deque()
+    next_page = 1
+    last_window = False
+
+    def submit():
+        nonlocal next_page
+        pages = f"{next_page}-{next_page + window - 1}"
+        in_flight.append((next_page, pages, document_analysis_client.begin_analyze_document_from_url("prebuilt-layout", formUrl, pages=pages)))
+        next_page += window
+
+    while True:
+        # At least one window in flight, or the loop would end after the first one
+        while not last_window and len(in_flight) < max(1, concurrent_requests):
+            submit()
+        if not in_flight:
+            break
+        first_page, pages, poller = in_flight.popleft()
+        with span("formrecognizer.analyze", model="prebuilt-layout", pages=pages) as current:
+            try:
+                layout = poller.result()
+            except HttpResponseError as e:
+                # Windows past the last page are rejected by the service; any other failure loses pages
+                if first_page == 1 or not _is_past_last_page(e):
+                    raise
+                logger.info(f"Stopping analysis at page {first_page}: {e.message}")
+                break
+            current.set_attribute("analyzed_pages", len(layout.pages))
+        chunks = _layout_chunks(layout)
+        for index in sorted(chunks):
+            yield {"index": index, "text": chunks[index], "pages": (index * PAGES_PER_EMBEDDINGS + 1, (index + 1) * PAGES_PER_EMBEDDINGS)}
+        if len(layout.pages) < window:
+            # Anything already submitted is past the end of the document
+            last_window = True
+            in_flight.clear()
+
+def analyze_read(formUrl):
+    results = []
+    for chunk in iter_analyze_read(formUrl):
+        # Keep chunk numbers as positions, as callers name chunks by index
+        while len(results) < chunk["index"]:
+            results.append('')
+        results.append(chunk["text"])
+    return results
@@ -0,0 +1,259 @@
+"""
+Blue/green migrations of the embeddings index, to change the embeddings model or
+the index parameters without downtime.
+
+Queries go through the `embeddings-active` alias (see redisembeddings.index_alias).
+A migration runs in four steps:
+
+1. start_migration creates `embeddings-index-vN` over the same chunk hashes. The
+   new index reads its vectors from a new hash field, `embeddings_vN`, and is
+   registered as "building".
+2. build re-embeds every chunk into that field with the new model, at most
+   INDEX_MIGRATION_RATE chunks per second. It reports throughput and ETA as it goes.
+   Meanwhile ingestion writes new chunks to both fields (utils.embed_chunk), so
+   nothing is missed. The build can be stopped and resumed. Chunks that already
+   have the new field are skipped.
+3. switch embeds the chunks stored since the build and moves the alias to the new
+   index in one MULTI with the registry update. Other processes pick the change
+   up within ACTIVE_INDEX_REFRESH seconds. Until then they keep querying the old
+   index with the old model, which stays consistent.
+4. retire drops the old index after INDEX_RETIRE_GRACE seconds and deletes its
+   vector field from the chunks.
+
+    python index_migration.py start --doc-model text-embedding-3-small --query-model text-embedding-3-small
+    python index_migration.py build --rate 100
+    python index_migration.py switch
+    python index_migration.py retire
+"""
+import logging
+import os
+import time
+
+import numpy as np
+
+from utilities.redisembeddings import (DOCUMENTS_VERSION_KEY, INDEX_VERSIONS_KEY, IndexVersion, create_index, ensure_indexes,
+                                       get_index, get_index_state, get_index_versions, get_redis_conn, index_alias, index_name,
+                                       register_index_version)
+from utilities.embeddingmodels import get_embeddings_models
+from utilities.tracing import span
+from utilities.utils import get_embedding, get_embeddings
+
+logger = logging.getLogger(__name__)
+
+# Chunks re-embedded per second by build; 0 removes the limit. The deployment's rate limiter still applies.
+INDEX_MIGRATION_RATE = float(os.getenv('INDEX_MIGRATION_RATE', 50))
+INDEX_MIGRATION_BATCH = int(os.getenv('INDEX_MIGRATION_BATCH', 100))
+# Seconds between a switch and the earliest retire of the previous index
+INDEX_RETIRE_GRACE = int(os.getenv('INDEX_RETIRE_GRACE', 3600))
+# Seconds between progress log lines
+INDEX_MIGRATION_LOG_INTERVAL = 10
+
+# Writes the vector only if the chunk still exists, so a chunk deleted during the build is not recreated
+_SET_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+return -1
+"""
+
+class MigrationError(Exception):
+    pass
+
+def _num_docs(name) -> int:
+    return int(get_index(name).info()["num_docs"])
+
+def status() -> list:
+    """Every index version with the number of chunks it has indexed, the active one first."""
+    active, _ = get_index_state(refresh=True)
+    versions = sorted(get_index_versions().values(), key=lambda version: (version.name != active.name, -version.version))
+    rows = []
+    for version in versions:
+        info = get_index(version.name).info()
+        rows.append({"name": version.name, "state": version.state, "field": version.field, "doc_model": version.doc_model,
+                     "query_model": version.query_model, "dimension": version.dimension, "chunks": int(info["num_docs"]),
+                     "indexing_failures": int(info.get("hash_indexing_failures", 0)), "switched_at": version.switched_at})
+    return rows
+
+def start_migration(doc_model: str=None, query_model: str=None, dimension: int=None, distance_metric: str="COSINE",
+                    hnsw_params: dict=None) -> IndexVersion:
+    """Create the next index version and register it as building. Models default to the configured ones.
+
+    Without `dimension`, one text is embedded with `doc_model` to measure it.
+    """
+    ensure_indexes()
+    if get_index_state(refresh=True)[1] is not None:
+        raise MigrationError(f"{get_index_state()[1].name} is already being built; switch or abort it first")
+    models = get_embeddings_models()
+    doc_model = doc_model or models["doc"]
+    query_model = query_model or (models["query"] if doc_model == models["doc"] else doc_model)
+    dimension = dimension or len(get_embedding("dimension", engine=doc_model))
+    if not dimension:
+        raise MigrationError(f"{doc_model} did not return an embedding")
+    number = max(version.version for version in get_index_versions().values()) + 1
+    version = IndexVersion(f"{index_name}-v{number}", number, f"embeddings_v{number}", doc_model, query_model, dimension, state="building")
+    create_index(get_redis_conn(), index_name=version.name, distance_metric=distance_metric, field=version.field,
+                 dimension=dimension, hnsw_params=hnsw_params)
+    register_index_version(version)
+    get_index_state(refresh=True)
+    logger.info(f"Created {version.name}: {doc_model}, {dimension} dimensions, field {version.field}")
+    return version
+
+def _building(version: IndexVersion=None) -> IndexVersion:
+    building = version or get_index_state(refresh=True)[1]
+    if building is None or building.state != "building":
+        raise MigrationError("No index is being built; run start first")
+    return building
+
+def _build_batch(redis_conn, script, keys, version, stats):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, "text", version.field, "duplicate_of")
+    todo = []
+    for key, (text, vector, duplicate_of) in zip(keys, pipe.execute()):
+        # Near-duplicate references have no vectors in any version
+        if vector is not None or duplicate_of is not None:
+            stats["skipped"] += 1
+        elif text:
+            todo.append((key, text.decode('utf-8')))
+    if not todo:
+        return
+    vectors = get_embeddings([text for _, text in todo], engine=version.doc_model)
+    pipe = redis_conn.pipeline(transaction=False)
+    for (key, _), vector in zip(todo, vectors):
+        if len(vector) != version.dimension:
+            stats["failed"] += 1
+            continue
+        script(keys=[key], args=[version.field, np.array(vector, dtype=np.float32).tobytes()], client=pipe)
+    for written in pipe.execute():
+        stats["embedded" if written != -1 else "deleted"] += 1
+
+def build(version: IndexVersion=None, rate: float=INDEX_MIGRATION_RATE, batch_size: int=INDEX_MIGRATION_BATCH, progress=None) -> dict:
+    """Embed every chunk that lacks the vector field of `version` (by default the one being built).
+
+    `progress(stats)` is called after each batch with the counts (scanned, embedded,
+    skipped, failed, deleted), the total, the chunks per second and the ETA in seconds.
+    Returns the final stats. Safe to interrupt and run again.
+    """
+    version = _building(version)
+    redis_conn = get_redis_conn()
+    script = redis_conn.register_script(_SET_IF_EXISTS)
+    stats = {"scanned": 0, "embedded": 0, "skipped": 0, "failed": 0, "deleted": 0,
+             "total": _num_docs(index_alias), "rate": 0.0, "eta": None}
+    start = last_log = time.monotonic()
+    with span("index_migration.build", index=version.name, rate=rate) as current:
+        keys = []
+        for key in redis_conn.scan_iter(match="embedding:*", count=batch_size):
+            keys.append(key)
+            if len(keys) < batch_size:
+                continue
+            _build_batch(redis_conn, script, keys, version, stats)
+            stats["scanned"] += len(keys)
+            keys = []
+            _update_rates(stats, start)
+            if progress:
+                progress(stats)
+            if time.monotonic() - last_log >= INDEX_MIGRATION_LOG_INTERVAL:
+                last_log = time.monotonic()
+                _log_progress(version, stats)
+            # Paced on the chunks embedded, so resuming over finished chunks is not slowed down
+            if rate:
+                ahead = stats["embedded"] / rate - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if keys:
+            _build_batch(redis_conn, script, keys, version, stats)
+            stats["scanned"] += len(keys)
+        _update_rates(stats, start)
+        stats["eta"] = 0.0
+        if progress:
+            progress(stats)
+        for name in ("embedded", "skipped", "failed"):
+            current.set_attribute(name, stats[name])
+    _log_progress(version, stats)
+    return stats
+
+def _update_rates(stats, start):
+    elapsed = max(time.monotonic() - start, 1e-9)
+    stats["rate"] = stats["embedded"] / elapsed
+    # Scanned chunks include skipped ones, so the ETA follows the actual pace of the scan
+    remaining = max(0, stats["total"] - stats["scanned"])
+    stats["eta"] = remaining * elapsed / stats["scanned"] if stats["scanned"] else None
+
+def _log_progress(version, stats):
+    eta = f"{stats['eta'] / 60:.1f} min" if stats["eta"] is not None else "unknown"
+    logger.info(f"{version.name}: {stats['scanned']}/{stats['total']} chunks scanned, {stats['embedded']} embedded "
+                f"({stats['rate']:.1f}/s), {stats['skipped']} already done, {stats['failed']} failed, ETA {eta}")
+
+def switch(version: IndexVersion=None, catch_up: bool=True, batch_size: int=INDEX_MIGRATION_BATCH) -> IndexVersion:
+    """Point the alias at `version` (by default the one being built) and make it the active version.
+
+    With `catch_up`, chunks stored without the new field are embedded first, without
+    the migration rate limit. Returns the previous active version, now retired.
+    """
+    version = _building(version)
+    if catch_up:
+        stats = build(version, rate=0, batch_size=batch_size)
+        if stats["failed"]:
+            raise MigrationError(f"{stats['failed']} chunks could not be embedded with {version.doc_model}; run build again before switching")
+    previous = get_index_state(refresh=True)[0]
+    missing = _num_docs(previous.name) - _num_docs(version.name)
+    if missing > 0:
+        logger.warning(f"{version.name} indexes {missing} chunks fewer than {previous.name}")
+    version.state, version.switched_at = "active", time.time()
+    previous.state = "retired"
+    with span("index_migration.switch", index=version.name, previous=previous.name):
+        pipe = get_redis_conn().pipeline(transaction=True)
+        pipe.ft(version.name).aliasupdate(index_alias)
+        register_index_version(version, pipe)
+        register_index_version(previous, pipe)
+        # Cached answers were computed with the old index
+        pipe.incr(DOCUMENTS_VERSION_KEY)
+        pipe.execute()
+    get_index_state(refresh=True)
+    logger.info(f"Switched {index_alias} from {previous.name} to {version.name}")
+    return previous
+
+def _drop(version, batch_size):
+    # Drops the index and its vector field; the chunk hashes are shared with the other versions
+    redis_conn = get_redis_conn()
+    get_index(version.name).dropindex(delete_documents=False)
+    keys = []
+    for key in redis_conn.scan_iter(match="embedding:*", count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            _hdel_batch(redis_conn, keys, version.field)
+            keys = []
+    if keys:
+        _hdel_batch(redis_conn, keys, version.field)
+    redis_conn.hdel(INDEX_VERSIONS_KEY, version.name)
+    get_index_state(refresh=True)
+
+def _hdel_batch(redis_conn, keys, field):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hdel(key, field)
+    pipe.execute()
+
+def retire(force: bool=False, batch_size: int=INDEX_MIGRATION_BATCH) -> list:
+    """Drop the retired index versions once INDEX_RETIRE_GRACE seconds have passed since the switch.
+
+    Returns the names of the dropped indexes.
+    """
+    active = get_index_state(refresh=True)[0]
+    elapsed = time.time() - (active.switched_at or 0)
+    if not force and elapsed < INDEX_RETIRE_GRACE:
+        raise MigrationError(f"{active.name} became active {elapsed:.0f}s ago; wait {INDEX_RETIRE_GRACE - elapsed:.0f}s or force it")
+    dropped = []
+    for version in get_index_versions().values():
+        if version.state == "retired":
+            _drop(version, batch_size)
+            dropped.append(version.name)
+            logger.info(f"Dropped {version.name} and the {version.field} vectors")
+    return dropped
+
+def abort(version: IndexVersion=None, batch_size: int=INDEX_MIGRATION_BATCH) -> IndexVersion:
+    """Drop the index being built and the vectors written for it. Queries are not affected."""
+    version = _building(version)
+    _drop(version, batch_size)
+    logger.info(f"Aborted the migration to {version.name}")
+    return version
@@ -0,0 +1,171 @@
+"""
+Staged ingestion pipeline for documents converted locally or with Form Recognizer
+(see utilities.extraction).
+
+    extract -> chunk -> embed (N workers) -> store
+           \\-> archive (converted text streamed to blob storage, off the critical path)
+
+Each stage runs in its own thread and the stages are connected by bounded
+queues. The first pages are embedded and stored while Form Recognizer is still
+analysing later page windows, so per-document latency approaches that of the
+slowest stage instead of the sum of all of them. The bounded queues keep memory
+flat for long documents. When a stage fails the others stop, except for the
+archive: its failures are logged and the document is still embedded and stored.
+"""
+from queue import Queue, Empty, Full
+import logging
+import os
+import threading
+
+from utilities.azureblobstorage import upsert_blob_metadata
+from utilities.convertedtext import ConvertedTextWriter
+from utilities.extraction import iter_extract
+from utilities.dedup import check_chunk
+from utilities.redisembeddings import get_redis_conn
+from utilities.tracing import span
+from utilities.utils import split_text, embed_chunk, store_chunk
+
+logger = logging.getLogger(__name__)
+
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 16))
+INGEST_EMBED_WORKERS = int(os.getenv('INGEST_EMBED_WORKERS', 4))
+
+_DONE = object()
+
+class _Pipeline:
+    def __init__(self):
+        self.stop = threading.Event()
+        self.errors = []
+        self._threads = []
+
+    def put(self, queue, item):
+        # Blocks while the queue is full, unless another stage has failed
+        while not self.stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue):
+        while not self.stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                continue
+        return _DONE
+
+    def start(self, name, target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                logger.error(f"Ingestion stage {name} failed: {e}")
+                self.errors.append(e)
+                self.stop.set()
+        thread = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+def ingest_document(form_url: str, filename: str, embed_workers: int=INGEST_EMBED_WORKERS, queue_size: int=INGEST_QUEUE_SIZE, archive: bool=True,
+                    data: bytes=None) -> int:
+    """Extract, chunk, embed and store a document. Returns the number of chunks stored or
+    recognised as near-duplicates of stored chunks (see utilities.dedup).
+
+    `data` holds the file contents when the caller has them; otherwise they are read from `form_url`.
+
+    Raises the first stage error, after the other stages have stopped.
+    """
+    pipeline = _Pipeline()
+    extracted = Queue(maxsize=queue_size)
+    to_embed = Queue(maxsize=queue_size)
+    to_store = Queue(maxsize=queue_size)
+    to_archive = Queue(maxsize=queue_size)
+    stored = [0]
+    duplicates = [0]
+
+    def extract():
+        for chunk in iter_extract(form_url, filename, data):
+            if not pipeline.put(extracted, chunk) or (archive and not pipeline.put(to_archive, chunk)):
+                return
+        pipeline.put(extracted, _DONE)
+        if archive:
+            pipeline.put(to_archive, _DONE)
+
+    def archive_text():
+        # The archive only serves the converted text view; its failures must not lose the embeddings
+        item = None
+        try:
+            writer = ConvertedTextWriter(filename)
+            while True:
+                item = pipeline.get(to_archive)
+                if item is _DONE:
+                    break
+                writer.add(item["index"], item["text"], item["pages"])
+            if pipeline.stop.is_set():
+                return
+            writer.close()
+            upsert_blob_metadata(filename, {"converted": "true", "chunks": str(len(writer.entries)), "converted_format": "chunks"})
+        except Exception as e:
+            logger.error(f"Archiving the converted text of {filename} failed, the document is still stored: {e}")
+            # Drain the queue so that extract never blocks on it
+            while item is not _DONE:
+                item = pipeline.get(to_archive)
+
+    def chunk():
+        while True:
+            item = pipeline.get(extracted)
+            if item is _DONE:
+                break
+            for text, name in split_text(item["text"], f"{filename}_chunk_{item['index']}"):
+                if not pipeline.put(to_embed, {"text": text, "filename": name}):
+                    return
+        for _ in range(embed_workers):
+            pipeline.put(to_embed, _DONE)
+
+    def embed():
+        while True:
+            item = pipeline.get(to_embed)
+            if item is _DONE:
+                break
+            # Near-duplicates of a stored chunk skip the embedding call
+            if not check_chunk(item, get_redis_conn()):
+                if not embed_chunk(item):
+                    continue
+            if not pipeline.put(to_store, item):
+                return
+        pipeline.put(to_store, _DONE)
+
+    def store():
+        finished = 0
+        while finished < embed_workers:
+            item = pipeline.get(to_store)
+            if item is _DONE:
+                finished += 1
+                continue
+            store_chunk(item)
+            if item.get("duplicate_of"):
+                duplicates[0] += 1
+            else:
+                stored[0] += 1
+
+    with span("ingest.pipeline", filename=filename) as current:
+        pipeline.start("extract", extract)
+        pipeline.start("chunk", chunk)
+        for i in range(embed_workers):
+            pipeline.start(f"embed-{i}", embed)
+        pipeline.start("store", store)
+        if archive:
+            pipeline.start("archive", archive_text)
+        pipeline.join()
+        current.set_attribute("chunks", stored[0])
+        current.set_attribute("duplicates", duplicates[0])
+    if pipeline.errors:
+        raise pipeline.errors[0]
+    return stored[0] + duplicates[0]
@@ -0,0 +1,100 @@
+"""
+Offline language detection with character trigram profiles.
+
+Small enough to run on every query and every ingested chunk without a network
+call. Profiles are built once from the seed texts below; detection combines the
+trigram similarity with stopword hits, which carry most of the signal for short
+questions.
+"""
+from collections import Counter
+from functools import lru_cache
+import math
+import re
+
+SEED_TEXTS = {
+    "es": "¿Cuál es el horario de la reunión de la comunidad? La información que buscas está en el documento. "
+          "Por favor, responde a la pregunta utilizando únicamente el texto anterior. Los miembros de la iglesia "
+          "se reúnen cada domingo para celebrar juntos y compartir con las familias que necesitan ayuda. "
+          "También hay actividades para los jóvenes durante la semana y un grupo de oración los miércoles.",
+    "en": "What is the schedule for the community meeting? The information you are looking for is in the document. "
+          "Please answer the question using only the text above. The members of the church meet every Sunday "
+          "to celebrate together and share with the families who need help. There are also activities for young "
+          "people during the week and a prayer group on Wednesdays.",
+    "pt": "Qual é o horário da reunião da comunidade? A informação que você procura está no documento. "
+          "Por favor, responda à pergunta usando apenas o texto acima. Os membros da igreja se reúnem todos os "
+          "domingos para celebrar juntos e compartilhar com as famílias que precisam de ajuda. Também há "
+          "atividades para os jovens durante a semana e um grupo de oração às quartas-feiras.",
+    "fr": "Quel est l'horaire de la réunion de la communauté ? L'information que vous cherchez se trouve dans le "
+          "document. Veuillez répondre à la question en utilisant uniquement le texte ci-dessus. Les membres de "
+          "l'église se réunissent chaque dimanche pour célébrer ensemble et partager avec les familles qui ont "
+          "besoin d'aide. Il y a aussi des activités pour les jeunes pendant la semaine.",
+    "de": "Wann findet das Treffen der Gemeinde statt? Die Information, die Sie suchen, steht in dem Dokument. "
+          "Bitte beantworten Sie die Frage nur mit dem obigen Text. Die Mitglieder der Kirche treffen sich jeden "
+          "Sonntag, um gemeinsam zu feiern und mit den Familien zu teilen, die Hilfe brauchen. Es gibt auch "
+          "Aktivitäten für die Jugendlichen während der Woche und eine Gebetsgruppe am Mittwoch.",
+    "it": "Qual è l'orario della riunione della comunità? L'informazione che cerchi si trova nel documento. "
+          "Per favore, rispondi alla domanda usando solo il testo sopra. I membri della chiesa si riuniscono ogni "
+          "domenica per celebrare insieme e condividere con le famiglie che hanno bisogno di aiuto. Ci sono anche "
+          "attività per i giovani durante la settimana e un gruppo di preghiera il mercoledì.",
+}
+
+STOPWORDS = {
+    "es": "el la los las de del que y en un una por para con no es se su al lo como más pero sus le ya o este "
+          "cuál cuándo dónde qué quién cómo hay están está son fue muy también entre sobre sin",
+    "en": "the of and to in is it that for on with as was are be this by at from or an have not which what "
+          "when where who how there their they you your can will does do did about",
+    "pt": "o a os as de do da dos das que e em um uma para com não é se seu ao como mais mas sua ou este "
+          "qual quando onde quem como há estão está são foi muito também entre sobre sem você",
+    "fr": "le la les de du des que et en un une pour avec ne pas est se son au comme plus mais sa ou ce "
+          "quel quelle quand où qui comment il elle sont était très aussi entre sur sans vous",
+    "de": "der die das den dem des und in ist nicht ein eine zu mit für auf sich von auch es an wie was "
+          "wann wo wer warum sind war sehr zwischen über ohne sie ich wir",
+    "it": "il lo la i gli le di del della che e è in un una per con non si suo al come più ma sua o questo "
+          "quale quando dove chi come ci sono era molto anche tra sopra senza",
+}
+
+MIN_CONFIDENCE = 0.05
+
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+def _words(text):
+    return _WORD_RE.findall(text.lower())
+
+def _trigrams(text):
+    counts = Counter()
+    for word in _words(text):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            counts[padded[i:i + 3]] += 1
+    return counts
+
+@lru_cache(maxsize=None)
+def _profiles():
+    profiles = {}
+    for language, seed in SEED_TEXTS.items():
+        counts = _trigrams(seed + " " + STOPWORDS[language])
+        norm = math.sqrt(sum(v * v for v in counts.values()))
+        profiles[language] = (counts, norm, frozenset(STOPWORDS[language].split()))
+    return profiles
+
+def detect_language_scores(text: str) -> dict:
+    """Return a score per supported language for `text` (higher is more likely)."""
+    query = _trigrams(text)
+    words = _words(text)
+    query_norm = math.sqrt(sum(v * v for v in query.values()))
+    scores = {}
+    for language, (profile, norm, stopwords) in _profiles().items():
+        similarity = sum(count * profile.get(gram, 0) for gram, count in query.items()) / (query_norm * norm) if query_norm else 0.0
+        stopword_ratio = sum(word in stopwords for word in words) / len(words) if words else 0.0
+        scores[language] = similarity + stopword_ratio
+    return scores
+
+def detect_language(text: str, default=None):
+    """Detect the language of `text` offline. Returns an ISO 639-1 code or `default` if unsure."""
+    if not text or not text.strip():
+        return default
+    scores = sorted(detect_language_scores(text[:2000]).items(), key=lambda x: x[1], reverse=True)
+    (best, best_score), (_, second_score) = scores[0], scores[1]
+    if best_score - second_score < MIN_CONFIDENCE:
+        return default
+    return best
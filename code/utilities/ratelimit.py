@@ -0,0 +1,75 @@
+"""
+Client-side rate limiting for Azure OpenAI deployments.
+
+Each deployment has a requests-per-minute and a tokens-per-minute quota. A
+`RateLimiter` keeps one token bucket for each and blocks the caller until both
+have room, so that concurrent workers stay under the quota instead of
+collecting 429 responses and retrying.
+"""
+from functools import lru_cache
+import os
+import threading
+import time
+
+from utilities.tracing import span
+
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 0))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 0))
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute. A limit of 0 disables that bucket."""
+
+    def __init__(self, requests_per_minute: int=0, tokens_per_minute: int=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: int=0) -> float:
+        """Block until one request of `tokens` tokens fits in the quota. Returns the seconds waited."""
+        if not self.enabled:
+            return 0.0
+        # A single request larger than the bucket would never fit otherwise
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    return waited
+            with span("ratelimit.wait", seconds=wait):
+                time.sleep(wait)
+            waited += wait
+
+@lru_cache(maxsize=None)
+def get_rate_limiter(engine: str) -> RateLimiter:
+    """Shared limiter for one deployment, configured from OPENAI_REQUESTS_PER_MINUTE and OPENAI_TOKENS_PER_MINUTE."""
+    return RateLimiter(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
@@ -1,140 +1,627 @@
 from redis import Redis
+from redis.exceptions import RedisError, ResponseError
 from redis.commands.search.query import Query
+from redis.commands.search.result import Result
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.field import VectorField, TagField, TextField
 import typing as t
 import numpy as np
-import pandas as pd
 from pprint import pprint
+from functools import lru_cache
+import threading
+import logging
 import hashlib
+import json
 import os
+import re
+import time
+from utilities.embeddingmodels import embedding_dimension, get_embeddings_models
+from utilities.langdetect import detect_language
+from utilities.tracing import span
 
-embeddings_dims = {
-    "text-search-davinci-doc-001": 12288,
-    "text-embedding-ada-002": 1536
-}
+logger = logging.getLogger(__name__)
 
 # Redis configuration
-DIM = embeddings_dims[os.getenv("OPENAI_EMBEDDINGS_ENGINE_DOC", "text-embedding-ada-002")]
 VECT_NUMBER = 3155
 
-def create_index(redis_conn: Redis, index_name="embeddings-index", prefix = "embedding",number_of_vectors = VECT_NUMBER, distance_metric:str="COSINE"):
+index_name = "embeddings-index"
+prompt_index_name = "prompt-index"
+# Alias of the index version that serves queries; a migration switch moves it atomically
+index_alias = "embeddings-active"
+# Registry of the index versions: index name -> JSON description (see IndexVersion)
+INDEX_VERSIONS_KEY = "embeddings-index:versions"
+# Seconds a process keeps its view of the active and building index versions
+ACTIVE_INDEX_REFRESH = float(os.getenv('ACTIVE_INDEX_REFRESH', 5))
+
+def _source_field():
+    # File names hold commas and mixed case; a tag split on "," and lowercased would not match them
+    return TagField(name="source", separator="|", case_sensitive=True)
+
+def _result_id_field():
+    # Prompt results are paged in id order by FT.SEARCH SORTBY; the key itself cannot be sorted on
+    return TextField(name="result_id", sortable=True, no_index=True)
+
+# Fields added after the first release, added to existing indexes by ensure_indexes()
+INDEX_EXTRA_FIELDS = {
+    index_name: [TagField(name="language"), _source_field()],
+    prompt_index_name: [TagField(name="job"), _result_id_field()],
+}
+
+# Counter bumped on every chunk write or delete, so caches of the documents can tell they are stale
+DOCUMENTS_VERSION_KEY = "embeddings-index:version"
+
+# Keys per SCAN/FT.SEARCH page and per UNLINK pipeline in bulk deletes
+DELETE_BATCH_SIZE = int(os.getenv('REDIS_DELETE_BATCH_SIZE', 500))
+# Set once the chunks stored before the source tag existed have been tagged
+SOURCES_BACKFILL_KEY = "embeddings-index:sources-backfilled"
+PROMPT_IDS_BACKFILL_KEY = "prompt-index:ids-backfilled"
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+class IndexVersion:
+    """One generation of the embeddings index.
+
+    Every version indexes the same chunk hashes; its vectors live in its own hash field
+    (`embeddings` for the first one, `embeddings_vN` after), exposed to queries as @embeddings.
+    """
+    __slots__ = ('name', 'version', 'field', 'doc_model', 'query_model', '_dimension', 'state', 'switched_at')
+
+    def __init__(self, name, version, field, doc_model, query_model, dimension=None, state="active", switched_at=None):
+        self.name = name
+        self.version = version
+        self.field = field
+        self.doc_model = doc_model
+        self.query_model = query_model
+        self._dimension = dimension
+        self.state = state
+        self.switched_at = switched_at
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension or embedding_dimension(self.doc_model)
+
+    def to_json(self) -> str:
+        return json.dumps({"version": self.version, "field": self.field, "doc_model": self.doc_model, "query_model": self.query_model,
+                           "dimension": self._dimension, "state": self.state, "switched_at": self.switched_at})
+
+    @classmethod
+    def from_json(cls, name, value):
+        return cls(name, **json.loads(value))
+
+    def __repr__(self):
+        return f"IndexVersion(name={self.name!r}, field={self.field!r}, doc_model={self.doc_model!r}, state={self.state!r})"
+
+def _legacy_version() -> IndexVersion:
+    # The index created before versioning, with the configured models
+    models = get_embeddings_models()
+    return IndexVersion(index_name, 1, "embeddings", models["doc"], models["query"])
+
+def get_index_versions() -> dict:
+    """Every registered index version by index name."""
+    versions = {}
+    for name, value in get_redis_conn().hgetall(INDEX_VERSIONS_KEY).items():
+        name = name.decode('utf-8')
+        versions[name] = IndexVersion.from_json(name, value)
+    return versions
+
+def register_index_version(version: IndexVersion, pipe=None) -> None:
+    (pipe or get_redis_conn()).hset(INDEX_VERSIONS_KEY, version.name, version.to_json())
+
+_index_state = {"active": None, "building": None, "expires": 0.0}
+_index_state_lock = threading.Lock()
+
+def _load_index_state():
+    try:
+        versions = get_index_versions()
+        try:
+            active_name = _info_name(get_index(index_alias).info())
+        except ResponseError:
+            # No alias yet: ensure_indexes has not run against this Redis
+            active_name = index_name
+        active = versions.get(active_name) or _legacy_version()
+        building = next((version for version in versions.values() if version.state == "building"), None)
+        return active, building
+    except RedisError as e:
+        logger.warning(f"Index versions unavailable, using the configured models: {e}")
+        return _legacy_version(), None
+
+def get_index_state(refresh: bool=False):
+    """(active version, version being built or None), refreshed every ACTIVE_INDEX_REFRESH seconds."""
+    with _index_state_lock:
+        if refresh or time.monotonic() >= _index_state["expires"]:
+            _index_state["active"], _index_state["building"] = _load_index_state()
+            _index_state["expires"] = time.monotonic() + ACTIVE_INDEX_REFRESH
+        return _index_state["active"], _index_state["building"]
+
+def active_index() -> IndexVersion:
+    """The index version queries run against: the target of the alias."""
+    return get_index_state()[0]
+
+def building_index() -> IndexVersion:
+    """The index version being built by a migration, which ingestion also writes to; None outside migrations."""
+    return get_index_state()[1]
+
+@lru_cache(maxsize=None)
+def get_redis_conn() -> Redis:
+    # Connect to the Redis server on first use, not at import time
+    return Redis(host= os.environ.get('REDIS_ADDRESS','localhost'), port=6379, password=os.environ.get('REDIS_PASSWORD',None)) #api for Docker localhost for local execution
+
+@lru_cache(maxsize=None)
+def get_index(name: str=index_name):
+    return get_redis_conn().ft(name)
+
+def ensure_indexes(force: bool=False) -> None:
+    """Create the embeddings and prompt indexes if missing. Cheap after the first successful call."""
+    global _indexes_ready
+    if _indexes_ready and not force:
+        return
+    with _indexes_lock:
+        if _indexes_ready and not force:
+            return
+        redis_conn = get_redis_conn()
+        active_name = _ensure_embeddings_index(redis_conn)
+        for name, create in ((active_name, create_index), (prompt_index_name, create_prompt_index)):
+            try:
+                info = get_index(name).info()
+            except ResponseError:
+                logger.info(f"Index {name} does not exist, creating it")
+                create(redis_conn, index_name=name)
+                continue
+            if name == active_name:
+                _check_dimension(info, get_index_state(refresh=True)[0])
+                _check_source_field(info, name)
+            # Indexes created by older versions lack the fields added since
+            missing = [field for field in INDEX_EXTRA_FIELDS.get(name, []) if field.name not in _index_attributes(info)]
+            if missing:
+                logger.info(f"Adding fields {[f.name for f in missing]} to index {name}")
+                get_index(name).alter_schema_add(missing)
+        if redis_conn.set(SOURCES_BACKFILL_KEY, 1, nx=True):
+            backfill_sources()
+        if redis_conn.set(PROMPT_IDS_BACKFILL_KEY, 1, nx=True):
+            backfill_prompt_ids()
+        _indexes_ready = True
+
+def _ensure_embeddings_index(redis_conn) -> str:
+    # Returns the name of the active index, creating the first version and the alias when missing
+    try:
+        return _info_name(get_index(index_alias).info())
+    except ResponseError:
+        pass
+    try:
+        get_index(index_name).info()
+    except ResponseError:
+        logger.info(f"Index {index_name} does not exist, creating it")
+        create_index(redis_conn, index_name=index_name)
+    # Indexes created before versioning become version 1, with the configured models
+    redis_conn.hsetnx(INDEX_VERSIONS_KEY, index_name, _legacy_version().to_json())
+    try:
+        get_index(index_name).aliasadd(index_alias)
+    except ResponseError:
+        # Another process added it first
+        pass
+    return _info_name(get_index(index_alias).info())
+
+def _info_name(info) -> str:
+    # FT.INFO through an alias reports the name of the index it points to
+    name = info["index_name"]
+    return name.decode('utf-8') if isinstance(name, bytes) else name
+
+def _index_attributes(info) -> set:
+    names = set()
+    for attribute in info.get('attributes', []):
+        attribute = [a.decode('utf-8') if isinstance(a, bytes) else a for a in attribute]
+        if 'identifier' in attribute:
+            names.add(attribute[attribute.index('identifier') + 1])
+    return names
+
+def _check_dimension(info, version):
+    # FT.INFO reports the vector dimension on recent RediSearch versions only
+    for attribute in info.get('attributes', []):
+        attribute = [a.decode('utf-8') if isinstance(a, bytes) else a for a in attribute]
+        if 'dim' in attribute and 'embeddings' in attribute:
+            dimension = int(attribute[attribute.index('dim') + 1])
+            if dimension != version.dimension:
+                logger.error(f"Index {version.name} stores {dimension}-dimensional vectors, but {version.doc_model} produces "
+                             f"{version.dimension}. Migrate the index (index_migration.py) or switch the model back.")
+
+def _check_source_field(info, name):
+    # FT.ALTER cannot change a field; indexes created before it was case sensitive keep the old definition
+    for attribute in info.get('attributes', []):
+        attribute = [a.decode('utf-8') if isinstance(a, bytes) else a for a in attribute]
+        if 'identifier' in attribute and attribute[attribute.index('identifier') + 1] == 'source':
+            if 'CASESENSITIVE' not in attribute:
+                logger.warning(f"The source tag of index {name} is split on commas and not case sensitive, so files with those "
+                               f"names cannot be listed or deleted. Rebuild it with index_migration.py (start, build, switch).")
+
+def backfill_sources(batch_size: int=DELETE_BATCH_SIZE) -> int:
+    """Tag the chunks stored before the source tag existed, so delete_file finds them without a SCAN.
+    Returns the number of chunks tagged."""
+    redis_conn = get_redis_conn()
+    tagged = 0
+    with span("redis.backfill_sources") as current:
+        batch = []
+        for key in redis_conn.scan_iter(match="embedding:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                tagged += _tag_sources(redis_conn, batch)
+                batch = []
+        if batch:
+            tagged += _tag_sources(redis_conn, batch)
+        current.set_attribute("tagged", tagged)
+    if tagged:
+        logger.info(f"Tagged {tagged} chunks stored before the source tag")
+    return tagged
+
+def backfill_prompt_ids(batch_size: int=DELETE_BATCH_SIZE) -> int:
+    """Store the id of the prompt results saved before it was a field, so they sort by id too.
+    Returns the number of results updated."""
+    redis_conn = get_redis_conn()
+    updated = 0
+    with span("redis.backfill_prompt_ids") as current:
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in redis_conn.scan_iter(match="prompt:*", count=batch_size):
+            pipe.hsetnx(key, "result_id", key.decode('utf-8')[len("prompt:"):])
+            if len(pipe) >= batch_size:
+                updated += sum(pipe.execute())
+        if len(pipe):
+            updated += sum(pipe.execute())
+        current.set_attribute("updated", updated)
+    if updated:
+        logger.info(f"Stored the id of {updated} prompt results")
+    return updated
+
+def _tag_sources(redis_conn, keys):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, "filename", "source")
+    writes = redis_conn.pipeline(transaction=False)
+    tagged = 0
+    for key, (chunk_filename, chunk_source) in zip(keys, pipe.execute()):
+        if chunk_source is None and chunk_filename:
+            writes.hset(key, "source", get_source_filename(chunk_filename.decode('utf-8')))
+            tagged += 1
+    if tagged:
+        writes.execute()
+    return tagged
+
+def __getattr__(name):
+    # Backwards compatibility for callers that used the module-level connection and dimension
+    if name == 'redis_conn':
+        return get_redis_conn()
+    if name == 'DIM':
+        return active_index().dimension
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def create_index(redis_conn: Redis, index_name="embeddings-index", prefix = "embedding",number_of_vectors = VECT_NUMBER, distance_metric:str="COSINE",
+                 field: str="embeddings", dimension: int=None, hnsw_params: dict=None):
     text = TextField(name="text")
     filename = TextField(name="filename")
-    embeddings = VectorField("embeddings",
+    language = TagField(name="language")
+    source = _source_field()
+    # Vectors of later index versions live in their own hash field, queried as @embeddings
+    embeddings = VectorField(field,
                 "HNSW", {
                     "TYPE": "FLOAT32",
-                    "DIM": DIM,
+                    "DIM": dimension or embedding_dimension(),
                     "DISTANCE_METRIC": distance_metric,
                     "INITIAL_CAP": number_of_vectors,
-                })
+                    **(hnsw_params or {}),
+                }, as_name="embeddings" if field != "embeddings" else None)
     # Create index
     redis_conn.ft(index_name).create_index(
-        fields = [text, embeddings, filename],
+        fields = [text, embeddings, filename, language, source],
         definition = IndexDefinition(prefix=[prefix], index_type=IndexType.HASH)
     )
 
-def execute_query(np_vector:np.array, return_fields: list=[], search_type: str="KNN", number_of_results: int=20, vector_field_name: str="embeddings"):
-    base_query = f'*=>[{search_type} {number_of_results} @{vector_field_name} $vec_param AS vector_score]'
-    query = Query(base_query)\
+# FT.SEARCH commands sent per pipeline by execute_queries
+SEARCH_PIPELINE_SIZE = 100
+
+def _knn_query(return_fields: list=[], search_type: str="KNN", number_of_results: int=20, vector_field_name: str="embeddings", filter_expression: str="*", ef_runtime: int=None):
+    # EF_RUNTIME trades HNSW recall for latency; None keeps the index default
+    ef_clause = f' EF_RUNTIME {int(ef_runtime)}' if ef_runtime else ''
+    base_query = f'({filter_expression})=>[{search_type} {number_of_results} @{vector_field_name} $vec_param{ef_clause} AS vector_score]'
+    return Query(base_query)\
         .sort_by("vector_score")\
         .paging(0, number_of_results)\
         .return_fields(*return_fields)\
         .dialect(2)
-    
+
+class SearchResult:
+    """One chunk returned by a KNN search."""
+    __slots__ = ('id', 'text', 'filename', 'vector_score')
+
+    def __init__(self, id, text, filename, vector_score):
+        self.id = id
+        self.text = text
+        self.filename = filename
+        self.vector_score = vector_score
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'text': self.text, 'filename': self.filename, 'vector_score': self.vector_score}
+
+    def __repr__(self):
+        return f"SearchResult(id={self.id!r}, filename={self.filename!r}, vector_score={self.vector_score})"
+
+class SearchResults(list):
+    """Search results in score order. `error` is set when the search failed and the list is empty."""
+    __slots__ = ('error',)
+
+    def __init__(self, results=(), error=None):
+        super().__init__(results)
+        self.error = error
+
+    def to_dicts(self) -> list:
+        return [result.to_dict() for result in self]
+
+    def to_frame(self):
+        """pandas DataFrame with id, text, filename and vector_score columns, for the UI."""
+        import pandas as pd
+        return pd.DataFrame(self.to_dicts(), columns=list(SearchResult.__slots__))
+
+def _knn_results(docs):
+    return SearchResults([SearchResult(doc.id, doc.text, doc.filename, float(doc.vector_score)) for doc in docs])
+
+def execute_query(np_vector:np.array, return_fields: list=[], search_type: str="KNN", number_of_results: int=20, vector_field_name: str="embeddings", filter_expression: str="*", ef_runtime: int=None,
+                  index: IndexVersion=None):
+    """KNN search in `index`, by default the active version. The vector must come from that version's query model."""
+    query = _knn_query(return_fields, search_type, number_of_results, vector_field_name, filter_expression, ef_runtime)
     params_dict = {"vec_param": np_vector.astype(dtype=np.float32).tobytes()}
+    index = index or active_index()
+
+    with span("redis.knn", k=number_of_results, filter=filter_expression, index=index.name) as current:
+        results = get_index(index.name).search(query, params_dict)
+        current.set_attribute("results", len(results.docs))
+    return _knn_results(results.docs)
+
+def execute_queries(np_vectors, return_fields: list=[], search_type: str="KNN", number_of_results: int=20, vector_field_name: str="embeddings", filter_expressions=None, ef_runtime: int=None,
+                    index: IndexVersion=None):
+    """KNN search for many vectors, sent as pipelined FT.SEARCH commands. Returns one SearchResults per vector.
 
-    results = redis_conn.ft(index_name).search(query, params_dict)
-    return pd.DataFrame(list(map(lambda x: {'id' : x.id, 'text': x.text, 'filename': x.filename, 'vector_score': x.vector_score}, results.docs)))
+    `filter_expressions` holds one filter per vector; None searches every chunk. `index` as in execute_query.
+    """
+    filter_expressions = filter_expressions or ["*"] * len(np_vectors)
+    index = index or active_index()
+    results = []
+    with span("redis.knn_batch", k=number_of_results, queries=len(np_vectors)):
+        for start in range(0, len(np_vectors), SEARCH_PIPELINE_SIZE):
+            pipe = get_redis_conn().pipeline(transaction=False)
+            for np_vector, filter_expression in zip(np_vectors[start:start + SEARCH_PIPELINE_SIZE], filter_expressions[start:start + SEARCH_PIPELINE_SIZE]):
+                query = _knn_query(return_fields, search_type, number_of_results, vector_field_name, filter_expression, ef_runtime)
+                pipe.ft(index.name).search(query, {"vec_param": np.asarray(np_vector).astype(dtype=np.float32).tobytes()})
+            results += [_knn_results(Result(raw, True).docs) for raw in pipe.execute()]
+    return results
 
 def get_documents(number_of_results: int=VECT_NUMBER):
+    import pandas as pd
     base_query = f'*'
     return_fields = ['id','text','filename']
     query = Query(base_query)\
         .paging(0, number_of_results)\
         .return_fields(*return_fields)\
         .dialect(2)
-    results = redis_conn.ft(index_name).search(query)
+    with span("redis.get_documents"):
+        results = get_index(index_alias).search(query)
     if results.docs:
         return pd.DataFrame(list(map(lambda x: {'id' : x.id, 'text': x.text, 'filename': x.filename}, results.docs))).sort_values(by='id')
     else:
         return pd.DataFrame()
 
+def document_key(elem) -> str:
+    """Redis key of a chunk: derived from its file name, or from its text when it has none."""
+    hash_object = hashlib.sha1(elem['filename'].encode('utf-8')) if elem['filename'] else hashlib.sha1(elem['text'].encode('utf-8'))
+    return f"embedding:{hash_object.hexdigest()}"
+
 def set_document(elem):
-    # Connect to the Redis server
-    redis_conn = Redis(host= os.environ.get('REDIS_ADDRESS','localhost'), port=6379, password=os.environ.get('REDIS_PASSWORD',None)) 
     # Set Data
-    hash_object = hashlib.sha1(elem['filename'].encode('utf-8')) if elem['filename'] else hashlib.sha1(elem['text'].encode('utf-8'))
-    index = hash_object.hexdigest()
-    redis_conn.hset(
-        f"embedding:{index}",
-        mapping={
-            "text": elem['text'],
-            "filename": elem['filename'],
-            "embeddings": np.array(elem['search_embeddings']).astype(dtype=np.float32).tobytes()
-        }
-    )
+    mapping = {
+        "text": elem['text'],
+        "filename": elem['filename'],
+    }
+    # elem['vectors'] maps index version fields to vectors (active and, during a migration, the one being built)
+    vectors = elem.get('vectors') or {active_index().field: elem['search_embeddings']}
+    for field, vector in vectors.items():
+        mapping[field] = np.array(vector).astype(dtype=np.float32).tobytes()
+    # Language tag used to route queries to documents in the same language
+    language = elem.get('language') or detect_language(elem['text'])
+    if language:
+        mapping["language"] = language
+    # Original file name, so all chunks of a file can be found and deleted together
+    if elem['filename']:
+        mapping["source"] = get_source_filename(elem['filename'])
+    # MinHash signature, compared by later chunks to find near-duplicates
+    if elem.get('minhash') is not None:
+        mapping["minhash"] = np.asarray(elem['minhash'], dtype=np.uint32).tobytes()
+    with span("redis.set_document"):
+        pipe = get_redis_conn().pipeline(transaction=False)
+        pipe.hset(document_key(elem), mapping=mapping)
+        # The chunk may have been stored as a near-duplicate reference before
+        pipe.hdel(document_key(elem), "duplicate_of")
+        pipe.incr(DOCUMENTS_VERSION_KEY)
+        pipe.execute()
+
+def documents_version() -> int:
+    """Value of the documents change counter. It changes whenever a chunk is stored or deleted."""
+    return int(get_redis_conn().get(DOCUMENTS_VERSION_KEY) or 0)
+
+def get_source_filename(filename: str) -> str:
+    """Original file name for a chunk name such as `report.pdf_chunk_3` or `notes.txt_part_1`."""
+    return re.sub(r'(_chunk_\d+)?(_part_\d+)?$', '', filename)
+
+def get_language_counts() -> dict:
+    """Number of stored chunks per language tag."""
+    counts = {}
+    for language in get_index(index_alias).tagvals("language"):
+        language = language.decode('utf-8') if isinstance(language, bytes) else language
+        query = Query(f"@language:{{{language}}}").paging(0, 0).dialect(2)
+        counts[language] = get_index(index_alias).search(query).total
+    return counts
+
+def get_sources() -> list:
+    """Original file names with chunks in the index, sorted."""
+    sources = (source.decode('utf-8') if isinstance(source, bytes) else source for source in get_index(index_alias).tagvals("source"))
+    return sorted(sources)
+
+def _chunk_position(filename):
+    # report.pdf_chunk_10_part_2 -> [10, 2], so chunks come back in document order
+    return [int(n) for n in re.findall(r'_(?:chunk|part)_(\d+)', filename)]
+
+def get_file_chunks(filename: str, batch_size: int=DELETE_BATCH_SIZE) -> list:
+    """Every chunk stored for `filename`, as (chunk name, text) pairs in document order."""
+    source = get_source_filename(filename)
+    chunks = []
+    with span("redis.get_file_chunks", filename=source) as current:
+        offset = 0
+        while True:
+            query = Query(f"@source:{{{escape_tag(source)}}}").return_fields('filename', 'text').paging(offset, batch_size).dialect(2)
+            docs = get_index(index_alias).search(query).docs
+            chunks += [(doc.filename, doc.text) for doc in docs]
+            if len(docs) < batch_size:
+                break
+            offset += batch_size
+        current.set_attribute("chunks", len(chunks))
+    return sorted(chunks, key=lambda chunk: _chunk_position(chunk[0]))
+
+def _forget(redis_conn, keys):
+    # Near-duplicate buckets and links of the chunks (utilities.dedup imports this module)
+    from utilities.dedup import forget
+    forget(keys, redis_conn)
 
 def delete_document(index):
-    redis_conn.delete(f"{index}")
+    _forget(get_redis_conn(), [f"{index}"])
+    deleted = get_redis_conn().unlink(f"{index}") > 0
+    if deleted:
+        get_redis_conn().incr(DOCUMENTS_VERSION_KEY)
+    return deleted
+
+def escape_tag(value: str) -> str:
+    return re.sub(r'([^\w])', r'\\\1', value)
+
+def _unlink_batch(redis_conn, keys):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.unlink(key)
+    return sum(pipe.execute())
+
+def delete_keys_by_pattern(pattern: str, batch_size: int=DELETE_BATCH_SIZE) -> int:
+    """Delete keys matching `pattern` with SCAN and pipelined UNLINK, without blocking the server."""
+    redis_conn = get_redis_conn()
+    deleted = 0
+    batch = []
+    for key in redis_conn.scan_iter(match=pattern, count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += _unlink_batch(redis_conn, batch)
+            batch = []
+    if batch:
+        deleted += _unlink_batch(redis_conn, batch)
+    return deleted
+
+def delete_file(filename: str, batch_size: int=DELETE_BATCH_SIZE, include_untagged: bool=False) -> int:
+    """Delete every chunk stored for `filename` (its `_chunk_N`/`_part_N` keys). Returns the number of keys removed.
+
+    Chunks are found through the `source` tag in batches and removed with pipelined UNLINK,
+    so live queries are not stalled. Chunks stored before the tag existed are tagged once by
+    ensure_indexes (backfill_sources); `include_untagged` also looks for untagged chunks with a
+    SCAN over every embedding key.
+    """
+    source = get_source_filename(filename)
+    redis_conn = get_redis_conn()
+    deleted = 0
+    with span("redis.delete_file", filename=source) as current:
+        query = Query(f"@source:{{{escape_tag(source)}}}").no_content().paging(0, batch_size).dialect(2)
+        while True:
+            keys = [doc.id for doc in get_index(index_alias).search(query).docs]
+            if not keys:
+                break
+            _forget(redis_conn, keys)
+            deleted += _unlink_batch(redis_conn, keys)
+
+        if include_untagged:
+            batch = []
+            for key in redis_conn.scan_iter(match="embedding:*", count=batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += _delete_untagged(redis_conn, batch, source)
+                    batch = []
+            if batch:
+                deleted += _delete_untagged(redis_conn, batch, source)
+        if deleted:
+            redis_conn.incr(DOCUMENTS_VERSION_KEY)
+        current.set_attribute("deleted", deleted)
+    return deleted
+
+def _delete_untagged(redis_conn, keys, source):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, "filename", "source")
+    matches = [key for key, (chunk_filename, chunk_source) in zip(keys, pipe.execute())
+               if chunk_source is None and chunk_filename is not None and get_source_filename(chunk_filename.decode('utf-8')) == source]
+    if not matches:
+        return 0
+    _forget(redis_conn, matches)
+    return _unlink_batch(redis_conn, matches)
 
 def create_prompt_index(redis_conn: Redis, index_name="prompt-index", prefix = "prompt"):
     result = TextField(name="result")
     filename = TextField(name="filename")
     prompt = TextField(name="prompt")
+    job = TagField(name="job")
     # Create index
     redis_conn.ft(index_name).create_index(
-        fields = [result, filename, prompt],
+        fields = [result, filename, prompt, job, _result_id_field()],
         definition = IndexDefinition(prefix=[prefix], index_type=IndexType.HASH)
     )
 
-def add_prompt_result(id, result, filename="", prompt=""):
-    redis_conn.hset(
-        f"prompt:{id}",
-        mapping={
-            "result": result,
-            "filename": filename,
-            "prompt": prompt
-        }
-    )
+def _prompt_result_mapping(id, result, filename="", prompt="", job=None):
+    mapping = {
+        "result_id": id,
+        "result": result,
+        "filename": filename,
+        "prompt": prompt
+    }
+    if job:
+        mapping["job"] = job
+    return mapping
 
-def get_prompt_results(number_of_results: int=VECT_NUMBER):
-    base_query = f'*'
-    return_fields = ['id','result','filename','prompt']
+def add_prompt_result(id, result, filename="", prompt="", job=None):
+    get_redis_conn().hset(f"prompt:{id}", mapping=_prompt_result_mapping(id, result, filename, prompt, job))
+
+def add_prompt_results(results) -> int:
+    """Store many prompt results in one pipeline. `results` holds dicts with id, result, filename, prompt and job."""
+    pipe = get_redis_conn().pipeline(transaction=False)
+    for item in results:
+        pipe.hset(f"prompt:{item['id']}", mapping=_prompt_result_mapping(item['id'], item['result'], item.get('filename', ""), item.get('prompt', ""), item.get('job')))
+    with span("redis.add_prompt_results", results=len(results)):
+        pipe.execute()
+    return len(results)
+
+def existing_prompt_results(ids) -> set:
+    """The subset of prompt result ids that are already stored."""
+    ids = list(ids)
+    pipe = get_redis_conn().pipeline(transaction=False)
+    for id in ids:
+        pipe.exists(f"prompt:{id}")
+    return {id for id, exists in zip(ids, pipe.execute()) if exists}
+
+def get_prompt_results_page(offset: int=0, limit: int=50, job: str=None):
+    """One page of prompt results in id order and the total number of results, optionally for one job."""
+    import pandas as pd
+    base_query = f"@job:{{{escape_tag(job)}}}" if job else '*'
+    return_fields = ['id','result','filename','prompt','job']
     query = Query(base_query)\
-        .paging(0, number_of_results)\
+        .sort_by("result_id")\
+        .paging(offset, limit)\
         .return_fields(*return_fields)\
         .dialect(2)
-    results = redis_conn.ft(prompt_index_name).search(query)
+    results = get_index(prompt_index_name).search(query)
     if results.docs:
-        return pd.DataFrame(list(map(lambda x: {'id' : x.id, 'filename': x.filename, 'prompt': x.prompt, 'result': x.result.replace('\n',' ').replace('\r',' '),}, results.docs))).sort_values(by='id')
+        return pd.DataFrame(list(map(lambda x: {'id' : x.id, 'filename': x.filename, 'prompt': x.prompt, 'result': x.result.replace('\n',' ').replace('\r',' '),}, results.docs))), results.total
     else:
-        return pd.DataFrame()
+        return pd.DataFrame(), results.total
 
-def delete_prompt_results(prefix="prompt*"):
-    keys = redis_conn.keys(prefix)
-    if keys:
-        redis_conn.delete(*keys)
-
-# Connect to the Redis server
-redis_conn = Redis(host= os.environ.get('REDIS_ADDRESS','localhost'), port=6379, password=os.environ.get('REDIS_PASSWORD',None)) #api for Docker localhost for local execution
+def get_prompt_results(number_of_results: int=VECT_NUMBER, offset: int=0, job: str=None):
+    return get_prompt_results_page(offset, number_of_results, job)[0]
 
-# Check if Redis index exists
-index_name = "embeddings-index"
-prompt_index_name = "prompt-index"
-try:
-    if redis_conn.ft(index_name).info():
-        print("Index exists")
-except:
-    print("Index does not exist")
-    print("Creating embeddings index")
-    # Create index 
-    create_index(redis_conn)
-try:
-    if redis_conn.ft(prompt_index_name).info():
-        print("Index exists")
-except:
-    print("Index does not exist")
-    print("Creating prompt index")
-    # Create index 
-    create_prompt_index(redis_conn)
\ No newline at end of file
+def delete_prompt_results(prefix="prompt*"):
+    return delete_keys_by_pattern(prefix)
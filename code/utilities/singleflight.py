@@ -0,0 +1,144 @@
+"""
+Request coalescing ("single flight") for identical concurrent calls.
+
+When several threads ask for the same thing at once, such as the embedding of
+one question or the answer to a question at temperature 0, only the first call
+runs. The others wait for its result, or its exception, instead of sending their
+own upstream request. In process, nothing is kept after the call finishes.
+
+With SINGLEFLIGHT_REDIS=true, flights whose results are JSON-serialisable also
+coalesce across processes (web app replicas, Functions workers). The leader holds
+a Redis lock while it runs and publishes the result under a short-lived key.
+Callers in other processes poll for that result. If the lock expires without a
+result, they run the call themselves.
+
+The published result is deliberately a small cache: any identical call within
+SINGLEFLIGHT_RESULT_TTL seconds of the leader finishing reuses it, not only the
+calls that were waiting. Waiters in other processes may only notice the result
+one poll interval late, and the TTL covers that. It also means an answer can be
+up to that many seconds older than the documents: a question repeated right
+after an upload or a deletion can get the answer computed before it. Set
+SINGLEFLIGHT_RESULT_TTL lower (it must stay above the poll interval, 0.05s)
+when that matters more than the saved calls.
+"""
+from concurrent.futures import Future
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from redis.exceptions import RedisError
+from utilities.tracing import record_cache
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLEFLIGHT_REDIS = os.getenv('SINGLEFLIGHT_REDIS', 'false').lower() == 'true'
+# How long a leader may run before waiting processes stop trusting its lock
+SINGLEFLIGHT_LOCK_TIMEOUT = float(os.getenv('SINGLEFLIGHT_LOCK_TIMEOUT', 30))
+# How long a published result stays readable: for waiting processes, and as a short cache for repeated calls
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv('SINGLEFLIGHT_RESULT_TTL', 5))
+SINGLEFLIGHT_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers with the same key share its outcome."""
+
+    def __init__(self, name: str, shared: bool=False, enabled: bool=SINGLEFLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        # Only results that survive a JSON round trip can be shared through Redis
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Result of `func()`, or of the identical call already in flight for `key`."""
+        if not self.enabled:
+            return func()
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        record_cache(f"singleflight.{self.name}", not leader)
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._run_shared(key, func) if self.shared and SINGLEFLIGHT_REDIS else func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _redis_key(self, key):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return f"singleflight:{self.name}:{digest}"
+
+    def _run_shared(self, key, func):
+        from utilities.redisembeddings import get_redis_conn
+        redis_key = self._redis_key(key)
+        try:
+            redis_conn = get_redis_conn()
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + SINGLEFLIGHT_LOCK_TIMEOUT
+            while True:
+                # The leader deletes its lock when it publishes, so the result is read before every attempt
+                result = self._published(redis_conn, redis_key)
+                if result is not _MISSING:
+                    return result
+                if redis_conn.set(f"{redis_key}:lock", token, nx=True, px=int(SINGLEFLIGHT_LOCK_TIMEOUT * 1000)):
+                    break
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+            # A leader may have published between the last read and the lock
+            result = self._published(redis_conn, redis_key)
+            if result is not _MISSING:
+                _release(redis_conn, redis_key, token)
+                return result
+        except RedisError as e:
+            logger.warning(f"Single flight {self.name} without Redis: {e}")
+            return func()
+
+        try:
+            result = func()
+        except BaseException:
+            # Let waiting processes take over instead of polling until the lock expires
+            _release(redis_conn, redis_key, token)
+            raise
+        try:
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.set(f"{redis_key}:result", json.dumps(result), px=int(SINGLEFLIGHT_RESULT_TTL * 1000))
+            pipe.delete(f"{redis_key}:lock")
+            pipe.execute()
+        except (RedisError, TypeError) as e:
+            logger.warning(f"Single flight {self.name} could not publish its result: {e}")
+            _release(redis_conn, redis_key, token)
+        return result
+
+    def _published(self, redis_conn, redis_key):
+        # Decoded result of a finished leader, or _MISSING
+        result = redis_conn.get(f"{redis_key}:result")
+        if result is None:
+            return _MISSING
+        record_cache(f"singleflight.{self.name}.redis", True)
+        return json.loads(result)
+
+def _release(redis_conn, redis_key, token):
+    # Only our own lock: after a timeout it may belong to another leader
+    try:
+        if redis_conn.get(f"{redis_key}:lock") == token.encode('utf-8'):
+            redis_conn.delete(f"{redis_key}:lock")
+    except RedisError:
+        pass
@@ -0,0 +1,255 @@
+"""
+Binary snapshots of the embeddings index, to rebuild or move it without running
+OCR and embeddings again.
+
+A snapshot is a directory with three files:
+
+- manifest.json: format version, vector dimension, embeddings model, chunk count
+- vectors.npy: float32 matrix with one row per chunk. It can be opened with
+  `np.load(path, mmap_mode='r')`.
+- chunks.parquet: key, text, filename, source, language, MinHash signature and
+  `duplicate_of` of each chunk, in the same order as the vectors
+
+Near-duplicate reference records (DEDUP_MODE=link) have no vectors; their row
+of vectors.npy is zeros and `duplicate_of` names the chunk they repeat.
+
+Export scans the chunk keys in batches, reads them with pipelined HMGET and
+appends every batch to both files. Memory stays flat whatever the index size.
+Import memory-maps the vectors, reads the Parquet file batch by batch and writes
+the chunks with pipelined HSET from a few threads. It also restores the
+near-duplicate buckets (utilities.dedup) of chunks that have a signature, and
+the links of the reference records.
+
+    python index_snapshot.py export /backups/index-2023-03-01
+    python index_snapshot.py import /backups/index-2023-03-01
+
+Parquet needs pyarrow.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import os
+
+import numpy as np
+
+from utilities.redisembeddings import DOCUMENTS_VERSION_KEY, active_index, ensure_indexes, get_redis_conn
+from utilities.tracing import span
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', 1000))
+SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', 4))
+
+# Version 2 added duplicate_of; version 1 snapshots are still read
+FORMAT_VERSION = 2
+MANIFEST = "manifest.json"
+VECTORS = "vectors.npy"
+CHUNKS = "chunks.parquet"
+FIELDS = ["text", "filename", "source", "language", "minhash", "duplicate_of"]
+# Room for the .npy header, rewritten with the final row count when the export ends
+_NPY_HEADER_SIZE = 128
+
+class SnapshotError(Exception):
+    pass
+
+def _npy_header(rows, dimension):
+    header = repr({'descr': '<f4', 'fortran_order': False, 'shape': (rows, dimension)}).encode('latin1')
+    padding = _NPY_HEADER_SIZE - 10 - len(header) - 1
+    return b'\x93NUMPY\x01\x00' + (_NPY_HEADER_SIZE - 10).to_bytes(2, 'little') + header + b' ' * padding + b'\n'
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("key", pa.string()),
+        ("text", pa.string()),
+        ("filename", pa.string()),
+        ("source", pa.string()),
+        ("language", pa.string()),
+        ("minhash", pa.binary()),
+        ("duplicate_of", pa.string()),
+    ])
+
+class SnapshotWriter:
+    """Appends chunks to a new snapshot directory. Use as a context manager, or call close()."""
+
+    def __init__(self, path: str, dimension: int, model: str=None):
+        import pyarrow.parquet as pq
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        self.model = model
+        self.count = 0
+        self._vectors = open(os.path.join(path, VECTORS), "wb")
+        self._vectors.write(_npy_header(0, dimension))
+        self._chunks = pq.ParquetWriter(os.path.join(path, CHUNKS), _schema(), compression="zstd")
+
+    def write(self, keys, vectors, metadata) -> None:
+        """Append a batch: chunk keys, a float32 (len(keys), dimension) array and one field dict per key."""
+        import pyarrow as pa
+        vectors = np.ascontiguousarray(vectors, dtype='<f4')
+        if vectors.shape != (len(keys), self.dimension):
+            raise SnapshotError(f"Expected {len(keys)} vectors of dimension {self.dimension}, got {vectors.shape}")
+        self._vectors.write(vectors.tobytes())
+        columns = {"key": list(keys)}
+        for field in FIELDS:
+            columns[field] = [item.get(field) for item in metadata]
+        self._chunks.write_table(pa.Table.from_pydict(columns, schema=_schema()))
+        self.count += len(keys)
+
+    def close(self) -> None:
+        self._chunks.close()
+        self._vectors.seek(0)
+        self._vectors.write(_npy_header(self.count, self.dimension))
+        self._vectors.close()
+        manifest = {
+            "format": FORMAT_VERSION,
+            "count": self.count,
+            "dimension": self.dimension,
+            "model": self.model,
+            "created": datetime.datetime.utcnow().isoformat() + "Z",
+        }
+        # Written last: a directory without a manifest is an unfinished export
+        with open(os.path.join(self.path, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # No manifest, so the partial snapshot cannot be imported
+            self._chunks.close()
+            self._vectors.close()
+
+def read_manifest(path: str) -> dict:
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise SnapshotError(f"{path} has no {MANIFEST}; the export did not finish")
+    if manifest.get("format") not in (1, FORMAT_VERSION):
+        raise SnapshotError(f"Unsupported snapshot format {manifest.get('format')}")
+    return manifest
+
+def iter_snapshot(path: str, batch_size: int=SNAPSHOT_BATCH_SIZE):
+    """Yield (keys, vectors, columns) batches of a snapshot, with vectors read from the memory map."""
+    import pyarrow.parquet as pq
+    manifest = read_manifest(path)
+    vectors = np.load(os.path.join(path, VECTORS), mmap_mode='r')
+    if vectors.shape != (manifest["count"], manifest["dimension"]):
+        raise SnapshotError(f"{VECTORS} holds {vectors.shape}, the manifest says {manifest['count']} x {manifest['dimension']}")
+    start = 0
+    for batch in pq.ParquetFile(os.path.join(path, CHUNKS)).iter_batches(batch_size=batch_size):
+        columns = batch.to_pydict()
+        keys = columns.pop("key")
+        columns.setdefault("duplicate_of", [None] * len(keys))
+        yield keys, vectors[start:start + len(keys)], columns
+        start += len(keys)
+
+def _decode(value):
+    return value.decode('utf-8') if value is not None else None
+
+def export_index(path: str, batch_size: int=SNAPSHOT_BATCH_SIZE, progress=None) -> int:
+    """Write every stored chunk to a snapshot at `path`. Returns the number of chunks exported.
+
+    The vectors are those of the active index version. Chunks without a vector of
+    its dimension are skipped, except near-duplicate reference records, which never
+    have one. `progress(done)` is called after each batch.
+    """
+    redis_conn = get_redis_conn()
+    index = active_index()
+    dimension = index.dimension
+    skipped = 0
+    with span("snapshot.export", path=path, index=index.name) as current, SnapshotWriter(path, dimension, index.doc_model) as writer:
+        keys = []
+        for key in redis_conn.scan_iter(match="embedding:*", count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                skipped += _export_batch(redis_conn, writer, keys, index.field)
+                keys = []
+                if progress:
+                    progress(writer.count)
+        if keys:
+            skipped += _export_batch(redis_conn, writer, keys, index.field)
+            if progress:
+                progress(writer.count)
+        current.set_attribute("chunks", writer.count)
+    if skipped:
+        logger.warning(f"{skipped} chunks without a {dimension}-dimensional vector were not exported")
+    return writer.count
+
+def _export_batch(redis_conn, writer, keys, vector_field):
+    pipe = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, vector_field, *FIELDS)
+    rows, vectors, metadata = [], [], []
+    for key, values in zip(keys, pipe.execute()):
+        embeddings, text, filename, source, language, minhash, duplicate_of = values
+        if duplicate_of is not None:
+            vectors.append(np.zeros(writer.dimension, dtype=np.float32))
+        elif embeddings is None or len(embeddings) != writer.dimension * 4:
+            continue
+        else:
+            vectors.append(np.frombuffer(embeddings, dtype=np.float32))
+        rows.append(key.decode('utf-8'))
+        metadata.append({"text": _decode(text) or "", "filename": _decode(filename) or "", "source": _decode(source),
+                         "language": _decode(language), "minhash": minhash, "duplicate_of": _decode(duplicate_of)})
+    if rows:
+        writer.write(rows, np.stack(vectors), metadata)
+    return len(keys) - len(rows)
+
+def _import_batch(redis_conn, keys, vectors, columns, vector_field):
+    from utilities.dedup import _band_keys
+    pipe = redis_conn.pipeline(transaction=False)
+    for i, key in enumerate(keys):
+        duplicate_of = columns["duplicate_of"][i]
+        # Reference records keep their zero row out of the index
+        mapping = {} if duplicate_of is not None else {vector_field: np.ascontiguousarray(vectors[i], dtype=np.float32).tobytes()}
+        for field in FIELDS:
+            if columns[field][i] is not None:
+                mapping[field] = columns[field][i]
+        pipe.hset(key, mapping=mapping)
+        if duplicate_of is not None:
+            pipe.sadd(f"dedup:links:{duplicate_of}", key)
+        minhash = columns["minhash"][i]
+        if minhash is not None:
+            for band_key in _band_keys(np.frombuffer(minhash, dtype=np.uint32)):
+                pipe.sadd(band_key, key)
+    pipe.execute()
+    return len(keys)
+
+def import_index(path: str, batch_size: int=SNAPSHOT_BATCH_SIZE, workers: int=SNAPSHOT_WORKERS, progress=None) -> int:
+    """Load a snapshot into Redis. Returns the number of chunks written.
+
+    Chunks with the same key are overwritten; other stored chunks are kept. The
+    vectors go to the active index version, whose dimension must match the
+    snapshot's. `progress(done, total)` is called from the calling thread after each batch.
+    """
+    manifest = read_manifest(path)
+    ensure_indexes()
+    index = active_index()
+    if manifest["dimension"] != index.dimension:
+        raise SnapshotError(f"The snapshot holds {manifest['dimension']}-dimensional vectors, the index {index.name} expects {index.dimension}")
+    if manifest.get("model") and manifest["model"] != index.doc_model:
+        logger.warning(f"The snapshot was embedded with {manifest['model']}, the index {index.name} uses {index.doc_model}")
+    redis_conn = get_redis_conn()
+    done = 0
+    with span("snapshot.import", path=path, chunks=manifest["count"]):
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = []
+            for keys, vectors, columns in iter_snapshot(path, batch_size):
+                pending.append(pool.submit(_import_batch, redis_conn, keys, vectors, columns, index.field))
+                # Bounded read-ahead, so the import does not load the whole snapshot in memory
+                while len(pending) >= 2 * workers:
+                    done += pending.pop(0).result()
+                    if progress:
+                        progress(done, manifest["count"])
+            for future in pending:
+                done += future.result()
+                if progress:
+                    progress(done, manifest["count"])
+        redis_conn.incr(DOCUMENTS_VERSION_KEY)
+    return done
@@ -0,0 +1,155 @@
+"""
+Map-reduce summarisation of documents longer than one prompt.
+
+The text is split into SUMMARY_CHUNK_TOKENS-token chunks with the same token
+chunker as ingestion. The chunks are summarised concurrently by SUMMARY_WORKERS
+threads (map). Each completion goes through the deployment's rate limiter.
+Consecutive partial summaries are then grouped into prompts of up to
+SUMMARY_CHUNK_TOKENS tokens and summarised again (reduce), level by level, until
+everything fits in one prompt. That last prompt is written in the requested style.
+A text that fits in one chunk takes a single completion, as before.
+
+Every completion is cached in Redis for SUMMARY_CACHE_TTL seconds, keyed by the
+hash of its model, length and prompt. Summarising the same document again, or
+retrying after a failed chunk, only sends the prompts that have no result yet.
+
+`summarize_document` summarises a stored document from its chunks in Redis. The
+original file is not needed.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import logging
+import os
+
+from redis.exceptions import RedisError
+
+from utilities.redisembeddings import get_redis_conn, get_file_chunks
+from utilities.tracing import span, record_cache
+from utilities.utils import create_completion, get_token_count, split_text
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', 2000))
+SUMMARY_PARTIAL_TOKENS = int(os.getenv('SUMMARY_PARTIAL_TOKENS', 300))
+SUMMARY_WORKERS = int(os.getenv('SUMMARY_WORKERS', 8))
+SUMMARY_CACHE = os.getenv('SUMMARY_CACHE', 'true').lower() == 'true'
+SUMMARY_CACHE_TTL = int(os.getenv('SUMMARY_CACHE_TTL', 7 * 24 * 3600))
+
+# Final prompt of each summary style; {text} is the document or the joined partial summaries
+SUMMARY_STYLES = {
+    "Resumen básico": "Resume el siguiente texto de manera concisa:\n\n{text}\n\nResumen:",
+    "Puntos clave": "Extrae los puntos clave del siguiente texto en formato de lista con viñetas:\n\n{text}\n\nPuntos clave:",
+    "Explicación sencilla": "Explica el siguiente texto de manera simple, como si se lo estuvieras contando a un estudiante de secundaria:\n\n{text}\n\nExplicación:",
+    "Resumen ejecutivo": "Crea un resumen ejecutivo (máximo 100 palabras) del siguiente texto:\n\n{text}\n\nResumen ejecutivo:",
+    "Análisis crítico": "Realiza un análisis crítico del siguiente texto, destacando fortalezas y debilidades:\n\n{text}\n\nAnálisis:",
+}
+DEFAULT_STYLE = "Resumen básico"
+
+MAP_PROMPT = ("Resume el siguiente fragmento de un documento más largo. Conserva los hechos, cifras, nombres "
+              "y conclusiones importantes:\n\n{text}\n\nResumen del fragmento:")
+REDUCE_PROMPT = ("Los siguientes son resúmenes de partes consecutivas de un documento. Combínalos en un único "
+                 "resumen que conserve la información importante:\n\n{text}\n\nResumen combinado:")
+
+def style_prompt(style: str, text: str) -> str:
+    return SUMMARY_STYLES.get(style, SUMMARY_STYLES[DEFAULT_STYLE]).format(text=text)
+
+def _cache_key(prompt, model, max_tokens):
+    digest = hashlib.sha1(f"{model}\n{max_tokens}\n{prompt}".encode('utf-8')).hexdigest()
+    return f"summary:{digest}"
+
+def _cached_completion(prompt, model, max_tokens):
+    """(completion, whether it came from the cache)."""
+    key = _cache_key(prompt, model, max_tokens)
+    if SUMMARY_CACHE:
+        try:
+            cached = get_redis_conn().get(key)
+        except RedisError as e:
+            logger.warning(f"Summary cache unavailable in Redis: {e}")
+            cached = None
+        record_cache("summary", cached is not None)
+        if cached is not None:
+            return cached.decode('utf-8'), True
+    summary = create_completion(prompt, max_tokens=max_tokens, model=model)
+    if SUMMARY_CACHE and summary:
+        try:
+            get_redis_conn().set(key, summary, ex=SUMMARY_CACHE_TTL)
+        except RedisError as e:
+            logger.warning(f"Summary cache unavailable in Redis: {e}")
+    return summary, False
+
+def _count(stats, cached):
+    stats["cached" if cached else "completions"] += 1
+
+def _summarize_all(texts, template, model, max_tokens, workers, stats, stage, progress):
+    # Results keep the order of `texts`; progress is reported from the calling thread
+    summaries = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(texts)))) as pool:
+        futures = {pool.submit(_cached_completion, template.format(text=text), model, max_tokens): i for i, text in enumerate(texts)}
+        for done, future in enumerate(as_completed(futures), 1):
+            summaries[futures[future]], cached = future.result()
+            _count(stats, cached)
+            if progress:
+                progress(stage, done, len(texts))
+    return summaries
+
+def _group(texts, max_tokens, minimum=1):
+    """Consecutive texts joined into texts of at most `max_tokens` tokens, with at least `minimum` per group."""
+    groups, current, tokens = [], [], 0
+    for text in texts:
+        size = get_token_count(text)
+        if len(current) >= minimum and tokens + size > max_tokens:
+            groups.append("\n\n".join(current))
+            current, tokens = [], 0
+        current.append(text)
+        tokens += size
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+def summarize_chunks(chunks, style: str=DEFAULT_STYLE, model: str="gpt-35-turbo-instruct", max_tokens: int=500,
+                     workers: int=SUMMARY_WORKERS, chunk_tokens: int=SUMMARY_CHUNK_TOKENS, progress=None) -> dict:
+    """Summarise a document given as consecutive texts of at most `chunk_tokens` tokens.
+
+    `progress(stage, done, total)` is called after each completion, with stage "map",
+    "reduce-1", "reduce-2"... Returns the summary, the number of chunks and reduce
+    levels, and how many completions were sent or read from the cache. Failed
+    completions raise; the ones that succeeded are cached for the retry.
+    """
+    stats = {"completions": 0, "cached": 0}
+    chunks = [chunk for chunk in chunks if chunk.strip()]
+    if not chunks:
+        return {"summary": "", "chunks": 0, "levels": 0, **stats}
+    with span("summary.map_reduce", chunks=len(chunks), model=model) as current:
+        summaries, levels = chunks, 0
+        if len(chunks) > 1:
+            summaries = _summarize_all(chunks, MAP_PROMPT, model, SUMMARY_PARTIAL_TOKENS, workers, stats, "map", progress)
+            # Two summaries or more per group, so every level shrinks the input
+            groups = _group(summaries, chunk_tokens, minimum=2)
+            while len(groups) > 1:
+                levels += 1
+                summaries = _summarize_all(groups, REDUCE_PROMPT, model, SUMMARY_PARTIAL_TOKENS, workers, stats, f"reduce-{levels}", progress)
+                groups = _group(summaries, chunk_tokens, minimum=2)
+            summaries = groups
+        summary, cached = _cached_completion(style_prompt(style, summaries[0]), model, max_tokens)
+        _count(stats, cached)
+        if progress:
+            progress("final", 1, 1)
+        current.set_attribute("levels", levels)
+        current.set_attribute("completions", stats["completions"])
+    return {"summary": summary, "chunks": len(chunks), "levels": levels, **stats}
+
+def summarize_text(text: str, style: str=DEFAULT_STYLE, model: str="gpt-35-turbo-instruct", max_tokens: int=500,
+                   workers: int=SUMMARY_WORKERS, chunk_tokens: int=SUMMARY_CHUNK_TOKENS, progress=None) -> dict:
+    """Summarise `text` of any length. See summarize_chunks."""
+    chunks = [part for part, _ in split_text(text, max_tokens=chunk_tokens, chunk_size=chunk_tokens)]
+    return summarize_chunks(chunks, style, model, max_tokens, workers, chunk_tokens, progress)
+
+def summarize_document(filename: str, style: str=DEFAULT_STYLE, model: str="gpt-35-turbo-instruct", max_tokens: int=500,
+                       workers: int=SUMMARY_WORKERS, chunk_tokens: int=SUMMARY_CHUNK_TOKENS, progress=None) -> dict:
+    """Summarise a stored document from its chunks in Redis. See summarize_chunks."""
+    parts = []
+    # Near-duplicates linked to chunks of other files (utilities.dedup) are not part of the document
+    for _, text in get_file_chunks(filename):
+        parts += [part for part, _ in split_text(text, max_tokens=chunk_tokens, chunk_size=chunk_tokens)]
+    # Small consecutive chunks (short pages) share one map prompt
+    return summarize_chunks(_group(parts, chunk_tokens), style, model, max_tokens, workers, chunk_tokens, progress)
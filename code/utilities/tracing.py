@@ -0,0 +1,152 @@
+"""
+Per-stage latency instrumentation with OpenTelemetry.
+
+Every external call and pipeline stage runs inside `span(name, **attributes)`,
+which creates a trace span and records its duration in the
+`qna.stage.duration` histogram (milliseconds, labelled by stage). Exporters are
+configured once per process by `setup_tracing()`:
+
+- OTLP/HTTP when OTEL_EXPORTER_OTLP_ENDPOINT is set
+- console when OTEL_CONSOLE_EXPORTER=true
+- a Prometheus scrape endpoint when PROMETHEUS_PORT is set
+
+If the OpenTelemetry packages are not installed every helper is a no-op.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace, metrics
+    from opentelemetry.trace import Status, StatusCode
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+_setup_done = False
+_setup_lock = threading.Lock()
+_instruments = {}
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+    def set_status(self, *args, **kwargs):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def setup_tracing(service_name: str="qna-webapp") -> bool:
+    """Configure tracer and meter providers with the exporters enabled in the environment. Idempotent."""
+    global _setup_done
+    if not OTEL_AVAILABLE:
+        return False
+    with _setup_lock:
+        if _setup_done:
+            return True
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader, ConsoleMetricExporter
+
+        resource = Resource.create({"service.name": os.getenv('OTEL_SERVICE_NAME', service_name)})
+        tracer_provider = TracerProvider(resource=resource)
+        metric_readers = []
+
+        if os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'):
+            try:
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+                tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                metric_readers.append(PeriodicExportingMetricReader(OTLPMetricExporter()))
+            except ImportError:
+                logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-exporter-otlp-proto-http is not installed")
+
+        if os.getenv('OTEL_CONSOLE_EXPORTER', 'false').lower() == 'true':
+            tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+            metric_readers.append(PeriodicExportingMetricReader(ConsoleMetricExporter()))
+
+        if os.getenv('PROMETHEUS_PORT'):
+            try:
+                from opentelemetry.exporter.prometheus import PrometheusMetricReader
+                from prometheus_client import start_http_server
+                start_http_server(int(os.getenv('PROMETHEUS_PORT')))
+                metric_readers.append(PrometheusMetricReader())
+            except ImportError:
+                logger.warning("PROMETHEUS_PORT is set but opentelemetry-exporter-prometheus is not installed")
+            except OSError as e:
+                # Another worker in this host already serves the endpoint
+                logger.warning(f"Prometheus endpoint not started: {e}")
+
+        trace.set_tracer_provider(tracer_provider)
+        metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=metric_readers))
+        _setup_done = True
+        return True
+
+def _get_tracer():
+    return trace.get_tracer("utilities")
+
+def _instrument(kind, name, **kwargs):
+    # Instruments are created once per name; the meter provider proxies until setup_tracing() runs
+    key = (kind, name)
+    if key not in _instruments:
+        meter = metrics.get_meter("utilities")
+        _instruments[key] = getattr(meter, kind)(name, **kwargs)
+    return _instruments[key]
+
+@contextmanager
+def span(name: str, **attributes):
+    """Trace a pipeline stage and record its duration. Yields the span so callers can add attributes."""
+    if not OTEL_AVAILABLE:
+        yield _NOOP_SPAN
+        return
+    start = time.perf_counter()
+    error = False
+    with _get_tracer().start_as_current_span(name, record_exception=False, set_status_on_exception=False) as current:
+        for key, value in attributes.items():
+            if value is not None:
+                current.set_attribute(key, value)
+        try:
+            yield current
+        except BaseException as e:
+            error = True
+            current.record_exception(e)
+            current.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            _instrument("create_histogram", "qna.stage.duration", unit="ms", description="Duration of each pipeline stage and external call").record(duration_ms, {"stage": name, "error": error})
+
+def traced(name: str=None, **attributes):
+    """Decorator form of `span`, named after the function by default."""
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_tokens(stage: str, tokens: int, kind: str="prompt"):
+    """Count tokens sent to or received from a model, labelled by stage and kind."""
+    if OTEL_AVAILABLE and tokens:
+        _instrument("create_counter", "qna.tokens", unit="{token}", description="Tokens processed per stage").add(tokens, {"stage": stage, "kind": kind})
+
+def record_cache(cache: str, hit: bool, count: int=1):
+    """Count cache lookups, labelled by cache name and hit/miss."""
+    if OTEL_AVAILABLE and count:
+        _instrument("create_counter", "qna.cache.lookups", description="Cache lookups by result").add(count, {"cache": cache, "result": "hit" if hit else "miss"})
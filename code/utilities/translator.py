@@ -1,39 +1,185 @@
 import os, requests, urllib
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from redis.exceptions import RedisError
+from utilities.redisembeddings import get_redis_conn
+from utilities.tracing import span, record_cache
 
-def translate(text, language='en'):
-    endpoint_detect = os.environ['TRANSLATE_ENDPOINT'] + "/detect?api-version=3.0"
-    headers = {
+logger = logging.getLogger(__name__)
+
+# Translator v3 request limits
+DETECT_MAX_ELEMENTS = 100
+TRANSLATE_MAX_ELEMENTS = 1000
+MAX_CHARS_PER_REQUEST = 50000
+
+TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', 4096))
+TRANSLATION_CACHE_TTL = int(os.getenv('TRANSLATION_CACHE_TTL', 7 * 24 * 3600))
+TRANSLATION_REDIS_CACHE = os.getenv('TRANSLATION_REDIS_CACHE', 'true').lower() == 'true'
+LANGUAGES_TTL = int(os.getenv('TRANSLATE_LANGUAGES_TTL', 24 * 3600))
+
+class _LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_translation_cache = _LRUCache(TRANSLATION_CACHE_SIZE)
+_languages_cache = {"value": None, "expires": 0.0}
+_languages_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def get_session() -> requests.Session:
+    # One pooled session per process, reused by every Translator call
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _headers():
+    return {
         'Ocp-Apim-Subscription-Key': os.environ['TRANSLATE_KEY'],
         'Ocp-Apim-Subscription-Region': os.environ['TRANSLATE_REGION'],
         'Content-type': 'application/json'
     }
-    params = urllib.parse.urlencode({})
-    body = [{
-        'text': text
-    }]
-    request = requests.post(endpoint_detect, params=params, headers=headers, json=body)
-    response = request.json()
-    if (response[0]['language'] != language):
-        endpoint_translate = os.environ['TRANSLATE_ENDPOINT'] + "/translate?api-version=3.0"
-        params = urllib.parse.urlencode({
-            'api-version': '3.0',
-            'from': response[0]['language'],
-            'to': language
-        })
-        body = [{
-            'text': text
-        }]
-        request = requests.post(endpoint_translate, params=params, headers=headers, json=body)
-        response = request.json()
-        return response[0]['translations'][0]['text']
-    else:
-        return text
-    
+
+def _cache_key(text, language):
+    return f"translation:{language}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+def _batches(texts, max_elements):
+    # Split texts into requests that respect the element and character limits
+    batch, chars = [], 0
+    for text in texts:
+        if batch and (len(batch) >= max_elements or chars + len(text) > MAX_CHARS_PER_REQUEST):
+            yield batch
+            batch, chars = [], 0
+        batch.append(text)
+        chars += len(text)
+    if batch:
+        yield batch
+
+def _cache_lookup(texts, language):
+    found = {}
+    missing = []
+    for text in texts:
+        cached = _translation_cache.get(_cache_key(text, language))
+        if cached is None:
+            missing.append(text)
+        else:
+            found[text] = cached
+    if missing and TRANSLATION_REDIS_CACHE:
+        try:
+            values = get_redis_conn().mget([_cache_key(text, language) for text in missing])
+            for text, value in zip(missing, values):
+                if value is not None:
+                    value = value.decode('utf-8')
+                    found[text] = value
+                    _translation_cache.put(_cache_key(text, language), value)
+            missing = [text for text in missing if text not in found]
+        except RedisError as e:
+            logger.warning(f"Translation cache unavailable in Redis: {e}")
+    return found, missing
+
+def _cache_store(translations, language):
+    for text, translated in translations.items():
+        _translation_cache.put(_cache_key(text, language), translated)
+    if translations and TRANSLATION_REDIS_CACHE:
+        try:
+            pipe = get_redis_conn().pipeline(transaction=False)
+            for text, translated in translations.items():
+                pipe.set(_cache_key(text, language), translated, ex=TRANSLATION_CACHE_TTL)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Translation cache unavailable in Redis: {e}")
+
+def detect_batch(texts):
+    endpoint_detect = os.environ['TRANSLATE_ENDPOINT'] + "/detect?api-version=3.0"
+    languages = []
+    for batch in _batches(texts, DETECT_MAX_ELEMENTS):
+        with span("translator.detect", texts=len(batch)):
+            request = get_session().post(endpoint_detect, headers=_headers(), json=[{'text': text} for text in batch])
+            request.raise_for_status()
+        languages += [item['language'] for item in request.json()]
+    return languages
+
+def translate_batch(texts, language='en', source=None):
+    """Translate a list of texts into `language`, returning them in the same order.
+
+    Texts already in the target language are returned unchanged. Lookups go to the
+    in-process LRU first, then Redis; the rest is detected (unless `source` is given)
+    and translated in as few requests as the Translator array limits allow.
+    """
+    with span("translator.translate_batch", texts=len(texts), target=language) as current:
+        unique = list(dict.fromkeys(texts))
+        found, missing = _cache_lookup(unique, language)
+        record_cache("translation", True, len(unique) - len(missing))
+        record_cache("translation", False, len(missing))
+        current.set_attribute("cache_hits", len(unique) - len(missing))
+
+        if missing:
+            by_source = {}
+            sources = [source] * len(missing) if source else detect_batch(missing)
+            for text, text_source in zip(missing, sources):
+                by_source.setdefault(text_source, []).append(text)
+
+            translations = {}
+            endpoint_translate = os.environ['TRANSLATE_ENDPOINT'] + "/translate?api-version=3.0"
+            for text_source, source_texts in by_source.items():
+                if text_source == language:
+                    translations.update({text: text for text in source_texts})
+                    continue
+                params = urllib.parse.urlencode({
+                    'api-version': '3.0',
+                    'from': text_source,
+                    'to': language
+                })
+                for batch in _batches(source_texts, TRANSLATE_MAX_ELEMENTS):
+                    with span("translator.translate", texts=len(batch), source=text_source, target=language):
+                        request = get_session().post(endpoint_translate, params=params, headers=_headers(), json=[{'text': text} for text in batch])
+                        request.raise_for_status()
+                    for text, item in zip(batch, request.json()):
+                        translations[text] = item['translations'][0]['text']
+            _cache_store(translations, language)
+            found.update(translations)
+
+    return [found[text] for text in texts]
+
+def translate(text, language='en', source=None):
+    return translate_batch([text], language, source=source)[0]
 
 def get_available_languages():
-    r = requests.get("https://api.cognitive.microsofttranslator.com/languages?api-version=3.0&scope=translation")
-    # languages = sorted([{v['name']: k} for k,v in r.json()['translation'].items()], key=lambda x: list(x.keys())[0])
-    languages = {}
-    for k,v  in r.json()['translation'].items():
-        languages[v['name']] =  k
-    return languages
\ No newline at end of file
+    with _languages_lock:
+        if _languages_cache['value'] is not None and time.time() < _languages_cache['expires']:
+            return _languages_cache['value']
+        endpoint = os.getenv('TRANSLATE_ENDPOINT', 'https://api.cognitive.microsofttranslator.com')
+        r = get_session().get(endpoint + "/languages?api-version=3.0&scope=translation")
+        r.raise_for_status()
+        # languages = sorted([{v['name']: k} for k,v in r.json()['translation'].items()], key=lambda x: list(x.keys())[0])
+        languages = {}
+        for k,v  in r.json()['translation'].items():
+            languages[v['name']] =  k
+        _languages_cache.update(value=languages, expires=time.time() + LANGUAGES_TTL)
+        return languages
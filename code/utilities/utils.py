@@ -1,13 +1,18 @@
-import pandas as pd
 import numpy as np
 import openai
-import os, io, zipfile
+import os
 from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
-from utilities.redisembeddings import execute_query, get_documents, set_document
-from utilities.formrecognizer import analyze_read
-from utilities.azureblobstorage import upload_file, upsert_blob_metadata
+from utilities.redisembeddings import execute_query, execute_queries, get_documents, set_document, get_language_counts, get_redis_conn, SearchResults, get_index_state
+from utilities.langdetect import detect_language
+from utilities.translator import translate
+from utilities.tracing import span, traced, record_tokens
+from utilities.ratelimit import get_rate_limiter
+from utilities.singleflight import SingleFlight
+from utilities.embeddingmodels import get_local_model, is_local
+from utilities.dedup import DEDUP_QUERY, DEDUP_QUERY_OVERFETCH, check_chunk, link_duplicate, collapse
 import tiktoken
 import logging
+import threading
 import time
 import re
 
@@ -15,25 +20,120 @@ import re
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Intervalo mínimo (segundos) entre verificaciones de salud de OpenAI
+OPENAI_HEALTHCHECK_INTERVAL = int(os.getenv('OPENAI_HEALTHCHECK_INTERVAL', 300))
+
+_openai_config = None
+_init_lock = threading.Lock()
+_health_lock = threading.Lock()
+_health_thread = None
+_health_wakeup = threading.Event()
+_health_stop = threading.Event()
+_health_state = {"healthy": None, "checked_at": None, "models": None, "error": None}
+
 # Inicializa la conexión con la API de OpenAI
-def initialize(engine='gpt-35-turbo-instruct'):
+def initialize(engine='gpt-35-turbo-instruct', force=False):
+    """
+    Configura los parámetros de conexión a la API de Azure OpenAI una vez por proceso
+    y programa la verificación de credenciales en segundo plano
+    """
+    global _openai_config
+    api_base = os.getenv('OPENAI_API_BASE')  # URL del endpoint
+    api_version = os.getenv("OPENAI_API_VERSION", "2024-05-01-preview")  # Versión actualizada
+    api_key = os.getenv("OPENAI_API_KEY")  # Clave de API
+
+    # Falla rápido si falta configuración, sin llamar a la API
+    if not api_base or not api_key:
+        logger.error("Error inicializando OpenAI: faltan OPENAI_API_BASE u OPENAI_API_KEY")
+        with _health_lock:
+            _health_state.update(healthy=False, checked_at=time.time(), models=None, error="Configuración incompleta")
+        return False
+
+    config = (api_base, api_version, api_key)
+    changed = False
+    with _init_lock:
+        if force or config != _openai_config:
+            openai.api_type = "azure"
+            openai.api_base = api_base
+            openai.api_version = api_version
+            openai.api_key = api_key
+            # Una configuración nueva invalida el estado de salud anterior
+            if config != _openai_config:
+                with _health_lock:
+                    _health_state.update(healthy=None, checked_at=None, models=None, error=None)
+                changed = True
+            _openai_config = config
+
+    _schedule_health_check(now=changed)
+    return _health_state['healthy'] is not False
+
+# Verifica la conexión con OpenAI listando los modelos disponibles
+def check_openai_health():
     """
-    Configura los parámetros de conexión a la API de Azure OpenAI
-    con verificación de credenciales
+    Ejecuta la verificación de salud de forma síncrona
+    y actualiza el estado en caché
     """
     try:
-        openai.api_type = "azure"
-        openai.api_base = os.getenv('OPENAI_API_BASE')  # URL del endpoint
-        openai.api_version = os.getenv("OPENAI_API_VERSION", "2024-05-01-preview")  # Versión actualizada
-        openai.api_key = os.getenv("OPENAI_API_KEY")  # Clave de API
-        
-        # Verificar conexión
-        models = openai.Model.list()
+        with span("openai.models.list"):
+            models = openai.Model.list()
         logger.info(f"Conexión exitosa con OpenAI. Modelos disponibles: {len(models.data)}")
-        return True
+        state = {"healthy": True, "checked_at": time.time(), "models": len(models.data), "error": None}
     except Exception as e:
         logger.error(f"Error inicializando OpenAI: {str(e)}")
-        return False
+        state = {"healthy": False, "checked_at": time.time(), "models": None, "error": str(e)}
+    with _health_lock:
+        _health_state.update(state)
+    return state['healthy']
+
+# Repite la verificación de salud cada OPENAI_HEALTHCHECK_INTERVAL segundos
+def _health_loop(stop):
+    """
+    Bucle del hilo de salud; se despierta antes de tiempo
+    cuando cambia la configuración de OpenAI y termina cuando se activa stop
+    """
+    while not stop.is_set():
+        _health_wakeup.clear()
+        check_openai_health()
+        _health_wakeup.wait(OPENAI_HEALTHCHECK_INTERVAL)
+
+# Arranca el hilo de salud una vez por proceso, o adelanta la próxima verificación
+def _schedule_health_check(now=False):
+    """
+    El hilo vive con el proceso, así que sigue verificando aunque initialize
+    no se vuelva a llamar (p. ej. cacheado por st.experimental_singleton)
+    """
+    global _health_thread, _health_stop
+    with _health_lock:
+        if _health_thread is None or not _health_thread.is_alive():
+            # Cada hilo tiene su propio evento de parada, así un hilo anterior que aún termina no se reactiva
+            _health_stop = threading.Event()
+            _health_thread = threading.Thread(target=_health_loop, args=(_health_stop,), name="openai-healthcheck", daemon=True)
+            _health_thread.start()
+        elif now:
+            _health_wakeup.set()
+
+# Detiene el hilo de salud
+def shutdown_health_check(timeout=5):
+    """
+    Para el hilo de verificación y espera a que termine (p. ej. al final de las pruebas);
+    el siguiente initialize lo vuelve a arrancar
+    """
+    global _health_thread
+    with _health_lock:
+        thread, _health_thread = _health_thread, None
+        _health_stop.set()
+        _health_wakeup.set()
+    if thread is not None:
+        thread.join(timeout)
+
+# Devuelve el último estado de salud conocido de OpenAI
+def get_health_state():
+    """
+    Devuelve una copia del estado de salud en caché:
+    healthy (True/False/None si aún no se ha verificado), checked_at, models y error
+    """
+    with _health_lock:
+        return dict(_health_state)
 
 # Calcula la similitud coseno entre dos vectores
 def cosine_similarity(a, b):
@@ -49,74 +149,219 @@ def cosine_similarity(a, b):
         
     return np.dot(a, b) / (norm_a * norm_b)
 
-# Búsqueda semántica usando Redis
-def search_semantic_redis(search_query, n=3, pprint=True):
+# Modo de idioma para las consultas: 'off' (embedding directo) o 'route' (detección local y etiquetas por idioma)
+QUERY_LANGUAGE_MODE = os.getenv('QUERY_LANGUAGE_MODE', 'off').lower()
+CORPUS_LANGUAGES_TTL = int(os.getenv('CORPUS_LANGUAGES_TTL', 300))
+
+_corpus_languages = {"value": None, "expires": 0.0}
+_corpus_languages_lock = threading.Lock()
+
+# Obtiene los idiomas presentes en el corpus con caché temporal
+def get_corpus_languages():
     """
-    Realiza una búsqueda semántica usando Redis como backend
-    con manejo de errores robusto
+    Devuelve el número de chunks por idioma del corpus,
+    consultando Redis como máximo una vez cada CORPUS_LANGUAGES_TTL segundos
+    """
+    with _corpus_languages_lock:
+        if _corpus_languages['value'] is None or time.time() >= _corpus_languages['expires']:
+            _corpus_languages.update(value=get_language_counts(), expires=time.time() + CORPUS_LANGUAGES_TTL)
+        return _corpus_languages['value']
+
+# Decide el texto y el filtro de idioma con los que se busca una consulta
+@traced("qna.language_route")
+def route_query_language(search_query):
     """
+    Detecta el idioma de la consulta sin llamadas de red. Si el corpus tiene ese idioma
+    se filtra por su etiqueta; si no, se traduce (con caché) al idioma mayoritario del corpus
+    """
+    language = detect_language(search_query)
+    if not language:
+        return search_query, "*"
+    try:
+        corpus_languages = get_corpus_languages()
+    except Exception as e:
+        logger.warning(f"No se pudieron obtener los idiomas del corpus: {str(e)}")
+        return search_query, "*"
+    if not corpus_languages:
+        return search_query, "*"
+    if language in corpus_languages:
+        return search_query, f"@language:{{{language}}}"
+
+    target = max(corpus_languages, key=corpus_languages.get)
     try:
-        # Obtiene embedding de la consulta
-        embedding = get_embedding(search_query, engine=get_embeddings_model()['query'])
+        translated = translate(search_query, target, source=language)
+        logger.info(f"Consulta traducida de {language} a {target}")
+        return translated, f"@language:{{{target}}}"
+    except Exception as e:
+        logger.warning(f"Error traduciendo la consulta, se busca sin filtro de idioma: {str(e)}")
+        return search_query, "*"
+
+# Llamadas idénticas simultáneas comparten una sola solicitud
+_embedding_flight = SingleFlight("embedding", shared=True)
+_search_flight = SingleFlight("search")
+_completion_flight = SingleFlight("completion", shared=True)
+
+# Resultados pedidos a Redis para devolver n sin casi duplicados
+def _fetch_size(n):
+    return n * DEDUP_QUERY_OVERFETCH if DEDUP_QUERY else n
+
+# Quita los casi duplicados de una búsqueda y la recorta a n resultados
+def _collapse_results(res, n):
+    """
+    Conserva el mejor resultado de cada grupo de pasajes casi idénticos,
+    en el orden de la búsqueda
+    """
+    if not DEDUP_QUERY:
+        return res
+    return SearchResults(collapse(res, redis_conn=get_redis_conn())[:n], error=res.error)
+
+# Ejecuta una búsqueda semántica (embedding de la consulta y KNN en Redis)
+def _search_redis(search_query, n, language_mode, ef_runtime):
+    """
+    Obtiene el embedding de la consulta y lanza la búsqueda KNN,
+    sin filtro de idioma si la búsqueda filtrada no devuelve nada
+    """
+    with span("qna.search", k=n) as current:
+        filter_expression = "*"
+        if language_mode == 'route':
+            search_query, filter_expression = route_query_language(search_query)
+            current.set_attribute("language_filter", filter_expression)
+
+        # Obtiene embedding de la consulta con el modelo del índice activo
+        index = get_index_state()[0]
+        embedding = get_embedding(search_query, engine=index.query_model)
         
         # Ejecuta la consulta en Redis
         start_time = time.time()
-        res = execute_query(np.array(embedding), n_results=n)
+        fetch = _fetch_size(n)
+        res = execute_query(np.array(embedding), number_of_results=fetch, filter_expression=filter_expression, ef_runtime=ef_runtime, index=index)
+        if filter_expression != "*" and len(res) == 0:
+            # Chunks ingested before the language tag existed are only reachable without filter
+            res = execute_query(np.array(embedding), number_of_results=fetch, ef_runtime=ef_runtime, index=index)
+        res = _collapse_results(res, n)
         duration = time.time() - start_time
+        current.set_attribute("results", len(res))
+    
+    logger.info(f"Búsqueda semántica completada en {duration:.2f}s. Resultados: {len(res)}")
+    return res
+
+# Búsqueda semántica usando Redis
+def search_semantic_redis(search_query, n=3, pprint=True, language_mode=None, ef_runtime=None):
+    """
+    Realiza una búsqueda semántica usando Redis como backend
+    con manejo de errores robusto; las búsquedas idénticas simultáneas se hacen una vez
+    """
+    try:
+        language_mode = language_mode or QUERY_LANGUAGE_MODE
+        res = _search_flight.do((search_query, n, language_mode, ef_runtime),
+                                lambda: _search_redis(search_query, n, language_mode, ef_runtime))
         
-        logger.info(f"Búsqueda semántica completada en {duration:.2f}s. Resultados: {len(res)}")
-        
-        if pprint and res:
+        if pprint and len(res):
             for doc in res[:3]:
-                preview = doc['text'][:200].replace('\n', ' ')
-                logger.info(f"Documento: {doc['filename']} | Preview: {preview}...")
+                preview = doc.text[:200].replace('\n', ' ')
+                logger.info(f"Documento: {doc.filename} | Preview: {preview}...")
                 
         return res
     except Exception as e:
         logger.error(f"Error en búsqueda semántica: {str(e)}")
-        return []
+        return SearchResults(error=str(e))
 
-# Obtiene una respuesta semántica usando el modelo de OpenAI
-def get_semantic_answer(question, explicit_prompt="", model="gpt-35-turbo-instruct", tokens_response=400, temperature=0.0):
+# Búsqueda semántica de muchas consultas a la vez
+def search_semantic_redis_batch(queries, n=3, language_mode=None, ef_runtime=None):
     """
-    Genera una respuesta a una pregunta usando contexto relevante
-    con manejo de errores y optimización de prompt
+    Obtiene los embeddings de todas las consultas en lotes y lanza las búsquedas KNN
+    en pipelines de Redis; devuelve un resultado por consulta, en el mismo orden
     """
     try:
-        start_time = time.time()
-        
-        # Paso 1: Buscar documentos relevantes en Redis
-        res = search_semantic_redis(question, n=3, pprint=False)
-        
-        # Paso 2: Construir el prompt
-        if not res:
+        with span("qna.search_batch", k=n, queries=len(queries)) as current:
+            filters = ["*"] * len(queries)
+            if (language_mode or QUERY_LANGUAGE_MODE) == 'route':
+                routed = [route_query_language(query) for query in queries]
+                queries = [query for query, _ in routed]
+                filters = [filter_expression for _, filter_expression in routed]
+
+            index = get_index_state()[0]
+            embeddings = get_embeddings(queries, engine=index.query_model)
+            # Las consultas sin embedding (vacías) no se buscan
+            searchable = [i for i, embedding in enumerate(embeddings) if embedding]
+            results = [SearchResults() for _ in queries]
+            frames = execute_queries([np.array(embeddings[i]) for i in searchable], number_of_results=_fetch_size(n), filter_expressions=[filters[i] for i in searchable], ef_runtime=ef_runtime, index=index)
+            for i, frame in zip(searchable, frames):
+                results[i] = frame
+
+            # Chunks ingested before the language tag existed are only reachable without filter
+            retry_ids = [i for i in searchable if filters[i] != "*" and len(results[i]) == 0]
+            if retry_ids:
+                for i, frame in zip(retry_ids, execute_queries([np.array(embeddings[i]) for i in retry_ids], number_of_results=_fetch_size(n), ef_runtime=ef_runtime, index=index)):
+                    results[i] = frame
+            results = [_collapse_results(res, n) for res in results]
+            current.set_attribute("empty", sum(1 for res in results if len(res) == 0))
+        return results
+    except Exception as e:
+        logger.error(f"Error en búsqueda semántica por lotes: {str(e)}")
+        return [SearchResults(error=str(e)) for _ in queries]
+
+# Registra en la traza el uso de tokens informado por OpenAI
+def _record_usage(current_span, stage, response):
+    usage = response.get("usage") if response else None
+    if not usage:
+        return
+    current_span.set_attribute("prompt_tokens", usage.get("prompt_tokens", 0))
+    current_span.set_attribute("completion_tokens", usage.get("completion_tokens", 0))
+    record_tokens(stage, usage.get("prompt_tokens", 0), "prompt")
+    record_tokens(stage, usage.get("completion_tokens", 0), "completion")
+
+# Construye el prompt de QnA a partir de los chunks recuperados
+def build_qna_prompt(question, res, explicit_prompt="", n_chunks=None):
+    """
+    Combina los n_chunks primeros resultados (NUMBER_OF_EMBEDDINGS_FOR_QNA por defecto)
+    con la pregunta y devuelve el prompt y la lista de fuentes
+    """
+    with span("qna.prompt_build") as current:
+        if len(res) == 0:
             prompt = f"{question}"
             source_files = ['No se encontraron fuentes']
             logger.warning("No se encontraron documentos relevantes para la pregunta")
         else:
             # Combinar textos relevantes
-            n_chunks = min(int(os.getenv("NUMBER_OF_EMBEDDINGS_FOR_QNA", 3)), len(res))
-            res_text = "\n\n".join([doc['text'] for doc in res[:n_chunks]])
+            n_chunks = min(n_chunks or int(os.getenv("NUMBER_OF_EMBEDDINGS_FOR_QNA", 3)), len(res))
+            top_docs = res[:n_chunks]
+            res_text = "\n\n".join([doc.text for doc in top_docs])
             
             # Obtener nombres de archivos fuente
-            source_files = "Fuentes:\n" + "\n".join([f"- {doc['filename']}" for doc in res[:n_chunks]])
+            source_files = "Fuentes:\n" + "\n".join([f"- {doc.filename}" for doc in top_docs])
             
             # Preparar el prompt con la pregunta
             question_prompt = explicit_prompt.replace(r'\n', '\n').replace("_QUESTION_", question)
             prompt = f"Contexto:\n{res_text}\n\n---\n\n{question_prompt}"
+        current.set_attribute("prompt_chars", len(prompt))
+    return prompt, source_files
+
+# Obtiene una respuesta semántica usando el modelo de OpenAI
+@traced("qna.answer")
+def get_semantic_answer(question, explicit_prompt="", model="gpt-35-turbo-instruct", tokens_response=400, temperature=0.0):
+    """
+    Genera una respuesta a una pregunta usando contexto relevante
+    con manejo de errores y optimización de prompt
+    """
+    try:
+        start_time = time.time()
+        
+        # Paso 1: Buscar documentos relevantes en Redis
+        res = search_semantic_redis(question, n=3, pprint=False)
+        
+        # Paso 2: Construir el prompt
+        prompt, source_files = build_qna_prompt(question, res, explicit_prompt)
         
         # Paso 3: Llamar a la API de OpenAI
         logger.info(f"Enviando prompt a OpenAI ({len(prompt)} caracteres)...")
-        response = openai.Completion.create(
-            engine=model,
-            prompt=prompt,
-            temperature=temperature,
-            max_tokens=tokens_response,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None
-        )
+        if temperature == 0:
+            # Con temperatura 0 la respuesta es determinista: las preguntas idénticas simultáneas comparten la llamada
+            response = openai.util.convert_to_openai_object(_completion_flight.do(
+                (model, prompt, tokens_response),
+                lambda: _answer_completion(prompt, model, tokens_response, temperature)))
+        else:
+            response = _answer_completion(prompt, model, tokens_response, temperature)
         
         # Paso 4: Procesar la respuesta
         if response and response.choices:
@@ -142,14 +387,61 @@ def get_semantic_answer(question, explicit_prompt="", model="gpt-35-turbo-instru
         logger.error(f"Error inesperado: {str(e)}")
         raise
 
+# Obtiene una respuesta semántica en streaming
+def stream_semantic_answer(question, explicit_prompt="", model="gpt-35-turbo-instruct", tokens_response=400, temperature=0.0):
+    """
+    Igual que get_semantic_answer, pero devuelve el prompt, las fuentes y un generador
+    con los fragmentos de la respuesta a medida que los envía OpenAI
+    """
+    res = search_semantic_redis(question, n=3, pprint=False)
+    prompt, source_files = build_qna_prompt(question, res, explicit_prompt)
+
+    get_rate_limiter(model).acquire(get_token_count(prompt) + tokens_response)
+    with span("openai.completion", engine=model, max_tokens=tokens_response, stream=True):
+        response = openai.Completion.create(
+            engine=model,
+            prompt=prompt,
+            temperature=temperature,
+            max_tokens=tokens_response,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stop=None,
+            stream=True
+        )
+
+    def fragments():
+        for chunk in response:
+            if chunk.get("choices"):
+                yield chunk["choices"][0].get("text", "")
+    return prompt, source_files, fragments()
+
+# Llama al modelo de completado para la respuesta de QnA
+def _answer_completion(prompt, model, tokens_response, temperature):
+    get_rate_limiter(model).acquire(get_token_count(prompt) + tokens_response)
+    with span("openai.completion", engine=model, max_tokens=tokens_response) as current:
+        response = openai.Completion.create(
+            engine=model,
+            prompt=prompt,
+            temperature=temperature,
+            max_tokens=tokens_response,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stop=None
+        )
+        _record_usage(current, "openai.completion", response)
+    return response
+
 # Obtiene embeddings para un texto con reintentos automáticos
 @retry(wait=wait_random_exponential(min=1, max=30), stop=stop_after_attempt(8), 
-       retry=retry_if_exception_type(openai.error.APIError))
-def get_embedding(text: str, engine="text-embedding-ada-002") -> list[float]:
+       retry=retry_if_exception_type((openai.error.APIError, openai.error.RateLimitError)))
+def get_embedding(text: str, engine=None) -> list[float]:
     """
     Obtiene el embedding vectorial para un texto con manejo robusto de errores
-    y validación de entrada
+    y validación de entrada; por defecto con el modelo de documentos del índice activo
     """
+    engine = engine or get_embeddings_model()['doc']
     try:
         # Validar y limpiar texto
         if not text or len(text.strip()) < 3:
@@ -157,22 +449,16 @@ def get_embedding(text: str, engine="text-embedding-ada-002") -> list[float]:
             return []
             
         text = clean_text(text)
-        token_count = len(tiktoken.get_encoding('cl100k_base').encode(text))
+        with span("tokenize", chars=len(text)):
+            token_count = len(tiktoken.get_encoding('cl100k_base').encode(text))
         
         # Manejar textos demasiado largos
         if token_count > 8191:
             logger.warning(f"Texto demasiado largo ({token_count} tokens), truncando")
             text = text[:8000]  # Simple truncamiento para casos extremos
             
-        logger.info(f"Solicitando embedding para {token_count} tokens")
-        
-        # Obtener embedding con tiempo de espera
-        response = openai.Embedding.create(
-            input=[text],
-            engine=engine
-        )
-        
-        return response["data"][0]["embedding"]
+        # Los textos idénticos pedidos a la vez (misma pregunta, chunks repetidos) comparten la solicitud
+        return _embedding_flight.do((engine, text), lambda: _request_embedding(text, engine, token_count))
         
     except openai.error.InvalidRequestError as e:
         logger.error(f"Error en solicitud: {str(e)}")
@@ -181,6 +467,72 @@ def get_embedding(text: str, engine="text-embedding-ada-002") -> list[float]:
         logger.error(f"Error obteniendo embedding: {str(e)}")
         raise
 
+# Solicita el embedding de un texto ya limpio a OpenAI o al modelo local
+def _request_embedding(text, engine, token_count):
+    if is_local(engine):
+        return get_local_model(engine).embed_one(text)
+
+    logger.info(f"Solicitando embedding para {token_count} tokens")
+    
+    get_rate_limiter(engine).acquire(token_count)
+
+    # Obtener embedding con tiempo de espera
+    with span("openai.embedding", engine=engine, tokens=token_count):
+        response = openai.Embedding.create(
+            input=[text],
+            engine=engine
+        )
+    record_tokens("openai.embedding", token_count)
+    
+    return response["data"][0]["embedding"]
+
+# Textos por solicitud de embeddings (límite de entradas de la implementación de Azure OpenAI)
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 16))
+
+# Obtiene embeddings para varios textos con una solicitud por lote
+@retry(wait=wait_random_exponential(min=1, max=30), stop=stop_after_attempt(8), 
+       retry=retry_if_exception_type((openai.error.APIError, openai.error.RateLimitError)))
+def _embed_batch(texts, engine, token_count):
+    get_rate_limiter(engine).acquire(token_count)
+    with span("openai.embedding", engine=engine, tokens=token_count, texts=len(texts)):
+        response = openai.Embedding.create(input=texts, engine=engine)
+    record_tokens("openai.embedding", token_count)
+    return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+def get_embeddings(texts, engine=None, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Obtiene los embeddings de una lista de textos en el mismo orden, agrupando
+    hasta batch_size textos por solicitud; los textos vacíos devuelven []
+    """
+    engine = engine or get_embeddings_model()['doc']
+    encoding = tiktoken.get_encoding('cl100k_base')
+    embeddings = [[] for _ in texts]
+    pending = []
+    for i, text in enumerate(texts):
+        if not text or len(text.strip()) < 3:
+            continue
+        text = clean_text(text)
+        tokens = encoding.encode(text)
+        if len(tokens) > 8191:
+            logger.warning(f"Texto demasiado largo ({len(tokens)} tokens), truncando")
+            tokens = tokens[:8191]
+            text = encoding.decode(tokens)
+        pending.append((i, text, len(tokens)))
+
+    if is_local(engine) and pending:
+        # El modelo local agrupa por su cuenta (LOCAL_EMBEDDINGS_BATCH_SIZE)
+        vectors = get_local_model(engine).embed([text for _, text, _ in pending])
+        for (i, _, _), vector in zip(pending, vectors):
+            embeddings[i] = vector.tolist()
+        return embeddings
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors = _embed_batch([text for _, text, _ in batch], engine, sum(count for _, _, count in batch))
+        for (i, _, _), vector in zip(batch, vectors):
+            embeddings[i] = vector
+    return embeddings
+
 # Limpia texto para procesamiento
 def clean_text(text: str) -> str:
     """
@@ -196,7 +548,33 @@ def clean_text(text: str) -> str:
     # Eliminar espacios al inicio/final
     return text.strip()
 
+# Divide un texto largo en partes que caben en un embedding
+def split_text(text: str, filename="", max_tokens=3000, chunk_size=2000):
+    """
+    Devuelve una lista de pares (texto, nombre); los textos de más de max_tokens
+    tokens se dividen en partes de chunk_size tokens con el sufijo _part_N
+    """
+    text = clean_text(text)
+    if not text:
+        return []
+    
+    # Calcular tokens
+    encoding = tiktoken.get_encoding('cl100k_base')
+    tokens = encoding.encode(text)
+    token_count = len(tokens)
+    if token_count <= max_tokens:
+        return [(text, filename)]
+    
+    logger.info(f"Dividiendo texto largo ({token_count} tokens)")
+    parts = []
+    for i in range(0, token_count, chunk_size):
+        chunk_text = clean_text(encoding.decode(tokens[i:i+chunk_size]))
+        if chunk_text:
+            parts.append((chunk_text, f"{filename}_part_{i//chunk_size}"))
+    return parts
+
 # Procesa y genera embeddings para un texto
+@traced("ingest.chunk_and_embed")
 def chunk_and_embed(text: str, filename=""):
     """
     Divide un texto en chunks y genera embeddings
@@ -205,53 +583,58 @@ def chunk_and_embed(text: str, filename=""):
     try:
         logger.info(f"Procesando documento: {filename}")
         
-        # Limpiar y validar texto
-        text = clean_text(text)
-        if not text:
+        # Limpiar, validar y dividir texto
+        parts = split_text(text, filename)
+        if not parts:
             logger.warning("Texto vacío después de limpieza")
             return None
         
-        # Calcular tokens
-        encoding = tiktoken.get_encoding('cl100k_base')
-        tokens = encoding.encode(text)
-        token_count = len(tokens)
+        chunks = []
+        for part_text, part_filename in parts:
+            chunk = {"text": part_text, "filename": part_filename}
+            # Los casi duplicados de un chunk guardado no se envían a embeddings
+            if not check_chunk(chunk, get_redis_conn()):
+                embed_chunk(chunk)
+            chunks.append(chunk)
         
-        # Manejar textos largos dividiéndolos
-        if token_count > 3000:
-            logger.info(f"Dividiendo texto largo ({token_count} tokens)")
-            chunks = []
-            chunk_size = 2000  # Tokens por chunk
-            
-            for i in range(0, token_count, chunk_size):
-                chunk_text = encoding.decode(tokens[i:i+chunk_size])
-                chunk_text = clean_text(chunk_text)
-                
-                if not chunk_text:
-                    continue
-                    
-                embedding = get_embedding(chunk_text)
-                chunks.append({
-                    "text": chunk_text,
-                    "filename": f"{filename}_part_{i//chunk_size}",
-                    "embedding": embedding
-                })
-            
+        # Los textos largos devuelven una lista de chunks
+        if len(parts) > 1 or parts[0][1] != filename:
             logger.info(f"Texto dividido en {len(chunks)} chunks")
             return chunks
-            
-        # Texto normal
-        else:
-            embedding = get_embedding(text)
-            return {
-                "text": text,
-                "filename": filename,
-                "embedding": embedding
-            }
+        return chunks[0]
             
     except Exception as e:
         logger.error(f"Error en chunk_and_embed: {str(e)}")
         return None
 
+# Genera los embeddings de un chunk para cada versión del índice en uso
+def embed_chunk(item):
+    """
+    Calcula el embedding del índice activo y, durante una migración, el del índice
+    en construcción, para que los chunks nuevos lleguen a los dos; devuelve False si falla
+    """
+    active, building = get_index_state()
+    item["search_embeddings"] = get_embedding(item["text"], engine=active.doc_model)
+    if not item["search_embeddings"]:
+        return False
+    item["vectors"] = {active.field: item["search_embeddings"]}
+    if building is not None and building.field != active.field:
+        vector = get_embedding(item["text"], engine=building.doc_model)
+        if vector:
+            item["vectors"][building.field] = vector
+    return True
+
+# Guarda un chunk, o solo su enlace si es un casi duplicado
+def store_chunk(item):
+    """
+    Guarda el chunk con su embedding en Redis; un casi duplicado se guarda
+    como referencia sin vectores al chunk que repite (DEDUP_MODE=link) o se descarta
+    """
+    if item.get("duplicate_of"):
+        link_duplicate(item, get_redis_conn())
+    else:
+        set_document(item)
+
 # Añade embeddings a la base de datos
 def add_embeddings(text, filename):
     """
@@ -267,11 +650,11 @@ def add_embeddings(text, filename):
         # Manejar múltiples chunks
         if isinstance(embeddings, list):
             for item in embeddings:
-                set_document(item)
+                store_chunk(item)
             logger.info(f"Embeddings guardados ({len(embeddings)} chunks)")
             return True
         else:
-            set_document(embeddings)
+            store_chunk(embeddings)
             logger.info("Embedding guardado")
             return True
             
@@ -280,42 +663,21 @@ def add_embeddings(text, filename):
         return False
 
 # Procesa un archivo, lo convierte y genera embeddings
-def convert_file_and_add_embeddings(fullpath, filename):
+@traced("ingest.convert_file")
+def convert_file_and_add_embeddings(fullpath, filename, data=None):
     """
-    Convierte un archivo a texto, lo divide en chunks
-    y genera embeddings para cada chunk con manejo de errores
+    Convierte un archivo a texto (localmente si tiene capa de texto, si no con OCR),
+    lo divide en chunks y genera embeddings para cada chunk; data evita descargarlo
     """
+    # Importado aquí porque el pipeline usa las funciones de este módulo
+    from utilities.ingestion import ingest_document
     try:
         logger.info(f"Procesando archivo: {filename}")
         start_time = time.time()
         
-        # Paso 1: Extraer texto del archivo
-        text_chunks = analyze_read(fullpath)
-        if not text_chunks:
-            logger.error("No se pudo extraer texto del archivo")
-            return False
-            
-        # Paso 2: Crear archivo ZIP con los chunks de texto
-        zip_file = io.BytesIO()
-        with zipfile.ZipFile(zip_file, mode="w") as archive:
-            for i, chunk in enumerate(text_chunks):
-                archive.writestr(f"chunk_{i}.txt", chunk)
-        
-        # Paso 3: Subir ZIP a Azure Blob Storage
-        upload_file(zip_file.getvalue(), f"converted/{filename}.zip", content_type='application/zip')
-        upsert_blob_metadata(filename, {"converted": "true", "chunks": str(len(text_chunks))})
-        
-        # Paso 4: Procesar cada chunk de texto
-        total_chunks = 0
-        for i, chunk in enumerate(text_chunks):
-            # Limpiar y validar chunk
-            chunk = clean_text(chunk)
-            if not chunk:
-                continue
-                
-            # Procesar chunk
-            if add_embeddings(chunk, f"{filename}_chunk_{i}"):
-                total_chunks += 1
+        # Extracción, división, embeddings y guardado se solapan por etapas;
+        # el texto convertido se guarda fuera del camino crítico
+        total_chunks = ingest_document(fullpath, filename, data=data)
         
         # Registrar resultados
         duration = time.time() - start_time
@@ -329,21 +691,22 @@ def convert_file_and_add_embeddings(fullpath, filename):
 # Obtiene configuración de modelos de embeddings
 def get_embeddings_model():
     """
-    Obtiene los modelos de embeddings configurados
-    con valores por defecto seguros
+    Obtiene los modelos de embeddings del índice activo,
+    que tras una migración pueden no ser los configurados
     """
-    return {
-        "doc": os.getenv('OPENAI_EMBEDDINGS_ENGINE_DOC', 'text-embedding-ada-002'),
-        "query": os.getenv('OPENAI_EMBEDDINGS_ENGINE_QUERY', 'text-embedding-ada-002')
-    }
+    index = get_index_state()[0]
+    return {"doc": index.doc_model, "query": index.query_model}
 
-# Genera texto a partir de un prompt con manejo de errores
-def get_completion(prompt="", max_tokens=400, model="gpt-35-turbo-instruct"):
+# Genera texto a partir de un prompt respetando el límite de la implementación
+@retry(wait=wait_random_exponential(min=1, max=30), stop=stop_after_attempt(6),
+       retry=retry_if_exception_type((openai.error.APIError, openai.error.RateLimitError)))
+def create_completion(prompt="", max_tokens=400, model="gpt-35-turbo-instruct"):
     """
-    Genera texto de continuación para un prompt
-    con manejo de errores robusto
+    Genera texto de continuación para un prompt con reintentos;
+    propaga los errores para que el llamador decida qué hacer
     """
-    try:
+    get_rate_limiter(model).acquire(get_token_count(prompt) + max_tokens)
+    with span("openai.completion", engine=model, max_tokens=max_tokens) as current:
         response = openai.Completion.create(
             engine=model,
             prompt=prompt,
@@ -354,7 +717,17 @@ def get_completion(prompt="", max_tokens=400, model="gpt-35-turbo-instruct"):
             presence_penalty=0,
             stop=None
         )
-        return response.choices[0].text.strip() if response.choices else ""
+        _record_usage(current, "openai.completion", response)
+    return response.choices[0].text.strip() if response.choices else ""
+
+# Genera texto a partir de un prompt con manejo de errores
+def get_completion(prompt="", max_tokens=400, model="gpt-35-turbo-instruct"):
+    """
+    Genera texto de continuación para un prompt
+    con manejo de errores robusto
+    """
+    try:
+        return create_completion(prompt, max_tokens, model)
     except Exception as e:
         logger.error(f"Error en get_completion: {str(e)}")
         return ""
@@ -0,0 +1,91 @@
+"""
+Process-wide caches for the Streamlit pages.
+
+Streamlit serves every browser session from one process, so a DataFrame kept in
+st.session_state is held once per open tab. The pages use these helpers instead:
+
+- `initialize` configures OpenAI and creates the Redis indexes once per process.
+  The OpenAI health probe it starts runs in its own thread every
+  OPENAI_HEALTHCHECK_INTERVAL seconds, so caching the call does not stop it.
+- `get_documents` returns one shared copy of the stored chunks. It is reloaded
+  when the documents change counter in Redis moves (every ingest and delete
+  bumps it, from any process) or after WEBAPP_CACHE_TTL seconds.
+- `get_sources` returns the names of the stored documents, reloaded like
+  `get_documents`.
+- `list_files` caches catalogue pages, keyed by the catalogue change counter.
+
+The shared DataFrame must not be modified in place. Filtering or selecting
+columns returns a new frame and is fine.
+
+streamlit==1.17 has no st.cache_resource/st.cache_data yet, so this uses their
+predecessors, st.experimental_singleton and st.experimental_memo.
+"""
+import os
+import threading
+import time
+
+import streamlit as st
+
+from utilities import azureblobstorage, blobcatalog, redisembeddings, utils
+
+WEBAPP_CACHE_TTL = int(os.getenv('WEBAPP_CACHE_TTL', 300))
+WEBAPP_LISTING_CACHE_ENTRIES = int(os.getenv('WEBAPP_LISTING_CACHE_ENTRIES', 64))
+
+class SharedValue:
+    """A value shared by all sessions, reloaded when `version()` changes or it is older than `ttl` seconds."""
+
+    def __init__(self, load, version, ttl: int=WEBAPP_CACHE_TTL):
+        self._load = load
+        self._version = version
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_version = None
+        self._loaded_at = 0.0
+
+    def get(self):
+        version = self._version()
+        with self._lock:
+            # Sessions that arrive during a reload wait for it instead of loading again
+            if self._value is None or version != self._loaded_version or time.monotonic() - self._loaded_at > self.ttl:
+                self._value = self._load()
+                self._loaded_version = version
+                self._loaded_at = time.monotonic()
+            return self._value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+
+@st.experimental_singleton(show_spinner=False)
+def initialize(engine: str='gpt-35-turbo-instruct') -> None:
+    """utils.initialize and ensure_indexes, once per process and engine."""
+    utils.initialize(engine=engine)
+    redisembeddings.ensure_indexes()
+
+@st.experimental_singleton(show_spinner=False)
+def _documents() -> SharedValue:
+    return SharedValue(redisembeddings.get_documents, redisembeddings.documents_version)
+
+def get_documents():
+    """Every stored chunk as a DataFrame (id, text, filename), shared by all sessions."""
+    return _documents().get()
+
+def invalidate_documents() -> None:
+    _documents().invalidate()
+
+@st.experimental_singleton(show_spinner=False)
+def _sources() -> SharedValue:
+    return SharedValue(redisembeddings.get_sources, redisembeddings.documents_version)
+
+def get_sources() -> list:
+    """Original file names of the stored documents, shared by all sessions."""
+    return _sources().get()
+
+@st.experimental_memo(ttl=WEBAPP_CACHE_TTL, max_entries=WEBAPP_LISTING_CACHE_ENTRIES, show_spinner=False)
+def _list_files(version, offset, limit, search, converted, embeddings_added, sort_by, ascending):
+    return azureblobstorage.list_files(offset, limit, search=search, converted=converted, embeddings_added=embeddings_added, sort_by=sort_by, ascending=ascending)
+
+def list_files(offset=0, limit=50, search=None, converted=None, embeddings_added=None, sort_by="name", ascending=True):
+    """azureblobstorage.list_files, cached until the catalogue changes."""
+    return _list_files(blobcatalog.catalog_version(), offset, limit, search, converted, embeddings_added, sort_by, ascending)